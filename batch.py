@@ -0,0 +1,236 @@
+"""
+Traitement en lot des tempêtes de référence (sans Streamlit)
+
+Pour chaque tempête du fichier Tempete_references.xlsx : téléchargement des données de vent, calcul du maximum de la
+magnitude du vent puis des hexagones h3 à plusieurs résolutions. Les hexagones sont enregistrés dans le dossier des
+hexagones agrégés, relu directement par l'application. Les tempêtes déjà traitées sont ignorées (relance sans coût).
+
+Exemple :
+    python batch.py --variables rafale soutenu_10m --resolutions 4 5 6 --nb-jours 2
+"""
+
+#### SECTION IMPORT DE LIBRAIRIES ####
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+import pandas as pd
+
+from functions import *
+
+
+def arguments():
+    """
+    Objectif : Lire les arguments de la ligne de commande
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Pré-calcul des cartes de vent des tempêtes de référence"
+    )
+    parser.add_argument(
+        "--variables",
+        nargs="+",
+        default=["rafale", "soutenu_10m", "soutenu_100m"],
+        choices=["rafale", "soutenu_10m", "soutenu_100m"],
+        help="Variables de vent à traiter",
+    )
+    parser.add_argument(
+        "--resolutions",
+        nargs="+",
+        type=int,
+        default=[4, 5],
+        help="Résolutions h3 des hexagones",
+    )
+    parser.add_argument(
+        "--nb-jours",
+        type=int,
+        default=1,
+        help="Nombre de jours à partir de la date de la tempête",
+    )
+    parser.add_argument(
+        "--tempetes",
+        nargs="+",
+        default=None,
+        help="Noms des tempêtes à traiter (par défaut toutes)",
+    )
+    parser.add_argument(
+        "--nb-telechargements",
+        type=int,
+        default=4,
+        help="Nombre de requêtes envoyées simultanément à l'API",
+    )
+    parser.add_argument(
+        "--nb-processus",
+        type=int,
+        default=os.cpu_count(),
+        help="Nombre de processus pour le calcul des hexagones",
+    )
+    parser.add_argument(
+        "--zarr",
+        action="store_true",
+        help="Convertir les fichiers téléchargés en Zarr int16 compressé (nécessite zarr)",
+    )
+    parser.add_argument(
+        "--cdsapi-url",
+        default=None,
+        help="URL de l'API (par défaut celle du fichier ~/.cdsapirc)",
+    )
+    parser.add_argument(
+        "--cdsapi-key",
+        default=None,
+        help="Clé de l'API (par défaut celle du fichier ~/.cdsapirc)",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Objectif : Télécharger puis calculer les hexagones de toutes les tempêtes de référence
+    """
+
+    args = arguments()
+
+    # Paramètres communs avec l'application
+    name_folder = "wind_api_copernicus"
+    dossier_index = os.path.join(name_folder, "index_h3")
+    dossier_hexagones = os.path.join(name_folder, "hexagones")
+    taille_max_cache = 5 * 1024**3
+    resolution_base = 15
+    hours = [f"{heure:02d}:00" for heure in range(24)]
+
+    # Journal JSON des étapes (durées, tailles, cache)
+    configuration_journal(os.path.join(name_folder, "journal_etapes.jsonl"))
+
+    # Chargement des bases des pays et des tempêtes de références
+    dossier_references = os.path.join(name_folder, "references")
+    grilles_pays = index_pays("Pays_grille.xlsx", dossier_references)
+    data_tempetes = chargement_reference(
+        "Tempete_references.xlsx", dossier_references
+    ).assign(Date=lambda data: pd.to_datetime(data["Date"]).dt.date)
+
+    if args.tempetes is not None:
+        data_tempetes = data_tempetes[
+            data_tempetes["Nom de la Tempête"].isin(args.tempetes)
+        ]
+
+    # Liste des traitements restant à faire (tempête x variable)
+    traitements = []
+    for _, tempete in data_tempetes.iterrows():
+        country_selected = tempete["ISO3A"]
+        date_debut = tempete["Date"]
+        date_fin = date_debut + timedelta(days=args.nb_jours - 1)
+
+        if country_selected not in grilles_pays:
+            print(f"{tempete['Nom de la Tempête']} : pays {country_selected} inconnu")
+            continue
+
+        country_grid = grilles_pays[country_selected]
+
+        for choix in args.variables:
+            noms = [
+                nom_hexagones(
+                    country_selected, date_debut, args.nb_jours, choix, resolution
+                )
+                for resolution in args.resolutions
+            ]
+
+            # Hexagones déjà calculés -> rien à faire
+            if all(
+                os.path.exists(os.path.join(dossier_hexagones, nom)) for nom in noms
+            ):
+                continue
+
+            requests = decoupage_requetes(
+                choix_variable(choix),
+                date_debut,
+                date_fin,
+                hours,
+                country_grid,
+                TAILLE_TUILE,
+            )
+            filenames = [
+                name_file(nom_tuile(request["area"]), choix, request)
+                for request in requests
+            ]
+            traitements.append(
+                (tempete["Nom de la Tempête"], choix, filenames, noms, country_selected)
+            )
+
+            # Téléchargement en arrière-plan (nouveaux essais en cas d'erreur)
+            ajout_file_attente(name_folder, filenames, requests)
+
+    print(f"{len(traitements)} traitement(s) à réaliser")
+
+    # Attente de la fin des téléchargements
+    filenames_attendus = {
+        filename for _, _, filenames, _, _ in traitements for filename in filenames
+    }
+    arret = demarrage_file_attente(
+        args.cdsapi_url,
+        args.cdsapi_key,
+        name_folder,
+        taille_max_cache,
+        nb_workers=args.nb_telechargements,
+        conversion=args.zarr,
+    )
+    while True:
+        jobs = lecture_file_attente(name_folder)
+        if all(
+            jobs[filename]["etat"] in ("termine", "echec")
+            for filename in filenames_attendus
+        ):
+            break
+        time.sleep(1)
+    arret.set()
+
+    # Fichiers téléchargés avant l'option --zarr (archive existante)
+    if args.zarr:
+        print(f"{len(archivage_zarr(name_folder))} fichier(s) converti(s) en Zarr")
+
+    # Seuls les traitements dont tous les fichiers sont téléchargés sont calculés
+    for nom_tempete, choix, filenames, _, _ in traitements:
+        for filename in filenames:
+            if jobs[filename]["etat"] == "echec":
+                print(
+                    f"{nom_tempete} ({choix}) : échec du téléchargement de {filename} :",
+                    jobs[filename]["erreur"],
+                )
+    traitements = [
+        traitement
+        for traitement in traitements
+        if all(jobs[filename]["etat"] == "termine" for filename in traitement[2])
+    ]
+
+    # Calcul des hexagones (limité par le processeur, en processus)
+    with ProcessPoolExecutor(max_workers=args.nb_processus) as executor:
+        futures = {
+            executor.submit(
+                traitement_periode,
+                name_folder,
+                filenames,
+                choix,
+                resolution_base,
+                args.resolutions,
+                dossier_index,
+                dossier_hexagones,
+                noms,
+                country_selected,
+                grilles_pays[country_selected],
+            ): (nom_tempete, choix)
+            for nom_tempete, choix, filenames, noms, country_selected in traitements
+        }
+
+        for future in as_completed(futures):
+            nom_tempete, choix = futures[future]
+            try:
+                future.result()
+                print(f"{nom_tempete} ({choix}) : hexagones enregistrés")
+            except Exception as e:
+                print(f"{nom_tempete} ({choix}) : une erreur s'est produite :", e)
+
+
+if __name__ == "__main__":
+    main()
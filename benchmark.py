@@ -0,0 +1,454 @@
+"""
+Mesure des performances de chaque étape du traitement sur des données synthétiques (sans appel à Copernicus)
+
+Des fichiers NetCDF au format ERA5 (u10, v10, u100, v100, i10fg sur valid_time, latitude, longitude) sont générés à la
+taille d'un pays, d'un continent ou du monde. Chaque étape est chronométrée (meilleur temps sur plusieurs répétitions)
+et son pic de mémoire est mesuré avec tracemalloc. Les résultats sont comparés à une référence enregistrée : le script
+renvoie un code de sortie non nul si une étape dépasse la référence de plus du seuil.
+
+Exemples :
+    python benchmark.py --tailles pays continent
+    python benchmark.py --tailles pays continent monde --enregistrer
+"""
+
+#### SECTION IMPORT DE LIBRAIRIES ####
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import folium
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from exposition import exposition_classes, index_sites, vent_sites
+from functions import *
+
+# Zones des données synthétiques [nord, ouest, sud, est] (alignées sur la grille ERA5 de 0.25°)
+TAILLES = {
+    "pays": [51.25, -5.25, 41.25, 9.75],
+    "continent": [72.0, -25.0, 34.0, 45.0],
+    "monde": [90.0, -180.0, -90.0, 179.75],
+}
+
+# Résolution h3 affichée pour chaque taille (une carte mondiale en résolution 5 n'est pas réaliste)
+RESOLUTIONS_AFFICHAGE = {"pays": 5, "continent": 4, "monde": 3}
+
+# Nombre de sites du portefeuille synthétique (exposition au vent)
+NB_SITES = 1_000_000
+
+# Fichier des temps de référence
+FICHIER_REFERENCE = "benchmark_reference.json"
+
+
+def dataset_synthetique(area, dates, hours, variables, graine=0):
+    """
+    Objectif : Générer un dataset au format des fichiers ERA5 téléchargés (tempête synthétique + bruit)
+
+    Paramètres :
+        area : Zone [nord, ouest, sud, est]
+        dates : Jours des données
+        hours : Liste des heures ("00:00", ...)
+        variables : Variables au format de l'API (cf VARIABLES_NETCDF)
+        graine : Graine du générateur aléatoire (données reproductibles)
+    """
+
+    nord, ouest, sud, est = area
+    latitudes = np.arange(nord, sud - 0.125, -0.25)
+    longitudes = np.arange(ouest, est + 0.125, 0.25)
+    valid_time = pd.to_datetime(
+        [f"{pd.Timestamp(date).date()} {heure}" for date in dates for heure in hours]
+    )
+
+    # Tempête : tourbillon gaussien qui traverse la zone d'ouest en est au cours de la période
+    lat_grille, lon_grille = np.meshgrid(
+        latitudes.astype(np.float32), longitudes.astype(np.float32), indexing="ij"
+    )
+    lat_centre = (nord + sud) / 2
+    rayon = max(2.0, (nord - sud) / 6)
+    generateur = np.random.default_rng(graine)
+
+    data = {}
+    for numero, variable in enumerate(variables):
+        valeurs = np.empty(
+            (len(valid_time), len(latitudes), len(longitudes)), dtype=np.float32
+        )
+        for pas in range(len(valid_time)):
+            lon_centre = ouest + (est - ouest) * (pas + 0.5) / len(valid_time)
+            intensite = np.exp(
+                -((lat_grille - lat_centre) ** 2 + (lon_grille - lon_centre) ** 2)
+                / (2 * rayon**2)
+            )
+            valeurs[pas] = 25 * intensite * (1 if numero % 2 == 0 else -1)
+            valeurs[pas] += generateur.normal(0, 3, lat_grille.shape)
+
+        # Les rafales sont positives
+        if variable == "instantaneous_10m_wind_gust":
+            np.abs(valeurs, out=valeurs)
+
+        data[VARIABLES_NETCDF[variable]] = xr.Variable(
+            ("valid_time", "latitude", "longitude"),
+            valeurs,
+            attrs={"units": "m s**-1", "long_name": variable},
+        )
+
+    return xr.Dataset(
+        data,
+        coords={
+            "valid_time": valid_time,
+            "latitude": latitudes,
+            "longitude": longitudes,
+        },
+        attrs={"Conventions": "CF-1.7", "institution": "ECMWF (synthétique)"},
+    )
+
+
+def mesure(fonction, repetitions=3):
+    """
+    Objectif : Mesurer le temps (meilleur de plusieurs répétitions) et le pic de mémoire d'une fonction
+
+    Paramètres :
+        fonction : Fonction sans argument à mesurer
+        repetitions : Nombre de répétitions pour le temps
+
+    Renvoie le temps en secondes, le pic de mémoire en Mo et le résultat de la fonction
+    """
+
+    # Temps sans tracemalloc (qui ralentit le code Python)
+    temps = []
+    for _ in range(repetitions):
+        gc.collect()
+        debut = time.perf_counter()
+        resultat = fonction()
+        temps.append(time.perf_counter() - debut)
+
+    # Pic de mémoire (allocations Python et numpy) sur une exécution séparée
+    # (suivi_etape reporte le pic des étapes imbriquées, qui remettent le pic de tracemalloc à zéro)
+    gc.collect()
+    tracemalloc.start()
+    with suivi_etape("benchmark") as etape:
+        fonction()
+    tracemalloc.stop()
+
+    return min(temps), etape["pic_memoire_mo"], resultat
+
+
+def benchmark_references(repetitions):
+    """
+    Objectif : Mesurer le chargement des fichiers de référence (Excel, copie Parquet, échelle de vent)
+
+    Paramètres :
+        repetitions : Nombre de répétitions pour le temps
+    """
+
+    resultats = {}
+    dossier_cache = tempfile.mkdtemp()
+
+    try:
+        for chemin in ["Pays_grille.xlsx", "Tempete_references.xlsx"]:
+
+            def lecture_excel():
+                CACHE_REFERENCES.clear()
+                return chargement_reference(chemin)
+
+            def lecture_parquet():
+                CACHE_REFERENCES.clear()
+                return chargement_reference(chemin, dossier_cache)
+
+            # Création de la copie Parquet avant la mesure
+            lecture_parquet()
+            resultats[f"chargement_reference[{chemin}, Excel]"] = mesure(
+                lecture_excel, repetitions
+            )
+            resultats[f"chargement_reference[{chemin}, Parquet]"] = mesure(
+                lecture_parquet, repetitions
+            )
+
+        resultats["chargement_echelle"] = mesure(
+            lambda: chargement_echelle.__wrapped__("Echelle_vent.xlsx"), repetitions
+        )
+
+    finally:
+        CACHE_REFERENCES.clear()
+        shutil.rmtree(dossier_cache)
+
+    return {etape: valeurs[:2] for etape, valeurs in resultats.items()}
+
+
+def benchmark_taille(taille, hours, repetitions, dossier):
+    """
+    Objectif : Mesurer chaque étape du traitement sur des données synthétiques d'une taille donnée
+
+    Paramètres :
+        taille : Taille des données (cf TAILLES)
+        hours : Liste des heures des données
+        repetitions : Nombre de répétitions pour le temps
+        dossier : Dossier de travail (fichiers NetCDF et index h3)
+    """
+
+    area = TAILLES[taille]
+    resolution_base = 15
+    resolution_parent = RESOLUTIONS_AFFICHAGE[taille]
+    dossier_index = os.path.join(dossier, "index_h3")
+    resultats = {}
+
+    # Fichiers NetCDF synthétiques (un par variable, comme les téléchargements de l'application)
+    filenames = {}
+    for choix in ["rafale", "soutenu_10m"]:
+        filenames[choix] = f"synthetique_{taille}_{choix}.nc"
+        dataset_synthetique(
+            area, ["2024-01-01"], hours, choix_variable(choix)
+        ).to_netcdf(os.path.join(dossier, filenames[choix]))
+
+    # Lecture du fichier et maximum temporel de la magnitude du vent
+    for choix, filename in filenames.items():
+
+        def lecture_vent():
+            with ouverture_periode(dossier, [filename]) as dataset:
+                return traitement_data_wind(dataset, choix)
+
+        resultats[f"traitement_data_wind[{choix}]"] = mesure(lecture_vent, repetitions)
+
+    longitudes, latitudes, wind_mag = resultats["traitement_data_wind[rafale]"][2]
+
+    # Hexagones : sans index, construction de l'index sur disque, relecture de l'index
+    resultats["calcul_hexagone"] = mesure(
+        lambda: calcul_hexagone(
+            latitudes, longitudes, wind_mag, resolution_base, resolution_parent
+        ),
+        repetitions,
+    )
+
+    def construction_index():
+        shutil.rmtree(dossier_index, ignore_errors=True)
+        return calcul_hexagone(
+            latitudes,
+            longitudes,
+            wind_mag,
+            resolution_base,
+            resolution_parent,
+            dossier_index,
+        )
+
+    resultats["calcul_hexagone[construction index]"] = mesure(
+        construction_index, repetitions
+    )
+    resultats["calcul_hexagone[index existant]"] = mesure(
+        lambda: calcul_hexagone(
+            latitudes,
+            longitudes,
+            wind_mag,
+            resolution_base,
+            resolution_parent,
+            dossier_index,
+        ),
+        repetitions,
+    )
+    hexagones = resultats["calcul_hexagone"][2]
+
+    resultats["pyramide_hexagones"] = mesure(
+        lambda: pyramide_hexagones(
+            latitudes,
+            longitudes,
+            wind_mag,
+            resolution_base,
+            range(1, resolution_parent + 1),
+            dossier_index,
+        ),
+        repetitions,
+    )
+
+    # Exposition d'un portefeuille synthétique : vent de chaque site puis agrégation par classe de vent
+    generateur = np.random.default_rng(0)
+    nord, ouest, sud, est = area
+    lat_sites = generateur.uniform(sud, nord, NB_SITES)
+    lon_sites = generateur.uniform(ouest, est, NB_SITES)
+    valeurs_assurees = generateur.uniform(1e5, 1e6, NB_SITES)
+
+    def exposition():
+        index = index_sites(latitudes, longitudes, lat_sites, lon_sites)
+        return exposition_classes(
+            vent_sites(wind_mag, index), "rafale", valeurs_assurees
+        )
+
+    resultats["exposition_sites"] = mesure(exposition, repetitions)
+
+    # Carte folium puis HTML envoyé au navigateur
+    carte_centre = map_center(area)
+    resultats["affichage_hexagones"] = mesure(
+        lambda: affichage_hexagones(
+            folium.Map(location=carte_centre, zoom_start=5), hexagones, "rafale"
+        ),
+        repetitions,
+    )
+    carte = resultats["affichage_hexagones"][2]
+    resultats["rendu_html"] = mesure(lambda: carte.get_root().render(), repetitions)
+
+    # Animation heure par heure : maxima de chaque pas de temps, une seule couche d'hexagones
+    def calcul_horaire():
+        with ouverture_periode(dossier, [filenames["rafale"]]) as dataset:
+            return calcul_hexagone_horaire(
+                dataset, "rafale", resolution_base, resolution_parent, dossier_index
+            )
+
+    resultats["calcul_hexagone_horaire"] = mesure(calcul_horaire, repetitions)
+    temps, hexagones_horaires, maxima_horaires = resultats["calcul_hexagone_horaire"][2]
+    resultats["affichage_hexagones_horaire"] = mesure(
+        lambda: affichage_hexagones_horaire(
+            folium.Map(location=carte_centre, zoom_start=5),
+            hexagones_horaires,
+            maxima_horaires,
+            temps,
+            "rafale",
+        ),
+        repetitions,
+    )
+    carte_horaire = resultats["affichage_hexagones_horaire"][2]
+    resultats["rendu_html[horaire]"] = mesure(
+        lambda: carte_horaire.get_root().render(), repetitions
+    )
+
+    # Taille des données (aide à la lecture des résultats)
+    print(
+        f"{taille} : {len(latitudes)} x {len(longitudes)} points, {len(hours)} heures, "
+        f"{len(hexagones)} hexagones en résolution {resolution_parent}, "
+        f"HTML {len(resultats['rendu_html'][2]) / 1024**2:.1f} Mo "
+        f"({len(resultats['rendu_html[horaire]'][2]) / 1024**2:.1f} Mo animé)"
+    )
+
+    return {etape: valeurs[:2] for etape, valeurs in resultats.items()}
+
+
+def comparaison(resultats, reference, seuil):
+    """
+    Objectif : Comparer les résultats à la référence et lister les régressions
+
+    Paramètres :
+        resultats : Dictionnaire taille -> étape -> [temps, mémoire]
+        reference : Résultats de référence (même format)
+        seuil : Dépassement relatif toléré (0.25 -> 25 %)
+    """
+
+    regressions = []
+    for taille, etapes in resultats.items():
+        for etape, (temps, memoire) in etapes.items():
+            if etape not in reference.get(taille, {}):
+                continue
+            temps_ref, memoire_ref = reference[taille][etape]
+
+            # Marge absolue pour les étapes très courtes (bruit de mesure)
+            if temps > temps_ref * (1 + seuil) + 0.01:
+                regressions.append(
+                    f"{taille} / {etape} : {temps:.3f} s (référence {temps_ref:.3f} s)"
+                )
+            if memoire > memoire_ref * (1 + seuil) + 1:
+                regressions.append(
+                    f"{taille} / {etape} : {memoire:.1f} Mo (référence {memoire_ref:.1f} Mo)"
+                )
+
+    return regressions
+
+
+def arguments():
+    """
+    Objectif : Lire les arguments de la ligne de commande
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Mesure des performances sur des données ERA5 synthétiques"
+    )
+    parser.add_argument(
+        "--tailles",
+        nargs="+",
+        default=["pays", "continent"],
+        choices=list(TAILLES),
+        help="Tailles des données synthétiques",
+    )
+    parser.add_argument(
+        "--nb-heures", type=int, default=24, help="Nombre de pas de temps horaires"
+    )
+    parser.add_argument(
+        "--repetitions", type=int, default=3, help="Nombre de répétitions par étape"
+    )
+    parser.add_argument(
+        "--seuil",
+        type=float,
+        default=0.25,
+        help="Dépassement relatif toléré par rapport à la référence",
+    )
+    parser.add_argument(
+        "--reference", default=FICHIER_REFERENCE, help="Fichier des temps de référence"
+    )
+    parser.add_argument(
+        "--enregistrer",
+        action="store_true",
+        help="Enregistrer les résultats comme nouvelle référence",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Objectif : Mesurer toutes les étapes, afficher les résultats et les comparer à la référence
+    """
+
+    args = arguments()
+    hours = [f"{heure:02d}:00" for heure in range(args.nb_heures)]
+
+    resultats = {"references": benchmark_references(args.repetitions)}
+    dossier = tempfile.mkdtemp()
+    try:
+        for taille in args.tailles:
+            resultats[taille] = benchmark_taille(
+                taille, hours, args.repetitions, dossier
+            )
+    finally:
+        shutil.rmtree(dossier)
+
+    # Affichage des résultats
+    for taille, etapes in resultats.items():
+        print(f"\n{taille}")
+        for etape, (temps, memoire) in etapes.items():
+            print(f"    {etape:<50} {temps:9.4f} s {memoire:10.1f} Mo")
+    print(
+        f"\nPic RSS du processus : {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} Mo"
+    )
+
+    # Enregistrement de la nouvelle référence (les tailles non mesurées sont conservées)
+    reference = {}
+    if os.path.exists(args.reference):
+        with open(args.reference, encoding="utf-8") as fichier:
+            reference = json.load(fichier)
+
+    if args.enregistrer:
+        for taille, etapes in resultats.items():
+            reference[taille] = {
+                etape: [round(temps, 4), round(memoire, 1)]
+                for etape, (temps, memoire) in etapes.items()
+            }
+        reference["machine"] = (
+            f"{platform.node()} ({platform.processor() or platform.machine()}, Python {platform.python_version()})"
+        )
+        with open(args.reference, "w", encoding="utf-8") as fichier:
+            json.dump(reference, fichier, indent=2, ensure_ascii=False)
+        print(f"Référence enregistrée dans {args.reference}")
+        return
+
+    regressions = comparaison(resultats, reference, args.seuil)
+    for regression in regressions:
+        print("Régression :", regression)
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Contrôle du temps d'import de functions.py (démarrage à froid de l'application)
+
+Lance un interpréteur neuf avec python -X importtime, vérifie que les librairies lourdes ne sont pas chargées à l'import
+et que le temps d'import cumulé reste sous le budget. Renvoie un code de sortie non nul en cas de dépassement.
+
+Exemple :
+    python controle_import.py --budget 600
+"""
+
+#### SECTION IMPORT DE LIBRAIRIES ####
+import argparse
+import subprocess
+import sys
+
+# Librairies qui ne doivent être importées qu'à l'utilisation (cf functions.py)
+MODULES_DIFFERES = [
+    "cdsapi",
+    "dask",
+    "folium",
+    "netCDF4",
+    "pyarrow.dataset",
+    "requests",
+    "streamlit_folium",
+    "xarray",
+    "zarr",
+]
+
+
+def temps_import(module):
+    """
+    Objectif : Mesurer les temps d'import d'un module dans un interpréteur neuf
+
+    Paramètres :
+        module : Nom du module à importer
+
+    Renvoie un dictionnaire module importé -> temps cumulé en millisecondes
+    """
+
+    resultat = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Lignes de la forme "import time:  self [us] | cumulative | imported package"
+    temps = {}
+    for ligne in resultat.stderr.splitlines():
+        if not ligne.startswith("import time:") or "cumulative" in ligne:
+            continue
+        _, cumul, nom = ligne[len("import time:") :].split("|")
+        temps[nom.strip()] = int(cumul) / 1000
+
+    return temps
+
+
+def main():
+    """
+    Objectif : Vérifier le budget de temps d'import de functions.py
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Contrôle du temps d'import de functions.py"
+    )
+    parser.add_argument(
+        "--module", default="functions", help="Module dont l'import est mesuré"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=600,
+        help="Temps d'import cumulé maximal en millisecondes",
+    )
+    args = parser.parse_args()
+
+    temps = temps_import(args.module)
+    erreurs = []
+
+    # Librairies lourdes chargées dès l'import
+    charges = [module for module in MODULES_DIFFERES if module in temps]
+    if charges:
+        erreurs.append(f"librairies importées au chargement : {', '.join(charges)}")
+
+    # Budget de temps
+    duree = temps[args.module]
+    print(f"Import de {args.module} : {duree:.0f} ms (budget {args.budget:.0f} ms)")
+    if duree > args.budget:
+        erreurs.append(f"budget dépassé de {duree - args.budget:.0f} ms")
+
+    # Modules les plus coûteux (aide au diagnostic)
+    for nom, cumul in sorted(temps.items(), key=lambda item: -item[1])[:10]:
+        print(f"    {cumul:8.1f} ms  {nom}")
+
+    for erreur in erreurs:
+        print("Erreur :", erreur)
+
+    sys.exit(1 if erreurs else 0)
+
+
+if __name__ == "__main__":
+    main()
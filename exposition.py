@@ -0,0 +1,232 @@
+"""
+Exposition d'un portefeuille de sites assurés au vent d'une tempête
+
+Chaque site (latitude, longitude, valeur assurée facultative) reçoit le vent maximal du point de grille ERA5 le plus
+proche, calculé par traitement_data_wind. La grille ERA5 est régulière : l'index site -> point de grille est obtenu par
+un simple calcul arithmétique sur tous les sites à la fois, et peut être réutilisé pour toutes les tempêtes d'une même
+zone. Les sites peuvent aussi être joints à une couche d'hexagones h3 (pyramide_hexagones, niveaux de retour).
+L'exposition est ensuite agrégée par classe de l'échelle de vent (cf Echelle_vent.xlsx).
+
+Exemple :
+    python exposition.py --sites portefeuille.csv --fichiers wind_api_copernicus/rafale_FRA_xxx.nc --choix rafale
+"""
+
+#### SECTION IMPORT DE LIBRAIRIES ####
+import argparse
+import os
+
+import h3
+import numpy as np
+import pandas as pd
+
+from functions import (
+    classification_vent,
+    details_etape,
+    echelle_vent,
+    etape_suivie,
+    ouverture_periode,
+    traitement_data_wind,
+)
+
+
+@etape_suivie("index_sites")
+def index_sites(latitudes, longitudes, lat_sites, lon_sites):
+    """
+    Objectif :
+        Associer à chaque site l'indice (dans la grille aplatie) du point de grille le plus proche, en une seule opération vectorisée
+
+    Paramètres :
+        latitudes : Latitudes de la grille (régulière, croissantes ou décroissantes comme dans ERA5)
+        longitudes : Longitudes de la grille (régulière)
+        lat_sites : Latitudes des sites
+        lon_sites : Longitudes des sites
+
+    Renvoie un tableau d'indices int64 (-1 pour un site hors de la grille)
+    """
+
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    lat_sites = np.asarray(lat_sites, dtype=np.float64)
+    lon_sites = np.asarray(lon_sites, dtype=np.float64)
+
+    # Pas de la grille (0.25° pour ERA5), signé pour les latitudes décroissantes
+    pas_lat = latitudes[1] - latitudes[0] if len(latitudes) > 1 else 1.0
+    pas_lon = longitudes[1] - longitudes[0] if len(longitudes) > 1 else 1.0
+
+    # Longitudes des sites ramenées à partir de la première longitude de la grille (-180/180 ou 0/360)
+    ecart_lon = (lon_sites - longitudes[0]) % 360
+
+    # Point de grille le plus proche
+    i = np.rint((lat_sites - latitudes[0]) / pas_lat).astype(np.int64)
+    j = np.rint(ecart_lon / pas_lon).astype(np.int64)
+
+    # Grille mondiale : la dernière longitude est voisine de la première
+    if len(longitudes) * pas_lon >= 360:
+        j %= len(longitudes)
+
+    dans_grille = (
+        (i >= 0) & (i < len(latitudes)) & (j >= 0) & (j < len(longitudes))
+    ) & np.isfinite(lat_sites + lon_sites)
+    index = np.where(dans_grille, i * len(longitudes) + j, -1)
+    details_etape(sites=len(index), hors_grille=int((~dans_grille).sum()))
+
+    return index
+
+
+def vent_sites(wind, index):
+    """
+    Objectif : Vent de chaque site à partir de la grille de vent et de l'index des sites (cf index_sites)
+
+    Paramètres :
+        wind : Matrice où chaque valeur i,j de vent correspond à une latitude i et une longitude j
+        index : Indices des sites dans la grille aplatie (-1 hors grille)
+
+    Renvoie le vent de chaque site (NaN hors grille)
+    """
+
+    wind = np.asarray(wind).ravel()
+    vent = wind[np.maximum(index, 0)].astype(np.float32)
+    vent[index < 0] = np.nan
+
+    return vent
+
+
+def vent_sites_hexagones(hexagones, valeurs, resolution, lat_sites, lon_sites):
+    """
+    Objectif :
+        Vent de chaque site à partir d'une couche d'hexagones h3 (jointure sur l'hexagone contenant le site)
+
+    Paramètres :
+        hexagones : Hexagones h3 entiers (uint64) triés, comme renvoyés par max_par_hexagone ou pyramide_hexagones
+        valeurs : Valeur de vent de chaque hexagone
+        resolution : Résolution h3 des hexagones
+        lat_sites : Latitudes des sites
+        lon_sites : Longitudes des sites
+
+    Renvoie le vent de chaque site (NaN si l'hexagone du site n'est pas dans la couche)
+    """
+
+    hexagones = np.asarray(hexagones, dtype=np.uint64)
+    lat_sites = np.asarray(lat_sites, dtype=np.float64)
+    lon_sites = np.asarray(lon_sites, dtype=np.float64)
+
+    # Couche vide : aucun site dans la zone
+    if len(hexagones) == 0:
+        return np.full(len(lat_sites), np.nan, dtype=np.float32)
+
+    # Hexagone de chaque site
+    cellules = np.fromiter(
+        (
+            h3.api.basic_int.latlng_to_cell(lat, lon, resolution)
+            for lat, lon in zip(lat_sites.tolist(), lon_sites.tolist())
+        ),
+        dtype=np.uint64,
+        count=len(lat_sites),
+    )
+
+    # Jointure par recherche dichotomique dans les hexagones triés
+    position = np.minimum(np.searchsorted(hexagones, cellules), len(hexagones) - 1)
+    trouve = hexagones[position] == cellules
+    vent = np.asarray(valeurs, dtype=np.float32)[position]
+    vent[~trouve] = np.nan
+
+    return vent
+
+
+@etape_suivie("exposition_classes")
+def exposition_classes(vent, choix, valeurs_assurees=None):
+    """
+    Objectif :
+        Agréger le nombre de sites et les valeurs assurées par classe de l'échelle de vent (couleurs de get_wind_color)
+
+    Paramètres :
+        vent : Vent de chaque site en km/h (NaN hors zone)
+        choix : Choix de l'utilisateur pour la variable a utiliser
+        valeurs_assurees : Valeur assurée de chaque site (None -> uniquement le nombre de sites)
+
+    Renvoie un DataFrame avec une ligne par classe et une ligne "Hors zone" pour les sites sans donnée de vent
+    """
+
+    echelle = echelle_vent(choix)
+    vent = np.asarray(vent)
+    if valeurs_assurees is None:
+        valeurs_assurees = np.zeros(len(vent))
+    valeurs_assurees = np.asarray(valeurs_assurees, dtype=np.float64)
+
+    # Niveau de chaque site connu, puis comptage et somme des valeurs par niveau
+    connus = np.isfinite(vent)
+    niveaux, couleurs = classification_vent(vent[connus], choix)
+    nb_classes = len(echelle["libelles"])
+    sites = np.bincount(niveaux, minlength=nb_classes)
+    valeurs = np.bincount(
+        niveaux, weights=valeurs_assurees[connus], minlength=nb_classes
+    )
+
+    table = pd.DataFrame(
+        {
+            "classe": echelle["libelles"] + ["Hors zone"],
+            "couleur": list(couleurs) + [None],
+            "sites": np.append(sites, (~connus).sum()),
+            "valeur_assuree": np.append(valeurs, valeurs_assurees[~connus].sum()),
+        }
+    )
+    total = table["valeur_assuree"].sum()
+    table["part_valeur"] = table["valeur_assuree"] / total if total else 0.0
+    details_etape(sites=len(vent))
+
+    return table
+
+
+def main():
+    """
+    Objectif : Exposition d'un portefeuille (fichier CSV) au vent maximal des fichiers NetCDF d'une tempête
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Exposition d'un portefeuille de sites au vent d'une tempête"
+    )
+    parser.add_argument(
+        "--sites",
+        required=True,
+        help="Fichier CSV des sites (colonnes latitude, longitude et valeur facultative)",
+    )
+    parser.add_argument(
+        "--fichiers",
+        nargs="+",
+        required=True,
+        help="Fichiers NetCDF de la tempête (cf requete_periode)",
+    )
+    parser.add_argument(
+        "--choix",
+        default="rafale",
+        choices=["rafale", "soutenu_10m", "soutenu_100m"],
+        help="Variable de vent",
+    )
+    parser.add_argument(
+        "--sortie",
+        default=None,
+        help="Fichier CSV des sites complété par le vent (facultatif)",
+    )
+    args = parser.parse_args()
+
+    sites = pd.read_csv(args.sites)
+
+    # Vent maximal de la tempête sur la grille
+    # Chemins complets résolus un par un (dossiers différents possibles), fichiers fermés une fois le maximum calculé
+    with ouverture_periode(
+        "", [os.path.abspath(fichier) for fichier in args.fichiers]
+    ) as dataset:
+        longitudes, latitudes, wind = traitement_data_wind(dataset, args.choix)
+
+    # Vent de chaque site puis agrégation par classe
+    index = index_sites(latitudes, longitudes, sites["latitude"], sites["longitude"])
+    sites["vent"] = vent_sites(wind, index)
+    table = exposition_classes(sites["vent"], args.choix, sites.get("valeur"))
+    print(table.to_string(index=False))
+
+    if args.sortie is not None:
+        sites.to_csv(args.sortie, index=False)
+
+
+if __name__ == "__main__":
+    main()
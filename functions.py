@@ -2,318 +2,3325 @@
 Fonctions utilisées dans le main
 """
 
+import contextlib
+import contextvars
+import functools
+import hashlib
+import json
+import logging
+import logging.handlers
 import os
+import shutil
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+try:
+    import resource
+except ImportError:  # Windows : pas de mesure du pic de mémoire du processus
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # Windows : verrous de fichiers avec msvcrt
+    fcntl = None
+    import msvcrt
 
 # Import de librairies
-import cdsapi
-import folium
+# cdsapi, dask, folium, pyarrow, requests et xarray sont importés dans les fonctions qui les utilisent (démarrage plus rapide)
 import h3
 import numpy as np
+import pandas as pd
+
+# Nom des variables de l'API dans les fichiers NetCDF téléchargés
+VARIABLES_NETCDF = {
+    "10m_u_component_of_wind": "u10",
+    "10m_v_component_of_wind": "v10",
+    "100m_u_component_of_wind": "u100",
+    "100m_v_component_of_wind": "v100",
+    "instantaneous_10m_wind_gust": "i10fg",
+}
+
+# Variables NetCDF des composantes du vent pour chaque choix (u et v pour un vent soutenu, une seule pour les rafales)
+COMPOSANTES_VENT = {
+    "soutenu_10m": ["u10", "v10"],
+    "soutenu_100m": ["u100", "v100"],
+    "rafale": ["i10fg"],
+}
+
+# Stockage Zarr (cf conversion_zarr) : composantes du vent en entiers int16 au centième de m/s (valeur manquante -32768)
+ECHELLE_ZARR = 0.01
+MANQUANT_ZARR = -32768
+
+# Pas de la grille ERA5 en degrés et taille des tuiles de téléchargement (multiple du pas)
+PAS_ERA5 = 0.25
+TAILLE_TUILE = 10
+
+# Clé de partition des hexagones agrégés restreints au pays (cf masque_pays) : les partitions enregistrées sans masque
+# (rectangle complet) n'ont pas cette clé et ne sont plus relues
+MASQUE_HEXAGONES = "pays"
+
+# Nom du dataset de ré-analyse
+DATASET_ERA5 = "reanalysis-era5-single-levels"
+
+# Sections du fichier Echelle_vent.xlsx pour chaque variable et titre de la légende
+SECTIONS_ECHELLE = {
+    "rafale": ("RAFALES", "Légende Rafale"),
+    "soutenu_10m": ("VENT SOUTENU 10 m", "Légende Vent soutenu 10m"),
+    "soutenu_100m": ("VENT SOUTENU 100 m", "Légende Vent soutenu 100m"),
+}
+
+# Couleur de chaque niveau de l'échelle simplifiée (du plus faible au plus fort)
+COULEURS_NIVEAUX = [
+    "green",
+    "yellow",
+    "orange",
+    "#FF8C00",
+    "red",
+]  # #FF8C00 : Orange foncé
+
+# Script de l'animation heure par heure (cf affichage_hexagones_horaire) : curseur et lecture qui recolorent
+# une seule couche GeoJSON à partir des valeurs de chaque pas de temps (même règle que classification_vent)
+GABARIT_ANIMATION = """
+{% macro script(this, kwargs) %}
+(function () {
+    var couche = {{ this.couche }};
+    var carte = {{ this._parent.get_name() }};
+    var donnees = {{ this.donnees }};
+
+    function couleur(vent) {
+        var niveau = 0;
+        while (niveau < donnees.seuils.length && vent >= donnees.seuils[niveau]) {
+            niveau++;
+        }
+        return donnees.couleurs[niveau];
+    }
+
+    var controle = L.control({position: "bottomright"});
+    controle.onAdd = function () {
+        var div = L.DomUtil.create("div", "leaflet-bar");
+        div.style.background = "white";
+        div.style.padding = "6px";
+        div.innerHTML =
+            '<button type="button">&#9654;</button> ' +
+            '<input type="range" min="0" max="' + (donnees.temps.length - 1) +
+            '" value="0" style="vertical-align: middle;"> <span></span>';
+        L.DomEvent.disableClickPropagation(div);
+        return div;
+    };
+    controle.addTo(carte);
+
+    var bouton = controle.getContainer().querySelector("button");
+    var curseur = controle.getContainer().querySelector("input");
+    var libelle = controle.getContainer().querySelector("span");
+
+    function affichage(pas) {
+        var valeurs = donnees.valeurs[pas];
+        couche.eachLayer(function (hexagone) {
+            var vent = valeurs[hexagone.feature.properties.rang];
+            var c = couleur(vent);
+            hexagone.feature.properties.vent = vent;
+            hexagone.setStyle({color: c, fillColor: c});
+        });
+        curseur.value = pas;
+        libelle.textContent = donnees.temps[pas] + " UTC";
+    }
+
+    var lecture = null;
+    bouton.onclick = function () {
+        if (lecture !== null) {
+            clearInterval(lecture);
+            lecture = null;
+            bouton.innerHTML = "&#9654;";
+            return;
+        }
+        bouton.innerHTML = "&#10074;&#10074;";
+        lecture = setInterval(function () {
+            affichage((Number(curseur.value) + 1) % donnees.temps.length);
+        }, 700);
+    };
+    curseur.oninput = function () {
+        affichage(Number(curseur.value));
+    };
+
+    affichage(0);
+})();
+{% endmacro %}
+"""
+
+# Fichiers de référence déjà chargés dans ce processus : clé -> (date de modification du fichier, contenu)
+CACHE_REFERENCES = {}
+
+# Verrou des accès au manifeste du cache et à la file d'attente (téléchargements en parallèle)
+VERROU_CACHE = threading.RLock()
+
+# Dossiers dont le verrou de fichier est détenu par ce processus (cf verrou_dossier)
+DOSSIERS_VERROUILLES = set()
+
+# Workers de la file d'attente de téléchargement démarrés dans ce processus (un groupe par dossier)
+WORKERS_FILE_ATTENTE = {}
+
+# Journal des mesures des étapes (une ligne JSON par étape, cf configuration_journal)
+JOURNAL = logging.getLogger("api_copernicus")
+
+# Mesures des étapes de l'exécution en cours (propres à chaque thread, donc à chaque session Streamlit) et étapes ouvertes
+MESURES_ETAPES = contextvars.ContextVar("mesures_etapes", default=None)
+PILE_ETAPES = contextvars.ContextVar("pile_etapes", default=())
+
+# Liste de fonctions
+
+
+def configuration_journal(chemin=None, taille_max=10 * 1024**2):
+    """
+    Objectif : Écrire le journal des étapes (une ligne JSON par étape) dans un fichier ou sur la sortie d'erreur
+
+    Paramètres :
+        chemin : Fichier du journal (None -> sortie d'erreur)
+        taille_max : Taille du fichier au-delà de laquelle il est archivé (3 archives conservées)
+    """
+
+    # Configuration faite une seule fois par processus
+    if JOURNAL.handlers:
+        return
+
+    if chemin is None:
+        sortie = logging.StreamHandler()
+    else:
+        os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+        sortie = logging.handlers.RotatingFileHandler(
+            chemin, maxBytes=taille_max, backupCount=3, encoding="utf-8"
+        )
+    sortie.setFormatter(logging.Formatter("%(message)s"))
+    JOURNAL.addHandler(sortie)
+    JOURNAL.setLevel(logging.INFO)
+    JOURNAL.propagate = False
+
+
+def debut_mesures():
+    """
+    Objectif : Démarrer la collecte des mesures des étapes de l'exécution en cours (thread courant)
+
+    Renvoie la liste complétée au fil des étapes
+    """
+
+    mesures = []
+    MESURES_ETAPES.set(mesures)
+
+    return mesures
+
+
+def pic_memoire_processus():
+    """
+    Objectif : Pic de mémoire (RSS) du processus depuis son démarrage en Mo (None si non disponible)
+    """
+
+    if resource is None:
+        return None
+
+    # ru_maxrss est en ko sous Linux et en octets sous macOS
+    pic = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pic / (1024**2 if sys.platform == "darwin" else 1024), 1)
+
+
+@contextlib.contextmanager
+def suivi_etape(nom, **details):
+    """
+    Objectif :
+        Mesurer une étape : durée, pic de mémoire (si tracemalloc est actif), pic RSS du processus, détails (tailles,
+        cache). La mesure est ajoutée aux mesures de l'exécution en cours et écrite dans le journal JSON
+
+    Paramètres :
+        nom : Nom de l'étape
+        details : Détails connus au début de l'étape (complétés avec details_etape)
+
+    Le pic de mémoire des étapes imbriquées est reporté sur l'étape parente. Il est approximatif si plusieurs threads
+    travaillent en même temps (tracemalloc mesure tout le processus)
+    """
+
+    pile = PILE_ETAPES.get()
+    mesure = {
+        "etape": nom,
+        "parent": pile[-1]["mesure"]["etape"] if pile else None,
+        "thread": threading.current_thread().name,
+        **details,
+    }
+
+    # Pic de mémoire de l'étape parente jusqu'ici, puis remise à zéro pour cette étape
+    memoire = tracemalloc.is_tracing()
+    cadre = {"mesure": mesure, "pic": 0, "base": 0}
+    if memoire:
+        actuelle, pic = tracemalloc.get_traced_memory()
+        if pile:
+            pile[-1]["pic"] = max(pile[-1]["pic"], pic)
+        tracemalloc.reset_peak()
+        cadre["base"] = actuelle
+
+    jeton = PILE_ETAPES.set(pile + (cadre,))
+    debut = time.perf_counter()
+    try:
+        yield mesure
+
+    except Exception as erreur:
+        mesure["erreur"] = repr(erreur)
+        raise
+
+    finally:
+        mesure["duree_s"] = round(time.perf_counter() - debut, 6)
+        PILE_ETAPES.reset(jeton)
+
+        if memoire and tracemalloc.is_tracing():
+            pic = max(cadre["pic"], tracemalloc.get_traced_memory()[1])
+            mesure["pic_memoire_mo"] = round((pic - cadre["base"]) / 1024**2, 3)
+            if pile:
+                pile[-1]["pic"] = max(pile[-1]["pic"], pic)
+            tracemalloc.reset_peak()
+
+        mesure["rss_max_mo"] = pic_memoire_processus()
+        mesure["horodatage"] = time.time()
+
+        mesures = MESURES_ETAPES.get()
+        if mesures is not None:
+            mesures.append(mesure)
+        JOURNAL.info(json.dumps(mesure, default=str, ensure_ascii=False))
+
+
+def journal_erreur(contexte, erreur):
+    """
+    Objectif : Écrire une erreur (type, message et trace) dans le journal JSON
+
+    Paramètres :
+        contexte : Étape ou partie de l'application où l'erreur s'est produite
+        erreur : Exception levée
+    """
+
+    JOURNAL.error(
+        json.dumps(
+            {
+                "erreur": contexte,
+                "type": type(erreur).__name__,
+                "message": str(erreur),
+                "trace": "".join(
+                    traceback.format_exception(
+                        type(erreur), erreur, erreur.__traceback__
+                    )
+                ),
+                "horodatage": time.time(),
+            },
+            ensure_ascii=False,
+        )
+    )
+
+
+def details_etape(**details):
+    """
+    Objectif : Ajouter des détails (tailles des données, cache utilisé ou non) à l'étape en cours de mesure
+
+    Paramètres :
+        details : Détails à ajouter
+    """
+
+    pile = PILE_ETAPES.get()
+    if pile:
+        pile[-1]["mesure"].update(details)
+
+
+def etape_suivie(nom):
+    """
+    Objectif : Décorateur mesurant chaque appel d'une fonction comme une étape (cf suivi_etape)
+
+    Paramètres :
+        nom : Nom de l'étape
+    """
+
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def fonction_suivie(*args, **kwargs):
+            with suivi_etape(nom):
+                return fonction(*args, **kwargs)
+
+        return fonction_suivie
+
+    return decorateur
+
+
+@etape_suivie("chargement_reference")
+def chargement_reference(chemin, dossier_cache=None):
+    """
+    Objectif :
+        Charger un fichier Excel de référence une seule fois par processus (rechargé si le fichier est modifié)
+
+    Paramètres :
+        chemin : Chemin du fichier Excel (Pays_grille.xlsx, Tempete_references.xlsx)
+        dossier_cache : Dossier où une copie Parquet du fichier est conservée entre les processus (None -> pas de copie)
+    """
+
+    date_modification = os.stat(chemin).st_mtime_ns
+
+    # Déjà chargé et fichier non modifié
+    en_memoire = CACHE_REFERENCES.get(chemin)
+    if en_memoire is not None and en_memoire[0] == date_modification:
+        details_etape(fichier=chemin, source="memoire")
+        return en_memoire[1]
+
+    # Copie Parquet (beaucoup plus rapide à lire que l'Excel), nommée avec la date de modification du fichier
+    data = None
+    if dossier_cache is not None:
+        chemin_cache = os.path.join(
+            dossier_cache,
+            os.path.splitext(os.path.basename(chemin))[0]
+            + f"_{date_modification}.parquet",
+        )
+        if os.path.exists(chemin_cache):
+            data = pd.read_parquet(chemin_cache)
+            details_etape(source="parquet")
+
+    if data is None:
+        data = pd.read_excel(chemin)
+        details_etape(source="excel")
+        if dossier_cache is not None:
+            os.makedirs(dossier_cache, exist_ok=True)
+            chemin_tmp = chemin_temporaire(chemin_cache)
+            data.to_parquet(chemin_tmp)
+            os.replace(chemin_tmp, chemin_cache)
+
+            # Suppression des copies d'anciennes versions du fichier
+            prefixe = os.path.splitext(os.path.basename(chemin))[0] + "_"
+            for nom in os.listdir(dossier_cache):
+                ancien = os.path.join(dossier_cache, nom)
+                if (
+                    nom.startswith(prefixe)
+                    and nom.endswith(".parquet")
+                    and ancien != chemin_cache
+                ):
+                    os.remove(ancien)
+
+    CACHE_REFERENCES[chemin] = (date_modification, data)
+    details_etape(fichier=chemin, lignes=len(data))
+
+    return data
+
+
+def index_pays(chemin="Pays_grille.xlsx", dossier_cache=None):
+    """
+    Objectif :
+        Construire une seule fois le dictionnaire code ISO3 -> rectangle du pays (ordre demandé par l'API Copernicus)
+
+    Paramètres :
+        chemin : Chemin du fichier Pays_grille.xlsx
+        dossier_cache : Dossier de la copie Parquet (cf chargement_reference)
+    """
+
+    date_modification = os.stat(chemin).st_mtime_ns
+    cle = ("index_pays", chemin)
+
+    en_memoire = CACHE_REFERENCES.get(cle)
+    if en_memoire is not None and en_memoire[0] == date_modification:
+        return en_memoire[1]
+
+    data_pays = chargement_reference(chemin, dossier_cache)
+
+    # Code présent plusieurs fois dans le fichier -> première ligne (comme grille_pays)
+    index = {}
+    for code_iso3a, lat_max, lon_min, lat_min, lon_max in zip(
+        data_pays["ISO3"],
+        data_pays["Lat_max"],
+        data_pays["Lon_min"],
+        data_pays["Lat_min"],
+        data_pays["Lon_max"],
+    ):
+        index.setdefault(code_iso3a, [lat_max, lon_min, lat_min, lon_max])
+    CACHE_REFERENCES[cle] = (date_modification, index)
+
+    return index
+
+
+def grille_pays(data_pays, code_iso3a):
+    """
+    Objectif:
+        Définir les coordonées d'un rectangle contenant le pays selectionné
+
+    Paramètres :
+        data_pays : Fichier contenant tous les pays, leur code d'identification et les coordonnées du rectangle
+        code_iso3a : Code d'identification du pays
+
+    Pour des recherches répétées, utiliser index_pays
+    """
+
+    # Extraction des coordonnées (une seule recherche de la ligne du pays)
+    ligne = data_pays.loc[data_pays["ISO3"] == code_iso3a].iloc[0]
+
+    # Renvoi de l'array dans l'ordre demandé par l'API Copernicus
+    return [ligne["Lat_max"], ligne["Lon_min"], ligne["Lat_min"], ligne["Lon_max"]]
+
+
+def frontieres_pays(chemin="Pays_frontieres.geojson"):
+    """
+    Objectif :
+        Charger une seule fois les frontières des pays (fichier GeoJSON livré avec l'application, utilisable hors ligne)
+
+    Paramètres :
+        chemin : Chemin du fichier des frontières (propriété ISO3 de chaque pays)
+
+    Renvoie un dictionnaire code ISO3 -> liste des anneaux des polygones du pays (tableaux numpy longitude, latitude)
+    """
+
+    date_modification = os.stat(chemin).st_mtime_ns
+    cle = ("frontieres_pays", chemin)
+
+    en_memoire = CACHE_REFERENCES.get(cle)
+    if en_memoire is not None and en_memoire[0] == date_modification:
+        return en_memoire[1]
+
+    with open(chemin, encoding="utf-8") as fichier:
+        geojson = json.load(fichier)
+
+    # Polygones et multi-polygones ramenés à une liste d'anneaux (contours extérieurs et trous)
+    frontieres = {}
+    for feature in geojson["features"]:
+        geometrie = feature["geometry"]
+        polygones = (
+            [geometrie["coordinates"]]
+            if geometrie["type"] == "Polygon"
+            else geometrie["coordinates"]
+        )
+        frontieres.setdefault(feature["properties"]["ISO3"], []).extend(
+            np.asarray(anneau, dtype=np.float64)
+            for polygone in polygones
+            for anneau in polygone
+        )
+    CACHE_REFERENCES[cle] = (date_modification, frontieres)
+
+    return frontieres
+
+
+def points_dans_polygones(latitudes, longitudes, anneaux):
+    """
+    Objectif :
+        Tester en une seule opération vectorisée par côté de polygone si des points sont à l'intérieur (règle pair-impair)
+
+    Paramètres :
+        latitudes : Latitudes des points
+        longitudes : Longitudes des points (même forme que latitudes)
+        anneaux : Anneaux des polygones (tableaux longitude, latitude), cf frontieres_pays
+
+    Les trous et les polygones multiples sont gérés par la règle pair-impair sur l'ensemble des anneaux
+    """
+
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    dedans = np.zeros(latitudes.shape, dtype=bool)
+
+    for anneau in anneaux:
+        x, y = anneau[:, 0], anneau[:, 1]
+
+        # Seuls les points du rectangle englobant de l'anneau sont testés
+        candidats = np.flatnonzero(
+            (latitudes >= y.min())
+            & (latitudes <= y.max())
+            & (longitudes >= x.min())
+            & (longitudes <= x.max())
+        )
+        if len(candidats) == 0:
+            continue
+        lat = latitudes.ravel()[candidats]
+        lon = longitudes.ravel()[candidats]
+
+        # Nombre de côtés traversés par une demi-droite horizontale partant de chaque point
+        traverse = np.zeros(len(candidats), dtype=bool)
+        for x1, y1, x2, y2 in zip(x[:-1], y[:-1], x[1:], y[1:]):
+            if y1 == y2:
+                continue
+            coupe = (y1 > lat) != (y2 > lat)
+            traverse ^= coupe & (lon < x1 + (lat - y1) * (x2 - x1) / (y2 - y1))
+
+        dedans.ravel()[candidats] ^= traverse
+
+    return dedans
+
+
+@etape_suivie("masque_pays")
+def masque_pays(
+    latitudes,
+    longitudes,
+    code_iso3a,
+    chemin="Pays_frontieres.geojson",
+    dossier_masques=None,
+    marge=0.5,
+):
+    """
+    Objectif :
+        Calculer (ou relire) le masque des points de la grille situés dans le pays, afin de ne traiter que ces points
+
+    Paramètres :
+        latitudes : Liste de latitudes
+        longitudes : Liste de longitudes
+        code_iso3a : Code d'identification du pays
+        chemin : Chemin du fichier des frontières (cf frontieres_pays)
+        dossier_masques : Dossier où les masques sont conservés entre les processus (None -> pas d'enregistrement)
+        marge : Un point est gardé si le centre ou un coin de sa maille (décalé de marge x pas de grille) est dans le pays (côtes)
+
+    Renvoie une matrice booléenne (latitude, longitude), None si le pays n'a pas de frontière dans le fichier ou ne contient
+    aucun point de la grille (petits territoires). Ce repli sur le rectangle complet est signalé dans le journal
+    """
+
+    frontieres = frontieres_pays(chemin)
+    if code_iso3a not in frontieres:
+        details_etape(pays=code_iso3a, cache="sans_frontiere")
+
+        # Signalé une fois par processus (fonction appelée à chaque rafraîchissement de l'application)
+        cle_absent = ("masque_pays_absent", code_iso3a)
+        if cle_absent not in CACHE_REFERENCES:
+            CACHE_REFERENCES[cle_absent] = True
+            journal_erreur(
+                "masque_pays",
+                LookupError(
+                    f"Pays {code_iso3a} absent de {chemin} : masque non appliqué, rectangle complet traité"
+                ),
+            )
+        return None
+
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    nom = f"masque_{code_iso3a}_{nom_grille(latitudes, longitudes)}_{marge}_{os.stat(chemin).st_mtime_ns}.npy"
+    cle = ("masque_pays", nom)
+
+    # Masque déjà calculé dans ce processus ou enregistré
+    if cle in CACHE_REFERENCES:
+        details_etape(pays=code_iso3a, cache="memoire")
+        return CACHE_REFERENCES[cle]
+    chemin_masque = (
+        os.path.join(dossier_masques, nom) if dossier_masques is not None else None
+    )
+    if chemin_masque is not None and os.path.exists(chemin_masque):
+        masque = np.load(chemin_masque)
+        details_etape(pays=code_iso3a, cache="masque_existant")
+
+    else:
+        # Centre et coins de la maille de chaque point (longitudes des frontières entre -180 et 180)
+        pas_lat = abs(latitudes[1] - latitudes[0]) if len(latitudes) > 1 else 0
+        pas_lon = abs(longitudes[1] - longitudes[0]) if len(longitudes) > 1 else 0
+        lat_grille, lon_grille = np.meshgrid(latitudes, longitudes, indexing="ij")
+        lon_grille = (lon_grille + 180) % 360 - 180
+
+        masque = np.zeros(lat_grille.shape, dtype=bool)
+        for decalage_lat, decalage_lon in [(0, 0), (-1, -1), (-1, 1), (1, -1), (1, 1)]:
+            masque |= points_dans_polygones(
+                lat_grille + decalage_lat * marge * pas_lat,
+                lon_grille + decalage_lon * marge * pas_lon,
+                frontieres[code_iso3a],
+            )
+        details_etape(pays=code_iso3a, cache="construction_masque")
+
+        if chemin_masque is not None:
+            os.makedirs(dossier_masques, exist_ok=True)
+            chemin_tmp = chemin_temporaire(chemin_masque)
+            with open(chemin_tmp, "wb") as fichier:
+                np.save(fichier, masque)
+            os.replace(chemin_tmp, chemin_masque)
+
+    # Pays plus petit que la maille : aucun point -> tout le rectangle
+    if not masque.any():
+        masque = None
+        journal_erreur(
+            "masque_pays",
+            LookupError(
+                f"Aucun point de la grille dans le pays {code_iso3a} : masque non appliqué, rectangle complet traité"
+            ),
+        )
+    CACHE_REFERENCES[cle] = masque
+    details_etape(
+        points=len(latitudes) * len(longitudes),
+        points_pays=int(masque.sum()) if masque is not None else None,
+    )
+
+    return masque
+
+
+def requete_cds(
+    variables_selected,
+    year_selected,
+    month_selected,
+    day_selected,
+    time_selected,
+    country_grid,
+):
+    """
+    Objectif : Construire la requête d'extraction envoyée à l'API Copernicus (Show API request)
+
+    Paramètres :
+        variables_selected : variables de l'API
+        year_selected : années sélectionnées
+        month_selected : mois sélectionnés
+        day_selected : jours selectionés
+        time_selected : heures selectionnées
+        country_grid : Grille lat_max, lon_min, lat_min, lon_max
+    """
+
+    request = {
+        "product_type": ["reanalysis"],
+        "variable": variables_selected,
+        "year": year_selected,
+        "month": month_selected,
+        "day": day_selected,
+        "time": time_selected,
+        "data_format": "netcdf",
+        "download_format": "unarchived",
+        "area": country_grid,
+    }
+
+    return request
+
+
+def normaliser_requete(request):
+    """
+    Objectif :
+        Mettre une requête sous une forme unique (listes triées et sans doublon, dates et heures sur 2 chiffres, zone arrondie)
+        afin que deux requêtes équivalentes aient la même clé
+
+    Paramètres :
+        request : Requête d'extraction (cf requete_cds)
+    """
+
+    formats = {
+        "year": lambda valeur: f"{int(valeur):04d}",
+        "month": lambda valeur: f"{int(valeur):02d}",
+        "day": lambda valeur: f"{int(valeur):02d}",
+        "time": lambda valeur: f"{int(str(valeur).split(':')[0]):02d}:00",
+    }
+
+    request_normalisee = {}
+    for cle, valeur in request.items():
+        # La zone garde son ordre (lat_max, lon_min, lat_min, lon_max)
+        if cle == "area":
+            request_normalisee[cle] = [round(float(coord), 4) for coord in valeur]
+        elif isinstance(valeur, (list, tuple)):
+            request_normalisee[cle] = sorted(
+                {formats.get(cle, str)(element) for element in valeur}
+            )
+        else:
+            request_normalisee[cle] = str(valeur)
+
+    return request_normalisee
+
+
+def cle_requete(request):
+    """
+    Objectif : Calculer l'empreinte (sha256) de la requête normalisée, utilisée comme clé de cache
+
+    Paramètres :
+        request : Requête d'extraction (cf requete_cds)
+    """
+
+    contenu = json.dumps(normaliser_requete(request), sort_keys=True)
+
+    return hashlib.sha256(contenu.encode("utf-8")).hexdigest()
+
+
+def name_file(country_selected, choix, request):
+    """
+    Objectif :
+        Créer un nom automatique lors de la création d'un fichier de téléchargement
+
+    Paramètres :
+        country_selected : pays selectionné
+        choix : Choix de l'utilisateur entre soutenu_10m, soutenu_100m, rafale
+        request : Requête d'extraction (cf requete_cds)
+
+    Le nom contient le pays, la première date et la variable (lisibilité) puis la clé de la requête complète :
+    deux requêtes différentes (heures, dates, zone...) ne peuvent pas avoir le même nom
+    """
+
+    request_normalisee = normaliser_requete(request)
+
+    # Nom du fichier
+    final_name = (
+        "era_data_"
+        + str(country_selected)
+        + "_"
+        + request_normalisee["year"][0]
+        + "_"
+        + request_normalisee["month"][0]
+        + "_"
+        + request_normalisee["day"][0]
+        + "_"
+        + str(choix)
+        + "_"
+        + cle_requete(request)[:16]
+        + ".nc"
+    )
+
+    return final_name
+
+
+def choix_variable(choix):
+    """
+    Objectif : Sélectionner les variables de l'API en fonction du choix utilisateur
+
+    Paramètrs:
+        choix : Choix de l'utilisateur entre soutenu_10m, soutenu_100m, rafale
+    """
+
+    if choix == "soutenu_10m":
+        variables_selected = ["10m_u_component_of_wind", "10m_v_component_of_wind"]
+    elif choix == "soutenu_100m":
+        variables_selected = ["100m_u_component_of_wind", "100m_v_component_of_wind"]
+    elif choix == "rafale":
+        variables_selected = ["instantaneous_10m_wind_gust"]
+    else:
+        raise ValueError(
+            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
+        )
+
+    return variables_selected
+
+
+def chemin_temporaire(chemin):
+    """
+    Objectif : Nom de fichier temporaire propre au processus et au thread, renommé ensuite en chemin (écriture atomique)
+
+    Paramètres :
+        chemin : Chemin final du fichier
+    """
+
+    return chemin + f".{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+@contextlib.contextmanager
+def verrou_fichier(chemin, bloquant=True, intervalle=0.1):
+    """
+    Objectif :
+        Verrou exclusif entre processus (et entre threads) sur un fichier de verrou, libéré automatiquement si le processus s'arrête
+
+    Paramètres :
+        chemin : Chemin du fichier de verrou (créé si besoin)
+        bloquant : Attendre que le verrou soit libre (False -> renvoie False immédiatement si le verrou est pris)
+        intervalle : Délai entre deux essais en secondes (Windows)
+
+    Renvoie True si le verrou est obtenu
+    """
+
+    os.makedirs(os.path.dirname(chemin) or ".", exist_ok=True)
+    with open(chemin, "a+b") as fichier:
+        acquis = False
+        while not acquis:
+            try:
+                if fcntl is not None:
+                    fcntl.flock(
+                        fichier.fileno(),
+                        fcntl.LOCK_EX | (0 if bloquant else fcntl.LOCK_NB),
+                    )
+                else:
+                    fichier.seek(0)
+                    msvcrt.locking(fichier.fileno(), msvcrt.LK_NBLCK, 1)
+                acquis = True
+            except OSError:
+                if not bloquant:
+                    break
+                time.sleep(intervalle)
+
+        try:
+            yield acquis
+        finally:
+            if acquis:
+                if fcntl is not None:
+                    fcntl.flock(fichier.fileno(), fcntl.LOCK_UN)
+                else:
+                    fichier.seek(0)
+                    msvcrt.locking(fichier.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def verrou_dossier(name_folder):
+    """
+    Objectif :
+        Verrou des accès au manifeste du cache et à la file d'attente d'un dossier, partagé par les threads et les processus
+        (sessions Streamlit, batch.py...). Réentrant dans un même thread
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+    """
+
+    dossier = os.path.abspath(name_folder)
+    with VERROU_CACHE:
+        # Verrou déjà détenu par ce thread (seul le thread qui détient VERROU_CACHE peut arriver ici)
+        if dossier in DOSSIERS_VERROUILLES:
+            yield
+            return
+
+        with verrou_fichier(os.path.join(dossier, "verrous", "dossier.lock")):
+            DOSSIERS_VERROUILLES.add(dossier)
+            try:
+                yield
+            finally:
+                DOSSIERS_VERROUILLES.discard(dossier)
+
+
+def chemin_verrou(name_folder, filename):
+    """
+    Objectif : Fichier de verrou d'un téléchargement : un seul appel à l'API par fichier à la fois, tous processus confondus
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier téléchargé
+    """
+
+    return os.path.join(name_folder, "verrous", filename + ".lock")
+
+
+def lecture_manifest(name_folder):
+    """
+    Objectif : Lire le manifeste du cache de téléchargement (taille, empreinte, dates de création et de dernier accès de chaque fichier)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+    """
+
+    chemin = os.path.join(name_folder, "manifest.json")
+    if not os.path.exists(chemin):
+        return {}
+
+    with open(chemin, encoding="utf-8") as fichier:
+        return json.load(fichier)
+
+
+def ecriture_manifest(name_folder, manifest):
+    """
+    Objectif : Enregistrer le manifeste du cache (fichier temporaire puis renommage pour éviter un manifeste partiel)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        manifest : Dictionnaire nom de fichier -> informations
+    """
+
+    chemin = os.path.join(name_folder, "manifest.json")
+    chemin_tmp = chemin_temporaire(chemin)
+    with open(chemin_tmp, "w", encoding="utf-8") as fichier:
+        json.dump(manifest, fichier, indent=2, ensure_ascii=False)
+    os.replace(chemin_tmp, chemin)
+
+
+def empreinte_fichier(chemin, taille_bloc=1024 * 1024):
+    """
+    Objectif : Calculer l'empreinte sha256 d'un fichier par blocs
+
+    Paramètres :
+        chemin : Chemin du fichier
+        taille_bloc : Taille des blocs lus
+    """
+
+    empreinte = hashlib.sha256()
+    with open(chemin, "rb") as fichier:
+        for bloc in iter(lambda: fichier.read(taille_bloc), b""):
+            empreinte.update(bloc)
+
+    return empreinte.hexdigest()
+
+
+def chemin_zarr(name_folder, filename):
+    """
+    Objectif : Chemin du magasin Zarr d'un fichier téléchargé (cf conversion_zarr)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier NetCDF (cf name_file)
+    """
+
+    return os.path.join(name_folder, os.path.splitext(filename)[0] + ".zarr")
+
+
+def chemin_donnees(name_folder, filename):
+    """
+    Objectif : Chemin des données d'un fichier téléchargé : magasin Zarr s'il a été converti, sinon fichier NetCDF
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier NetCDF (cf name_file)
+    """
+
+    magasin = chemin_zarr(name_folder, filename)
+    if os.path.isdir(magasin):
+        return magasin
+
+    return os.path.join(name_folder, filename)
+
+
+def taille_donnees(chemin):
+    """
+    Objectif : Taille en octets d'un fichier NetCDF ou d'un magasin Zarr (dossier)
+
+    Paramètres :
+        chemin : Chemin du fichier ou du dossier
+    """
+
+    if os.path.isdir(chemin):
+        return sum(
+            os.path.getsize(os.path.join(racine, nom))
+            for racine, _, noms in os.walk(chemin)
+            for nom in noms
+        )
+
+    return os.path.getsize(chemin)
+
+
+def fichier_en_cache(name_folder, filename):
+    """
+    Objectif :
+        Vérifier qu'un fichier est présent et complet dans le cache et mettre à jour sa date de dernier accès (LRU)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier
+    """
+
+    with verrou_dossier(name_folder):
+        manifest = lecture_manifest(name_folder)
+        informations = manifest.get(filename)
+        full_path = chemin_donnees(name_folder, filename)
+
+        # Fichier absent du dossier ou du manifeste, ou taille différente (téléchargement incomplet)
+        if (
+            informations is None
+            or not os.path.exists(full_path)
+            or taille_donnees(full_path) != informations["taille"]
+        ):
+            return False
+
+        informations["dernier_acces"] = time.time()
+        ecriture_manifest(name_folder, manifest)
+
+    return True
+
+
+def enregistrement_cache(name_folder, filename, request):
+    """
+    Objectif : Ajouter un fichier téléchargé au manifeste du cache
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier
+        request : Requête d'extraction ayant produit le fichier
+    """
+
+    full_path = os.path.join(name_folder, filename)
+    maintenant = time.time()
+    informations = {
+        "cle": cle_requete(request),
+        "requete": normaliser_requete(request),
+        "taille": os.path.getsize(full_path),
+        "sha256": empreinte_fichier(full_path),
+        "creation": maintenant,
+        "dernier_acces": maintenant,
+    }
+
+    with verrou_dossier(name_folder):
+        manifest = lecture_manifest(name_folder)
+        manifest[filename] = informations
+        ecriture_manifest(name_folder, manifest)
+
+
+def eviction_cache(name_folder, taille_max, a_conserver=()):
+    """
+    Objectif :
+        Supprimer les fichiers les moins récemment utilisés (LRU) tant que la taille du cache dépasse taille_max
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        taille_max : Taille maximale du cache en octets
+        a_conserver : Noms de fichiers à ne jamais supprimer (ex : fichier qui vient d'être téléchargé)
+
+    Renvoie la liste des fichiers supprimés
+    """
+
+    with verrou_dossier(name_folder):
+        manifest = lecture_manifest(name_folder)
+        taille_totale = sum(
+            informations["taille"] for informations in manifest.values()
+        )
+
+        # Du plus ancien accès au plus récent
+        supprimes = []
+        for filename, informations in sorted(
+            manifest.items(), key=lambda element: element[1]["dernier_acces"]
+        ):
+            if taille_totale <= taille_max:
+                break
+            if filename in a_conserver:
+                continue
+
+            full_path = chemin_donnees(name_folder, filename)
+            if os.path.isdir(full_path):
+                shutil.rmtree(full_path)
+            elif os.path.exists(full_path):
+                os.remove(full_path)
+            taille_totale -= informations["taille"]
+            supprimes.append(filename)
+
+        for filename in supprimes:
+            del manifest[filename]
+        ecriture_manifest(name_folder, manifest)
+
+    return supprimes
+
+
+def requete_couverte(request_cache, request):
+    """
+    Objectif :
+        Vérifier qu'une requête déjà téléchargée contient toutes les données d'une nouvelle requête (variables, dates, heures et zone)
+
+    Paramètres :
+        request_cache : Requête normalisée du fichier en cache
+        request : Requête normalisée demandée
+    """
+
+    for cle, valeur in request.items():
+        valeur_cache = request_cache.get(cle)
+        if valeur_cache is None:
+            return False
+
+        # Zone : le rectangle demandé doit être inclus dans celui du fichier (lat_max, lon_min, lat_min, lon_max)
+        if cle == "area":
+            if not (
+                valeur[0] <= valeur_cache[0]
+                and valeur[1] >= valeur_cache[1]
+                and valeur[2] >= valeur_cache[2]
+                and valeur[3] <= valeur_cache[3]
+            ):
+                return False
+
+        # Variables, années, mois, jours et heures : sous-ensemble
+        elif isinstance(valeur, list):
+            if not set(valeur) <= set(valeur_cache):
+                return False
+
+        # Format, type de produit : identiques
+        elif valeur != valeur_cache:
+            return False
+
+    return True
+
+
+def recherche_cache(name_folder, request):
+    """
+    Objectif : Trouver dans le cache le plus petit fichier dont la requête couvre la requête demandée
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        request : Requête d'extraction (cf requete_cds)
+
+    Renvoie le nom du fichier ou None
+    """
+
+    request_normalisee = normaliser_requete(request)
+
+    candidats = [
+        (informations["taille"], filename)
+        for filename, informations in lecture_manifest(name_folder).items()
+        if requete_couverte(informations["requete"], request_normalisee)
+        and os.path.exists(chemin_donnees(name_folder, filename))
+    ]
+
+    if not candidats:
+        return None
+
+    return min(candidats)[1]
+
+
+def extraction_locale(chemin_source, request):
+    """
+    Objectif :
+        Extraire d'un fichier déjà téléchargé les variables, dates, heures et la zone d'une requête (sel xarray)
+
+    Paramètres :
+        chemin_source : Chemin du fichier (ou du magasin Zarr) couvrant la requête
+        request : Requête d'extraction (cf requete_cds)
+    """
+
+    import xarray as xr
+
+    request_normalisee = normaliser_requete(request)
+    lat_max, lon_min, lat_min, lon_max = request_normalisee["area"]
+
+    with xr.open_dataset(chemin_source) as dataset:
+        # Variables
+        extrait = dataset[
+            [VARIABLES_NETCDF[variable] for variable in request_normalisee["variable"]]
+        ]
+
+        # Dates et heures
+        temps = extrait["valid_time"].dt
+        masque = (
+            temps.year.isin([int(annee) for annee in request_normalisee["year"]])
+            & temps.month.isin([int(mois) for mois in request_normalisee["month"]])
+            & temps.day.isin([int(jour) for jour in request_normalisee["day"]])
+            & temps.hour.isin(
+                [int(heure.split(":")[0]) for heure in request_normalisee["time"]]
+            )
+        )
+        extrait = extrait.isel(valid_time=masque.values)
+
+        # Zone (latitudes décroissantes dans les fichiers ERA5)
+        extrait = extrait.sel(
+            latitude=slice(lat_max, lat_min), longitude=slice(lon_min, lon_max)
+        )
+
+        return extrait.load()
+
+
+def requete_locale(name_folder, filename, request):
+    """
+    Objectif :
+        Répondre à une requête sans appel à l'API : fichier déjà en cache ou extraction d'un fichier plus large
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier (cf name_file)
+        request : Requête d'extraction (cf requete_cds)
+
+    Renvoie un message, ou None si un appel à l'API est nécessaire
+    """
+
+    full_path = os.path.join(name_folder, filename)
+
+    # Fichier déjà présent dans le cache -> pas d'appel à l'API
+    if fichier_en_cache(name_folder, filename):
+        details_etape(cache="fichier")
+        return f"Fichier {filename} déjà existant"
+
+    # Fichier plus large (heures, zone, variables) déjà présent -> extraction locale
+    source = recherche_cache(name_folder, request)
+    if source is not None:
+        full_path_tmp = chemin_temporaire(full_path)
+        extraction_locale(chemin_donnees(name_folder, source), request).to_netcdf(
+            full_path_tmp
+        )
+        os.replace(full_path_tmp, full_path)
+        fichier_en_cache(
+            name_folder, source
+        )  # Mise à jour du dernier accès de la source
+        enregistrement_cache(name_folder, filename, request)
+        details_etape(cache="extraction", source=source)
+        return f"Fichier {filename} extrait du fichier {source} déjà existant"
+
+    details_etape(cache="absent")
+    return None
+
+
+@etape_suivie("requete_api")
+def requete_api(
+    cdsapi_url,
+    cdsapi_key,
+    filename,
+    name_folder,
+    request,
+    taille_max_cache=None,
+    fabrique_client=None,
+):
+    """
+    Objectif : Requeter l'API Copernicus en fonction des choix faits par l'utilisateur
+
+    Paramètres :
+        cdsapi_url : URL de l'API
+        cdsapi_key : Clé de l'utilisateur
+        filename : Nom du fichier (cf name_file)
+        name_folder : Dossier des fichiers téléchargés
+        request : Requête d'extraction (cf requete_cds)
+        taille_max_cache : Taille maximale du dossier en octets (None -> pas de limite)
+        fabrique_client : Fonction (url, key) -> client de l'API (None -> cdsapi.Client), permet d'utiliser un autre serveur
+    """
+
+    import cdsapi
+
+    # Sous dossier pour enregistrer les fichiers .nc
+    folder = name_folder
+
+    # Création du sous dossier si il n'existe pas
+    os.makedirs(folder, exist_ok=True)
+    full_path = os.path.join(folder, filename)
+    details_etape(fichier=filename)
+
+    # Un seul appel à l'API par fichier : une requête identique (autre session ou processus) attend la fin du
+    # téléchargement en cours puis trouve le fichier dans le cache
+    with verrou_fichier(chemin_verrou(folder, filename)):
+        # Fichier en cache ou extraction locale
+        message = requete_locale(folder, filename, request)
+        if message is not None:
+            return message
+
+        # Appel de l'API
+        fabrique_client = cdsapi.Client if fabrique_client is None else fabrique_client
+        client = fabrique_client(url=cdsapi_url, key=cdsapi_key)
+
+        # Récupération des données et téléchargement (fichier temporaire puis renommage)
+        full_path_tmp = chemin_temporaire(full_path)
+        with suivi_etape("attente_cds"):
+            resultat = client.retrieve(DATASET_ERA5, request)
+        with suivi_etape("telechargement"):
+            resultat.download(target=full_path_tmp)
+        os.replace(full_path_tmp, full_path)
+        enregistrement_cache(folder, filename, request)
+        details_etape(octets=os.path.getsize(full_path))
+
+    # Limitation de la taille du cache
+    if taille_max_cache is not None:
+        eviction_cache(folder, taille_max_cache, a_conserver=(filename,))
+
+    return f"Fichier {filename} a été téléchargé avec succès"
+
+
+def lecture_file_attente(name_folder):
+    """
+    Objectif : Lire l'état de la file d'attente de téléchargement (un job par fichier)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+    """
+
+    chemin = os.path.join(name_folder, "file_attente.json")
+    if not os.path.exists(chemin):
+        return {}
+
+    with open(chemin, encoding="utf-8") as fichier:
+        return json.load(fichier)
+
+
+def ecriture_file_attente(name_folder, jobs):
+    """
+    Objectif : Enregistrer l'état de la file d'attente (fichier temporaire puis renommage)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        jobs : Dictionnaire nom de fichier -> état du job
+    """
+
+    os.makedirs(name_folder, exist_ok=True)
+    chemin = os.path.join(name_folder, "file_attente.json")
+    chemin_tmp = chemin_temporaire(chemin)
+    with open(chemin_tmp, "w", encoding="utf-8") as fichier:
+        json.dump(jobs, fichier, indent=2, ensure_ascii=False)
+    os.replace(chemin_tmp, chemin)
+
+
+def ajout_file_attente(name_folder, filenames, requests):
+    """
+    Objectif :
+        Ajouter des téléchargements à la file d'attente (un job déjà en file n'est pas dupliqué, un job en échec ou dont le fichier a été supprimé est relancé)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filenames : Noms des fichiers (cf name_file)
+        requests : Requêtes d'extraction associées
+    """
+
+    with verrou_dossier(name_folder):
+        jobs = lecture_file_attente(name_folder)
+        for filename, request in zip(filenames, requests):
+            job = jobs.get(filename)
+
+            # Job en cours, ou terminé et fichier toujours en cache (pas supprimé par l'éviction)
+            if job is not None and job["etat"] in ("en_attente", "en_cours"):
+                continue
+            if job is not None and job["etat"] == "termine":
+                if fichier_en_cache(name_folder, filename):
+                    continue
+
+            jobs[filename] = {
+                "requete": request,
+                "etat": "en_attente",
+                "tentatives": 0,
+                "prochain_essai": 0,
+                "id_requete": None,
+                "url": None,
+                "octets": 0,
+                "taille_totale": None,
+                "erreur": None,
+                "maj": time.time(),
+            }
+        ecriture_file_attente(name_folder, jobs)
+
+
+def mise_a_jour_job(name_folder, filename, **modifications):
+    """
+    Objectif : Modifier l'état d'un job de la file d'attente
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier du job
+        modifications : Champs à modifier (etat, tentatives, octets...)
+    """
+
+    with verrou_dossier(name_folder):
+        jobs = lecture_file_attente(name_folder)
+        jobs[filename].update(modifications, maj=time.time())
+        ecriture_file_attente(name_folder, jobs)
+
+    return jobs[filename]
+
+
+def prise_job(name_folder):
+    """
+    Objectif : Réserver le plus ancien job en attente dont la date de nouvel essai est passée
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+
+    Renvoie (nom du fichier, job) ou None si aucun job n'est disponible
+    """
+
+    with verrou_dossier(name_folder):
+        jobs = lecture_file_attente(name_folder)
+        disponibles = [
+            (job["maj"], filename)
+            for filename, job in jobs.items()
+            if job["etat"] == "en_attente" and job["prochain_essai"] <= time.time()
+        ]
+        if not disponibles:
+            return None
+
+        filename = min(disponibles)[1]
+        job = mise_a_jour_job(name_folder, filename, etat="en_cours")
+
+    return filename, job
+
+
+def telechargement_reprise(url, full_path, progression=None, taille_bloc=1024 * 1024):
+    """
+    Objectif :
+        Télécharger un fichier en HTTP dans full_path.part en reprenant là où un téléchargement interrompu s'est arrêté (en-tête Range)
+
+    Paramètres :
+        url : Adresse du résultat (le fichier .part doit provenir de cette même adresse, cf execution_job)
+        full_path : Chemin final du fichier
+        progression : Fonction (octets reçus, taille totale) appelée après chaque bloc
+        taille_bloc : Taille des blocs écrits
+
+    Le fichier n'est renommé que si sa taille est celle annoncée par le serveur (Content-Range ou Content-Length)
+    """
+
+    import requests
+
+    chemin_part = full_path + ".part"
+    deja_recus = os.path.getsize(chemin_part) if os.path.exists(chemin_part) else 0
+    entetes = {"Range": f"bytes={deja_recus}-"} if deja_recus else {}
+    taille_totale = None
+
+    with requests.get(url, headers=entetes, stream=True, timeout=60) as reponse:
+        # Taille totale annoncée par le serveur : "bytes debut-fin/total" ou "bytes */total"
+        plage = reponse.headers.get("Content-Range", "")
+        if "/" in plage and not plage.endswith("/*"):
+            taille_totale = int(plage.rsplit("/", 1)[1])
+
+        # 416 : la partie déjà reçue est complète (vérifiée ci-dessous si le serveur donne la taille)
+        if reponse.status_code != 416:
+            reponse.raise_for_status()
+
+            # Serveur sans reprise -> on recommence depuis le début
+            if reponse.status_code != 206:
+                deja_recus = 0
+                taille_totale = int(reponse.headers.get("Content-Length", 0)) or None
+
+            # Reprise à une autre position que la fin du fichier .part -> fichier inutilisable
+            elif not plage.startswith(f"bytes {deja_recus}-"):
+                os.remove(chemin_part)
+                raise IOError(
+                    f"Erreur : reprise refusée pour {full_path} (Content-Range : {plage})"
+                )
+
+            with open(chemin_part, "ab" if deja_recus else "wb") as fichier:
+                for bloc in reponse.iter_content(taille_bloc):
+                    fichier.write(bloc)
+                    deja_recus += len(bloc)
+                    if progression is not None:
+                        progression(deja_recus, taille_totale)
+
+    # Taille finale différente de celle annoncée : téléchargement incomplet (reprise au prochain essai) ou fichier corrompu
+    if taille_totale is not None and deja_recus != taille_totale:
+        if deja_recus > taille_totale:
+            os.remove(chemin_part)
+        raise IOError(
+            f"Erreur : {full_path} incomplet ({deja_recus} octets sur {taille_totale})"
+        )
+
+    os.replace(chemin_part, full_path)
+
+
+def soumission_cds(client, request):
+    """
+    Objectif : Soumettre une requête à l'API sans attendre son traitement
+
+    Paramètres :
+        client : Client de l'API (cdsapi.Client)
+        request : Requête d'extraction (cf requete_cds)
+
+    Renvoie l'identifiant de la requête côté API (suivi par resultat_cds, y compris après un redémarrage)
+    """
+
+    client.wait_until_complete = False
+    resultat = client.retrieve(DATASET_ERA5, request)
+
+    # Client actuel (ecmwf.datastores) : Remote.request_id, ancien client cdsapi : réponse JSON
+    if hasattr(resultat, "request_id"):
+        return resultat.request_id
+
+    return resultat.reply["request_id"]
+
+
+def resultat_cds(client, id_requete):
+    """
+    Objectif : Interroger l'API sur l'état d'une requête soumise
+
+    Paramètres :
+        client : Client de l'API (cdsapi.Client)
+        id_requete : Identifiant de la requête (cf soumission_cds)
+
+    Renvoie l'adresse du résultat, None si la requête est encore en file ou en cours. Erreur si la requête a échoué
+    """
+
+    import cdsapi
+
+    # Client actuel (ecmwf.datastores)
+    if hasattr(client, "client"):
+        remote = client.client.get_remote(id_requete)
+        if not remote.results_ready:
+            return None
+        return remote.get_results().location
+
+    # Ancien client cdsapi : état de la tâche
+    resultat = cdsapi.api.Result(client, {"request_id": id_requete})
+    resultat.update()
+    etat = resultat.reply["state"]
+    if etat == "completed":
+        return resultat.location
+    if etat in ("queued", "running"):
+        return None
+    raise RuntimeError(
+        f"Erreur : requête {id_requete} en échec ({resultat.reply.get('error')})"
+    )
+
+
+def attente_cds(client, id_requete, delai_max=60):
+    """
+    Objectif : Attendre la fin du traitement d'une requête soumise (interrogation avec un délai croissant)
+
+    Paramètres :
+        client : Client de l'API (cdsapi.Client)
+        id_requete : Identifiant de la requête (cf soumission_cds)
+        delai_max : Délai maximal entre deux interrogations en secondes
+
+    Renvoie l'adresse du résultat
+    """
+
+    delai = 1.0
+    while True:
+        url = resultat_cds(client, id_requete)
+        if url is not None:
+            return url
+        time.sleep(delai)
+        delai = min(delai * 1.5, delai_max)
+
+
+def progression_job(name_folder, filename, intervalle=1.0):
+    """
+    Objectif :
+        Fonction de progression d'un téléchargement (cf telechargement_reprise) qui met à jour le job au plus une fois par
+        intervalle et à la fin (chaque mise à jour réécrit la file d'attente sous le verrou du dossier)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier du job
+        intervalle : Délai minimal entre deux mises à jour en secondes
+    """
+
+    derniere = 0.0
+
+    def progression(octets, taille_totale):
+        nonlocal derniere
+        maintenant = time.monotonic()
+        if maintenant - derniere >= intervalle or octets == taille_totale:
+            derniere = maintenant
+            mise_a_jour_job(
+                name_folder, filename, octets=octets, taille_totale=taille_totale
+            )
+
+    return progression
+
+
+@etape_suivie("execution_job")
+def execution_job(
+    cdsapi_url,
+    cdsapi_key,
+    name_folder,
+    filename,
+    job,
+    fabrique_client,
+    taille_max_cache=None,
+):
+    """
+    Objectif :
+        Réaliser un job de la file d'attente : réponse locale si possible, sinon soumission à l'API puis téléchargement avec reprise
+
+    Paramètres :
+        cdsapi_url : URL de l'API
+        cdsapi_key : Clé de l'utilisateur
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier du job
+        job : État du job (cf ajout_file_attente)
+        fabrique_client : Fonction (url, key) -> client de l'API
+        taille_max_cache : Taille maximale du dossier en octets (None -> pas de limite)
+    """
+
+    full_path = os.path.join(name_folder, filename)
+    request = job["requete"]
+    details_etape(fichier=filename, essai=job["tentatives"] + 1)
+
+    # Fichier en cache ou extraction locale
+    message = requete_locale(name_folder, filename, request)
+    if message is not None:
+        return message
+
+    # Résultat pas encore disponible : soumission sans attente (identifiant enregistré tout de suite dans la file), puis
+    # suivi de la requête. Un worker redémarré pendant l'attente reprend le suivi de la même requête
+    url = job["url"]
+    if url is None:
+        import requests
+
+        client = fabrique_client(url=cdsapi_url, key=cdsapi_key)
+        id_requete = job["id_requete"]
+        if id_requete is None:
+            id_requete = soumission_cds(client, request)
+            mise_a_jour_job(name_folder, filename, id_requete=id_requete)
+
+        try:
+            with suivi_etape("attente_cds", id_requete=id_requete) as attente:
+                url = attente_cds(client, id_requete)
+        except (requests.ConnectionError, requests.Timeout):
+            raise
+        except Exception:
+            # Requête en échec ou inconnue de l'API -> nouvelle soumission au prochain essai
+            mise_a_jour_job(name_folder, filename, id_requete=None)
+            raise
+
+        # Nouvelle adresse : un fichier .part reçu d'une adresse précédente ne peut pas être complété
+        if os.path.exists(full_path + ".part"):
+            os.remove(full_path + ".part")
+        mise_a_jour_job(
+            name_folder, filename, url=url, duree_attente=attente["duree_s"]
+        )
+
+    # Téléchargement avec reprise et suivi de la progression
+    with suivi_etape("telechargement") as telechargement:
+        telechargement_reprise(
+            url, full_path, progression=progression_job(name_folder, filename)
+        )
+
+    enregistrement_cache(name_folder, filename, request)
+    details_etape(octets=os.path.getsize(full_path))
+    mise_a_jour_job(
+        name_folder, filename, duree_telechargement=telechargement["duree_s"]
+    )
+
+    # Limitation de la taille du cache
+    if taille_max_cache is not None:
+        eviction_cache(name_folder, taille_max_cache, a_conserver=(filename,))
+
+    return f"Fichier {filename} a été téléchargé avec succès"
+
+
+def worker_file_attente(
+    cdsapi_url,
+    cdsapi_key,
+    name_folder,
+    fabrique_client,
+    taille_max_cache,
+    tentatives_max,
+    delai_base,
+    delai_max,
+    arret,
+    conversion=False,
+):
+    """
+    Objectif :
+        Boucle d'un worker : prendre un job, l'exécuter, et en cas d'erreur le replanifier avec un délai exponentiel
+
+    Paramètres :
+        cdsapi_url : URL de l'API
+        cdsapi_key : Clé de l'utilisateur
+        name_folder : Dossier des fichiers téléchargés
+        fabrique_client : Fonction (url, key) -> client de l'API
+        taille_max_cache : Taille maximale du dossier en octets (None -> pas de limite)
+        tentatives_max : Nombre d'essais avant de passer le job en échec
+        delai_base : Délai avant le 2ème essai en secondes (doublé à chaque essai)
+        delai_max : Délai maximal entre deux essais en secondes
+        arret : threading.Event permettant d'arrêter le worker
+        conversion : Convertir chaque fichier téléchargé en magasin Zarr (cf conversion_zarr)
+    """
+
+    import requests
+
+    while not arret.is_set():
+        prise = prise_job(name_folder)
+
+        # Aucun job disponible -> nouvelle vérification une seconde plus tard
+        if prise is None:
+            arret.wait(1.0)
+            continue
+
+        filename, job = prise
+        try:
+            # Verrou du fichier : pas de double appel à l'API avec requete_api ou un autre processus
+            with verrou_fichier(chemin_verrou(name_folder, filename)):
+                execution_job(
+                    cdsapi_url,
+                    cdsapi_key,
+                    name_folder,
+                    filename,
+                    job,
+                    fabrique_client,
+                    taille_max_cache,
+                )
+                if conversion:
+                    # Magasin non conforme (cf controle_zarr) : le fichier NetCDF téléchargé est conservé
+                    try:
+                        conversion_zarr(name_folder, filename)
+                    except ValueError as erreur:
+                        journal_erreur("conversion_zarr", erreur)
+            mise_a_jour_job(name_folder, filename, etat="termine", erreur=None)
+
+        except Exception as erreur:
+            tentatives = job["tentatives"] + 1
+
+            # Adresse de résultat refusée (expirée) -> nouvelle adresse demandée au prochain essai, fichier .part supprimé
+            # (sinon l'adresse enregistrée pendant le job est conservée pour reprendre le téléchargement)
+            adresse = {}
+            if isinstance(erreur, requests.HTTPError):
+                adresse = {"url": None}
+                chemin_part = os.path.join(name_folder, filename) + ".part"
+                if os.path.exists(chemin_part):
+                    os.remove(chemin_part)
+
+            if tentatives >= tentatives_max:
+                mise_a_jour_job(
+                    name_folder,
+                    filename,
+                    etat="echec",
+                    tentatives=tentatives,
+                    erreur=str(erreur),
+                    **adresse,
+                )
+            else:
+                mise_a_jour_job(
+                    name_folder,
+                    filename,
+                    etat="en_attente",
+                    tentatives=tentatives,
+                    erreur=str(erreur),
+                    **adresse,
+                    prochain_essai=time.time()
+                    + min(delai_base * 2 ** (tentatives - 1), delai_max),
+                )
+
+
+def demarrage_file_attente(
+    cdsapi_url,
+    cdsapi_key,
+    name_folder,
+    taille_max_cache=None,
+    fabrique_client=None,
+    nb_workers=4,
+    tentatives_max=5,
+    delai_base=30,
+    delai_max=1800,
+    conversion=False,
+):
+    """
+    Objectif :
+        Démarrer (une seule fois par processus et par dossier) les workers qui traitent la file d'attente en arrière-plan
+
+    Paramètres :
+        cdsapi_url : URL de l'API
+        cdsapi_key : Clé de l'utilisateur
+        name_folder : Dossier des fichiers téléchargés
+        taille_max_cache : Taille maximale du dossier en octets (None -> pas de limite)
+        fabrique_client : Fonction (url, key) -> client de l'API (None -> cdsapi.Client)
+        nb_workers : Nombre de téléchargements simultanés
+        tentatives_max : Nombre d'essais avant de passer un job en échec
+        delai_base : Délai avant le 2ème essai en secondes (doublé à chaque essai)
+        delai_max : Délai maximal entre deux essais en secondes
+        conversion : Convertir chaque fichier téléchargé en magasin Zarr (cf conversion_zarr, nécessite zarr)
+
+    Renvoie l'Event permettant d'arrêter les workers
+    """
+
+    import cdsapi
+
+    # zarr absent -> erreur immédiate plutôt qu'un échec de chaque job
+    if conversion:
+        import zarr
+
+    with verrou_dossier(name_folder):
+        # Workers déjà démarrés pour ce dossier
+        if name_folder in WORKERS_FILE_ATTENTE:
+            arret, workers = WORKERS_FILE_ATTENTE[name_folder]
+            if any(worker.is_alive() for worker in workers):
+                return arret
+
+        # Jobs interrompus lors d'un arrêt précédent -> de nouveau en attente (la reprise utilise le fichier .part)
+        # Un job dont le verrou est pris est en cours dans un autre processus (autre session, batch.py) et n'est pas repris
+        jobs = lecture_file_attente(name_folder)
+        for filename, job in jobs.items():
+            if job["etat"] == "en_cours":
+                with verrou_fichier(
+                    chemin_verrou(name_folder, filename), bloquant=False
+                ) as libre:
+                    if libre:
+                        job["etat"] = "en_attente"
+        ecriture_file_attente(name_folder, jobs)
+
+        fabrique_client = cdsapi.Client if fabrique_client is None else fabrique_client
+        arret = threading.Event()
+        workers = [
+            threading.Thread(
+                target=worker_file_attente,
+                args=(
+                    cdsapi_url,
+                    cdsapi_key,
+                    name_folder,
+                    fabrique_client,
+                    taille_max_cache,
+                    tentatives_max,
+                    delai_base,
+                    delai_max,
+                    arret,
+                    conversion,
+                ),
+                daemon=True,
+            )
+            for _ in range(nb_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        WORKERS_FILE_ATTENTE[name_folder] = (arret, workers)
+
+    return arret
+
+
+def tuiles_zone(country_grid, taille_tuile=TAILLE_TUILE):
+    """
+    Objectif :
+        Lister les tuiles de la grille fixe de téléchargement qui couvrent une zone (tuiles alignées sur la grille ERA5)
+
+    Paramètres :
+        country_grid : Grille lat_max, lon_min, lat_min, lon_max
+        taille_tuile : Côté des tuiles en degrés (multiple de PAS_ERA5)
+
+    Une tuile contient les points de [sud, sud + taille - pas] x [ouest, ouest + taille - pas] : deux tuiles voisines n'ont
+    aucun point commun et se raccordent sans doublon. Renvoie la zone de chaque tuile (lat_max, lon_min, lat_min, lon_max)
+    """
+
+    lat_max, lon_min, lat_min, lon_max = country_grid
+
+    # Points extrêmes de la grille ERA5 contenus dans la zone (longitude 180 = -180 sur la grille)
+    lat_bas = np.ceil(lat_min / PAS_ERA5) * PAS_ERA5
+    lat_haut = np.floor(lat_max / PAS_ERA5) * PAS_ERA5
+    lon_bas = np.ceil(lon_min / PAS_ERA5) * PAS_ERA5
+    lon_haut = min(np.floor(lon_max / PAS_ERA5) * PAS_ERA5, 180 - PAS_ERA5)
+
+    tuiles = []
+    for sud in range(
+        int(np.floor(lat_haut / taille_tuile)),
+        int(np.floor(lat_bas / taille_tuile)) - 1,
+        -1,
+    ):
+        for ouest in range(
+            int(np.floor(lon_bas / taille_tuile)),
+            int(np.floor(lon_haut / taille_tuile)) + 1,
+        ):
+            tuiles.append(
+                [
+                    min(sud * taille_tuile + taille_tuile - PAS_ERA5, 90),
+                    ouest * taille_tuile,
+                    sud * taille_tuile,
+                    min(ouest * taille_tuile + taille_tuile - PAS_ERA5, 180 - PAS_ERA5),
+                ]
+            )
+
+    return tuiles
+
+
+def nom_tuile(zone):
+    """
+    Objectif : Libellé d'une zone de téléchargement (coin sud-ouest), utilisé à la place du pays dans le nom des fichiers (cf name_file)
+
+    Paramètres :
+        zone : Zone lat_max, lon_min, lat_min, lon_max (cf tuiles_zone)
+    """
+
+    return f"tuile_{float(zone[2]):.2f}_{float(zone[1]):.2f}"
+
+
+def decoupage_requetes(
+    variables_selected,
+    date_debut,
+    date_fin,
+    time_selected,
+    country_grid,
+    taille_tuile=None,
+):
+    """
+    Objectif :
+        Découper une période en requêtes adaptées à l'API Copernicus : une requête par mois et par variable
+        (et par tuile de la grille fixe si taille_tuile est renseigné)
+
+    Paramètres :
+        variables_selected : variables de l'API
+        date_debut : Premier jour de la période (inclus)
+        date_fin : Dernier jour de la période (inclus)
+        time_selected : heures selectionnées
+        country_grid : Grille lat_max, lon_min, lat_min, lon_max
+        taille_tuile : Côté des tuiles en degrés (None -> une seule requête sur la zone du pays)
+
+    Les tuiles sont communes à tous les pays : les pays voisins partagent les fichiers téléchargés (cf ouverture_periode)
+    """
+
+    zones = (
+        [country_grid]
+        if taille_tuile is None
+        else tuiles_zone(country_grid, taille_tuile)
+    )
+
+    # Jours de la période regroupés par mois
+    jours_par_mois = {}
+    jour = date_debut
+    while jour <= date_fin:
+        jours_par_mois.setdefault((jour.year, jour.month), []).append(jour.day)
+        jour += timedelta(days=1)
+
+    requests = [
+        requete_cds([variable], [annee], [mois], jours, time_selected, zone)
+        for (annee, mois), jours in jours_par_mois.items()
+        for variable in variables_selected
+        for zone in zones
+    ]
+
+    return requests
+
+
+def requete_periode(
+    cdsapi_url,
+    cdsapi_key,
+    filenames,
+    name_folder,
+    requests,
+    taille_max_cache=None,
+    nb_workers=4,
+    fabrique_client=None,
+):
+    """
+    Objectif :
+        Télécharger en parallèle les requêtes d'une période (cf decoupage_requetes) avec un nombre limité de téléchargements simultanés
+
+    Paramètres :
+        cdsapi_url : URL de l'API
+        cdsapi_key : Clé de l'utilisateur
+        filenames : Noms des fichiers (un par requête, cf name_file)
+        name_folder : Dossier des fichiers téléchargés
+        requests : Requêtes d'extraction
+        taille_max_cache : Taille maximale du dossier en octets (None -> pas de limite)
+        nb_workers : Nombre maximal de requêtes envoyées simultanément
+        fabrique_client : Fonction (url, key) -> client de l'API (None -> cdsapi.Client)
+
+    Renvoie le message de requete_api pour chaque fichier
+    """
+
+    with ThreadPoolExecutor(max_workers=nb_workers) as executor:
+        messages = list(
+            executor.map(
+                lambda filename, request: requete_api(
+                    cdsapi_url,
+                    cdsapi_key,
+                    filename,
+                    name_folder,
+                    request,
+                    taille_max_cache,
+                    fabrique_client,
+                ),
+                filenames,
+                requests,
+            )
+        )
+
+    return messages
+
+
+@etape_suivie("conversion_zarr")
+def conversion_zarr(name_folder, filename, taille_bloc=24):
+    """
+    Objectif :
+        Convertir un fichier téléchargé en magasin Zarr compressé : composantes du vent quantifiées en int16 (centième de m/s),
+        blocs de taille_bloc pas de temps sur toute la zone. Le fichier NetCDF est ensuite supprimé
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        filename : Nom du fichier NetCDF (cf name_file)
+        taille_bloc : Nombre de pas de temps par bloc (mêmes blocs que max_magnitude_temporelle)
+
+    Les lectures sont différées et ne décompressent que les blocs utiles. Le magasin est relu et comparé au fichier
+    source avant de le remplacer (cf controle_zarr). Nécessite zarr. Renvoie le chemin du magasin
+    """
+
+    import xarray as xr
+    from numcodecs import FixedScaleOffset
+
+    full_path = os.path.join(name_folder, filename)
+    magasin = chemin_zarr(name_folder, filename)
+
+    # Fichier déjà converti
+    if not os.path.exists(full_path):
+        return magasin
+
+    magasin_tmp = chemin_temporaire(magasin)
+    with xr.open_dataset(full_path) as dataset:
+        dataset = dataset.drop_encoding()
+        encodage = {}
+        for nom, variable in list(dataset.data_vars.items()):
+            encodage[nom] = {
+                "chunks": tuple(
+                    min(taille_bloc, taille) if dimension == "valid_time" else taille
+                    for dimension, taille in variable.sizes.items()
+                )
+            }
+            if nom not in VARIABLES_NETCDF.values():
+                continue
+
+            # Filtre int16 du magasin : relu directement en float32, sans valeur manquante possible
+            # Le filtre lit les données en float32 : une variable float64 (extraction d'un magasin relu) est convertie avant
+            if not bool(variable.isnull().any()):
+                dataset[nom] = variable.astype(np.float32)
+                encodage[nom]["filters"] = [
+                    FixedScaleOffset(
+                        offset=0,
+                        scale=round(1 / ECHELLE_ZARR),
+                        dtype="<f4",
+                        astype="<i2",
+                    )
+                ]
+
+            # Valeurs manquantes -> codage CF (valeur de remplissage, relu en float64)
+            else:
+                encodage[nom].update(
+                    dtype="int16",
+                    scale_factor=ECHELLE_ZARR,
+                    _FillValue=np.int16(MANQUANT_ZARR),
+                )
+        dataset.to_zarr(magasin_tmp, mode="w", encoding=encodage, zarr_format=2)
+
+        # Magasin relu et comparé à la source : pas de remplacement si la quantification a altéré les données
+        try:
+            controle_zarr(dataset, magasin_tmp, taille_bloc)
+        except ValueError:
+            shutil.rmtree(magasin_tmp, ignore_errors=True)
+            raise
+
+    # Remplacement du fichier NetCDF par le magasin (taille du cache mise à jour)
+    octets_netcdf = os.path.getsize(full_path)
+    with verrou_dossier(name_folder):
+        if os.path.isdir(magasin):
+            shutil.rmtree(magasin)
+        os.replace(magasin_tmp, magasin)
+        manifest = lecture_manifest(name_folder)
+        if filename in manifest:
+            manifest[filename].update(format="zarr", taille=taille_donnees(magasin))
+            ecriture_manifest(name_folder, manifest)
+        os.remove(full_path)
+    details_etape(octets_netcdf=octets_netcdf, octets_zarr=taille_donnees(magasin))
+
+    return magasin
+
+
+def controle_zarr(source, magasin, taille_bloc=24):
+    """
+    Objectif :
+        Vérifier qu'un magasin Zarr écrit par conversion_zarr restitue les composantes du vent de la source à la précision de
+        stockage (demi-centième de m/s) et aux mêmes valeurs manquantes
+
+    Paramètres :
+        source : Dataset xarray converti
+        magasin : Chemin du magasin Zarr
+        taille_bloc : Nombre de pas de temps comparés à la fois
+
+    Lève une ValueError si un écart dépasse la précision de stockage
+    """
+
+    import xarray as xr
+
+    # Demi-pas de quantification, plus l'arrondi float32 des vents forts
+    tolerance = ECHELLE_ZARR / 2 + 1e-4
+
+    with xr.open_dataset(magasin, engine="zarr") as relu:
+        for nom in source.data_vars:
+            if nom not in VARIABLES_NETCDF.values():
+                continue
+            for debut in range(0, source.sizes["valid_time"], taille_bloc):
+                bloc = slice(debut, debut + taille_bloc)
+                attendu = np.asarray(source[nom].isel(valid_time=bloc), np.float64)
+                obtenu = np.asarray(relu[nom].isel(valid_time=bloc), np.float64)
+                manquants = np.isnan(attendu)
+                ecart = np.abs(obtenu - attendu)
+                if np.any(np.isnan(obtenu) != manquants) or np.any(
+                    ecart[~manquants] > tolerance
+                ):
+                    raise ValueError(
+                        f"Erreur : le magasin Zarr {magasin} ne restitue pas {nom} "
+                        f"(écart maximal {np.nanmax(ecart):.4f} m/s)."
+                    )
+
+
+def archivage_zarr(name_folder, taille_bloc=24):
+    """
+    Objectif : Convertir en magasins Zarr tous les fichiers NetCDF du cache (archive existante, cf conversion_zarr)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés
+        taille_bloc : Nombre de pas de temps par bloc
+
+    Renvoie la liste des fichiers convertis
+    """
+
+    convertis = []
+    for filename, informations in lecture_manifest(name_folder).items():
+        if informations.get("format", "netcdf") == "netcdf":
+            with verrou_fichier(chemin_verrou(name_folder, filename)):
+                if os.path.exists(os.path.join(name_folder, filename)):
+                    # Magasin non conforme (cf controle_zarr) : le fichier NetCDF est conservé
+                    try:
+                        conversion_zarr(name_folder, filename, taille_bloc)
+                    except ValueError as erreur:
+                        journal_erreur("conversion_zarr", erreur)
+                        continue
+                    convertis.append(filename)
+
+    return convertis
+
+
+@etape_suivie("ouverture_periode")
+def ouverture_periode(name_folder, filenames, zone=None):
+    """
+    Objectif :
+        Ouvrir les fichiers d'une période et les regrouper en un seul dataset (variables fusionnées, mois concaténés selon valid_time,
+        tuiles assemblées selon latitude et longitude)
+
+    Paramètres :
+        name_folder : Dossier des fichiers téléchargés ("" -> filenames sont des chemins complets)
+        filenames : Noms des fichiers de la période (magasins Zarr lus à la place des fichiers convertis, cf conversion_zarr)
+        zone : Zone lat_max, lon_min, lat_min, lon_max à extraire des fichiers (tuiles, cf decoupage_requetes), None -> fichiers entiers
+    """
+
+    import xarray as xr
+
+    sources = [
+        xr.open_dataset(chemin_donnees(name_folder, filename)) for filename in filenames
+    ]
+    datasets = sources
+    details_etape(fichiers=len(filenames))
+
+    # Découpe de chaque tuile avant l'assemblage : seuls les points de la zone sont lus (latitudes décroissantes)
+    if zone is not None:
+        lat_max, lon_min, lat_min, lon_max = zone
+        decoupes = [
+            source.sel(
+                latitude=slice(lat_max, lat_min), longitude=slice(lon_min, lon_max)
+            )
+            for source in sources
+        ]
+
+        # Tuiles sans point dans la zone : fichiers fermés tout de suite
+        gardes = [
+            decoupe.sizes["latitude"] > 0 and decoupe.sizes["longitude"] > 0
+            for decoupe in decoupes
+        ]
+        for source, garde in zip(sources, gardes):
+            if not garde:
+                source.close()
+        sources = [source for source, garde in zip(sources, gardes) if garde]
+        datasets = [decoupe for decoupe, garde in zip(decoupes, gardes) if garde]
+
+    # Un seul fichier : pas de regroupement
+    if len(datasets) == 1:
+        dataset = datasets[0]
+    else:
+        dataset = xr.combine_by_coords(datasets, combine_attrs="drop_conflicts")
+
+    # Fichier ouvert renvoyé tel quel
+    if any(dataset is source for source in sources):
+        return dataset
+
+    # La fermeture du dataset regroupé ou découpé ferme les fichiers sources (pas de fichiers ouverts dans le processus Streamlit)
+    def fermeture():
+        for source in sources:
+            source.close()
+
+    dataset.set_close(fermeture)
+
+    return dataset
+
+
+def max_magnitude_temporelle(composantes, taille_bloc=24):
+    """
+    Objectif :
+        Calculer en une seule passe le maximum dans le temps de la magnitude du vent, par blocs de pas de temps (float32)
+
+    Paramètres :
+        composantes : Liste de variables xarray (u et v pour un vent soutenu, une seule pour les rafales)
+        taille_bloc : Nombre de pas de temps chargés en mémoire à la fois
+
+    La magnitude sqrt(u² + v²) est calculée à chaque pas de temps avant de prendre le maximum.
+    Lève une ValueError si aucun pas de temps n'est sélectionné
+    """
+
+    # Dimension temporelle en premier
+    composantes = [
+        composante.transpose("valid_time", ...) for composante in composantes
+    ]
+    nb_temps = composantes[0].sizes["valid_time"]
+
+    # Aucune heure sélectionnée : pas de maximum (comme la réduction xarray)
+    if nb_temps == 0:
+        raise ValueError(
+            "Erreur : aucun pas de temps sélectionné, le maximum du vent ne peut pas être calculé."
+        )
+
+    wind_max = None
+    for debut in range(0, nb_temps, taille_bloc):
+        bloc = slice(debut, debut + taille_bloc)
+
+        # Lecture du bloc uniquement -> format numpy.ndarray float32
+        valeurs = [
+            composante.isel(valid_time=bloc).values.astype(np.float32, copy=False)
+            for composante in composantes
+        ]
+
+        # Magnitude à chaque pas de temps
+        if len(valeurs) == 2:
+            magnitude = np.hypot(valeurs[0], valeurs[1])
+        else:
+            magnitude = valeurs[0]
+
+        # Maximum du bloc puis maximum courant (fmax ignore les valeurs manquantes)
+        magnitude_max = np.fmax.reduce(magnitude, axis=0)
+        if wind_max is None:
+            wind_max = magnitude_max
+        else:
+            np.fmax(wind_max, magnitude_max, out=wind_max)
+
+    return wind_max
+
+
+@etape_suivie("traitement_data_wind")
+def traitement_data_wind(dataset, choix, taille_bloc=24):
+    """
+    Objectif : Réaliser du traitement de données sur un dataset de vent (soutenu ou rafale)
+
+    Paramètres :
+        dataset : Fichier .nc téléchargé par l'API Copernicus
+        choix : Choix de l'utilisateur afin de personnaliser le calcul de la magnitude de vent : w_mag
+        taille_bloc : Nombre de pas de temps chargés en mémoire à la fois
+    """
+
+    # Extraction des longitudes et latitudes: même si on prend plusieurs variables la grille reste identiques -> coordonnées de la 1ère variable
+    longitudes = dataset[list(dataset.keys())[0]]["longitude"].values
+    latitudes = dataset[list(dataset.keys())[0]]["latitude"].values
+
+    # Pour un vent soutenu 10 m
+    if choix == "soutenu_10m":
+
+        # Magnitude maximale à la journée , w_mag = max(sqrt(u² +v²))
+        wind_mag = max_magnitude_temporelle(
+            [dataset["u10"], dataset["v10"]], taille_bloc
+        )
+
+    # Pour un vent soutenu 100 m
+    elif choix == "soutenu_100m":
+
+        # Magnitude maximale à la journée , w_mag = max(sqrt(u² +v²))
+        wind_mag = max_magnitude_temporelle(
+            [dataset["u100"], dataset["v100"]], taille_bloc
+        )
+
+    # Pour des rafales de vent
+    elif choix == "rafale":
+
+        # Magnitude du vent
+        wind_mag = max_magnitude_temporelle([dataset["i10fg"]], taille_bloc)
+
+    else:
+        raise ValueError(
+            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
+        )
+
+    # En km/H -> *3.6
+    wind_mag *= np.float32(3.6)
+    details_etape(
+        choix=choix,
+        points=int(wind_mag.size),
+        pas_de_temps=int(dataset.sizes.get("valid_time", 1)),
+    )
+
+    return longitudes, latitudes, wind_mag
+
+
+@etape_suivie("ouverture_hors_memoire")
+def ouverture_hors_memoire(chemins, taille_bloc=24):
+    """
+    Objectif :
+        Ouvrir un ensemble de fichiers NetCDF (plusieurs années, une ou plusieurs variables) sans les charger en mémoire :
+        les données sont découpées en blocs dask de taille_bloc pas de temps, lus et calculés à la demande
+
+    Paramètres :
+        chemins : Chemins des fichiers (regroupés selon valid_time et les variables, cf ouverture_periode)
+        taille_bloc : Nombre de pas de temps par bloc (24 -> un bloc par jour pour des données horaires)
+    """
+
+    import xarray as xr
+
+    dataset = xr.open_mfdataset(
+        sorted(chemins),
+        combine="by_coords",
+        chunks={"valid_time": taille_bloc},
+        data_vars="minimal",
+        coords="minimal",
+        compat="override",
+        combine_attrs="drop_conflicts",
+    )
+    details_etape(
+        fichiers=len(chemins), pas_de_temps=int(dataset.sizes.get("valid_time", 0))
+    )
+
+    return dataset
+
+
+def magnitude_vent(dataset, choix):
+    """
+    Objectif :
+        Magnitude du vent à chaque pas de temps en km/h (float32), sans calcul immédiat si le dataset est découpé en blocs dask
+
+    Paramètres :
+        dataset : Dataset xarray des fichiers téléchargés
+        choix : Choix de l'utilisateur (rafale, soutenu_10m ou soutenu_100m)
+    """
+
+    if choix not in COMPOSANTES_VENT:
+        raise ValueError(
+            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
+        )
+
+    composantes = [
+        dataset[variable].astype(np.float32) for variable in COMPOSANTES_VENT[choix]
+    ]
+
+    # w_mag = sqrt(u² +v²) pour un vent soutenu
+    if len(composantes) == 2:
+        magnitude = np.hypot(composantes[0], composantes[1])
+    else:
+        magnitude = composantes[0]
+
+    # En km/H -> *3.6
+    return (magnitude * np.float32(3.6)).rename("wind_max")
+
+
+def maxima_evenements(dataset, choix, evenements):
+    """
+    Objectif :
+        Maximum de la magnitude du vent sur chaque événement (tempête), sans calcul immédiat si le dataset est découpé en blocs dask
+
+    Paramètres :
+        dataset : Dataset xarray des fichiers téléchargés
+        choix : Choix de l'utilisateur (rafale, soutenu_10m ou soutenu_100m)
+        evenements : Liste de (nom, début, fin) des événements, bornes incluses
+    """
+
+    import xarray as xr
+
+    magnitude = magnitude_vent(dataset, choix)
+    maxima = [
+        magnitude.sel(valid_time=slice(debut, fin)).max("valid_time")
+        for _, debut, fin in evenements
+    ]
+
+    return xr.concat(
+        maxima,
+        dim=pd.Index([nom for nom, _, _ in evenements], name="evenement"),
+    )
+
+
+@etape_suivie("maxima_hors_memoire")
+def maxima_hors_memoire(
+    chemins,
+    choix,
+    dossier_sortie,
+    frequence="1D",
+    tranche="M",
+    evenements=None,
+    taille_bloc=24,
+    nb_workers=None,
+):
+    """
+    Objectif :
+        Calculer hors mémoire les maxima de la magnitude du vent par jour (ou autre fréquence) ou par événement sur des fichiers
+        plus gros que la mémoire, en parallèle sur les coeurs disponibles, et les écrire au fur et à mesure
+
+    Paramètres :
+        chemins : Chemins des fichiers NetCDF téléchargés (plusieurs années possibles)
+        choix : Choix de l'utilisateur (rafale, soutenu_10m ou soutenu_100m)
+        dossier_sortie : Dossier des fichiers de maxima
+        frequence : Fréquence des maxima au format pandas ("1D" -> maximum journalier)
+        tranche : Période couverte par chaque fichier de sortie au format pandas ("M" -> un fichier par mois, "Y" -> par an)
+        evenements : Liste de (nom, début, fin) -> un seul fichier de maxima par événement à la place des maxima périodiques
+        taille_bloc : Nombre de pas de temps par bloc dask
+        nb_workers : Nombre de threads de calcul (None -> nombre de coeurs)
+
+    La mémoire utilisée dépend de la taille des blocs et du nombre de threads, pas du nombre d'années traitées.
+    Les fichiers sont écrits dans un sous-dossier par grille (cf nom_grille) : des zones différentes ne partagent pas leurs maxima.
+    Chaque tranche est écrite dans un fichier temporaire puis renommée : les tranches déjà écrites sont ignorées à la relance.
+    Renvoie la liste des fichiers de maxima
+    """
+
+    with ouverture_hors_memoire(chemins, taille_bloc) as dataset:
+        dossier_grille = os.path.join(
+            dossier_sortie,
+            "grille_"
+            + nom_grille(dataset["latitude"].values, dataset["longitude"].values),
+        )
+        os.makedirs(dossier_grille, exist_ok=True)
+
+        # Maxima par événement : un seul fichier (quelques valeurs par point de grille), nommé selon la liste des événements
+        if evenements is not None:
+            description = json.dumps(
+                [
+                    [
+                        str(nom),
+                        pd.Timestamp(debut).isoformat(),
+                        pd.Timestamp(fin).isoformat(),
+                    ]
+                    for nom, debut, fin in evenements
+                ]
+            )
+            empreinte = hashlib.sha1(description.encode("utf-8")).hexdigest()[:12]
+            tranches = {
+                os.path.join(dossier_grille, f"{choix}_evenements_{empreinte}.nc"): None
+            }
+
+        # Maxima périodiques : un fichier par tranche de temps
+        else:
+            periodes = dataset["valid_time"].to_index().to_period(tranche)
+            tranches = {
+                os.path.join(dossier_grille, f"{choix}_{frequence}_{periode}.nc"): (
+                    periodes == periode
+                )
+                for periode in periodes.unique()
+            }
+
+        fichiers_ecrits = ecriture_maxima(
+            dataset, choix, tranches, frequence, evenements, nb_workers
+        )
+
+    details_etape(
+        choix=choix, fichiers_maxima=len(tranches), fichiers_ecrits=fichiers_ecrits
+    )
+
+    return list(tranches)
+
+
+def ecriture_maxima(dataset, choix, tranches, frequence, evenements, nb_workers):
+    """
+    Objectif : Calculer et écrire les tranches de maxima absentes (cf maxima_hors_memoire)
+
+    Paramètres :
+        dataset : Dataset ouvert par ouverture_hors_memoire
+        choix : Choix de l'utilisateur (rafale, soutenu_10m ou soutenu_100m)
+        tranches : Dictionnaire chemin du fichier -> pas de temps de la tranche (None pour les maxima par événement)
+        frequence : Fréquence des maxima au format pandas
+        evenements : Liste de (nom, début, fin) des événements ou None
+        nb_workers : Nombre de threads de calcul (None -> nombre de coeurs)
+
+    Renvoie le nombre de fichiers écrits
+    """
+
+    import dask
+
+    fichiers_ecrits = 0
+    with dask.config.set(scheduler="threads", num_workers=nb_workers):
+        for chemin, pas_tranche in tranches.items():
+            if os.path.exists(chemin):
+                continue
+
+            # Calcul différé : les blocs sont lus, réduits et écrits au fur et à mesure par to_netcdf
+            if evenements is not None:
+                maxima = maxima_evenements(dataset, choix, evenements)
+            else:
+                maxima = (
+                    magnitude_vent(dataset.isel(valid_time=pas_tranche), choix)
+                    .resample(valid_time=frequence)
+                    .max(skipna=True)
+                )
+
+            with suivi_etape("ecriture_maxima", fichier=os.path.basename(chemin)):
+                temporaire = chemin_temporaire(chemin)
+                maxima.to_netcdf(temporaire)
+                os.replace(temporaire, chemin)
+            fichiers_ecrits += 1
+
+    return fichiers_ecrits
+
+
+def lecture_maxima(dossier_sortie, choix, frequence="1D", grille=None):
+    """
+    Objectif : Ouvrir sans les charger les maxima périodiques écrits par maxima_hors_memoire
+
+    Paramètres :
+        dossier_sortie : Dossier des fichiers de maxima
+        choix : Choix de l'utilisateur (rafale, soutenu_10m ou soutenu_100m)
+        frequence : Fréquence des maxima utilisée à l'écriture
+        grille : Sous-dossier de la grille (grille_..., cf maxima_hors_memoire), None -> seule grille disponible
+    """
+
+    import xarray as xr
+
+    prefixe = f"{choix}_{frequence}_"
+
+    def fichiers_grille(dossier):
+        return [
+            os.path.join(dossier, nom)
+            for nom in sorted(os.listdir(dossier))
+            if nom.startswith(prefixe) and nom.endswith(".nc")
+        ]
+
+    # Grille non précisée : elle doit être unique pour ces maxima (zones différentes non mélangées)
+    if grille is None:
+        grilles = [
+            nom
+            for nom in sorted(os.listdir(dossier_sortie))
+            if nom.startswith("grille_")
+            and fichiers_grille(os.path.join(dossier_sortie, nom))
+        ]
+        if len(grilles) != 1:
+            raise ValueError(
+                f"Erreur : {len(grilles)} grilles de maxima {prefixe} dans {dossier_sortie}, "
+                f"précisez la grille parmi : {', '.join(grilles)}"
+            )
+        grille = grilles[0]
+
+    chemins = fichiers_grille(os.path.join(dossier_sortie, grille))
+
+    return xr.open_mfdataset(chemins, combine="by_coords")["wind_max"]
+
+
+def map_center(country_grid):
+    """
+    Objectif : Initaliser la carte sur le centre du rectangle correspondant au pays
+
+    Paramètres :
+        country_grid : Grille lon_min, lon_max, lat_min, lat_max
+    """
+    # Centre
+    lat_mid = (country_grid[0] + country_grid[2]) / 2  # Latitude centrale
+    lon_mid = (country_grid[1] + country_grid[3]) / 2  # Longitude centrale
+    map_center_pt = [lat_mid, lon_mid]
+
+    return map_center_pt
+
+
+def parent_cellules(cellules, resolution_parent):
+    """
+    Objectif :
+        Calculer de façon vectorisée l'hexagone parent d'un tableau d'indices h3 entiers (équivalent de h3.cell_to_parent)
+
+    Paramètres :
+        cellules : Tableau d'indices h3 entiers (uint64) de résolution supérieure ou égale à resolution_parent
+        resolution_parent : Résolution h3 des hexagones parents
+    """
+
+    # On remplace la résolution et on met à 7 les chiffres des résolutions plus fines
+    decalage = np.uint64(3 * (15 - resolution_parent))
+    masque_resolution = np.uint64(0xF) << np.uint64(52)
+    masque_chiffres = (np.uint64(1) << decalage) - np.uint64(1)
+
+    return (
+        (np.asarray(cellules, dtype=np.uint64) & ~masque_resolution)
+        | (np.uint64(resolution_parent) << np.uint64(52))
+        | masque_chiffres
+    )
+
+
+def cellules_grille(
+    latitudes, longitudes, resolution_base, resolution_parent, masque=None
+):
+    """
+    Objectif :
+        Calculer en une seule passe l'hexagone h3 parent (format entier uint64) de chaque point de la grille latitude | longitude
+
+    Paramètres :
+        latitudes : Liste de latitudes
+        longitudes : Liste de longitudes
+        resolution_base : Résolution h3 à laquelle chaque point est converti
+        resolution_parent : Résolution h3 des hexagones parents
+        masque : Matrice booléenne des points à convertir (cf masque_pays, None -> tous les points)
+
+    Renvoie une matrice de même forme que la grille de vent (latitude, longitude), 0 pour les points hors masque
+    """
+
+    # Aplatissement de la grille (une seule fois)
+    lat_grille, lon_grille = np.meshgrid(
+        np.asarray(latitudes, dtype=np.float64),
+        np.asarray(longitudes, dtype=np.float64),
+        indexing="ij",
+    )
+    if masque is None:
+        masque = np.ones(lat_grille.shape, dtype=bool)
+
+    # Conversion des points du masque en indices h3 entiers (résolution de base)
+    cellules_base = np.fromiter(
+        (
+            h3.api.basic_int.latlng_to_cell(lat, lon, resolution_base)
+            for lat, lon in zip(
+                lat_grille[masque].tolist(), lon_grille[masque].tolist()
+            )
+        ),
+        dtype=np.uint64,
+        count=int(masque.sum()),
+    )
+
+    cellules = np.zeros(lat_grille.shape, dtype=np.uint64)
+    cellules[masque] = parent_cellules(cellules_base, resolution_parent)
+
+    return cellules
+
+
+def groupes_hexagones(cellules):
+    """
+    Objectif :
+        Regrouper les points de la grille par hexagone (tri) afin de pouvoir réaliser des réductions groupées
+
+    Paramètres :
+        cellules : Matrice d'indices h3 entiers alignée sur la grille de vent
+
+    Renvoie les hexagones uniques (uint64), l'ordre de tri des points et l'indice de début de chaque groupe.
+    Les points sans hexagone (0, hors masque) sont exclus des groupes
+    """
+
+    cellules = np.asarray(cellules).ravel()
+
+    # Tri des points par hexagone puis repérage du début de chaque groupe
+    valides = np.flatnonzero(cellules != 0)
+    ordre = valides[np.argsort(cellules[valides], kind="stable")]
+    cellules_triees = cellules[ordre]
+    debuts = np.flatnonzero(
+        np.concatenate(([True], cellules_triees[1:] != cellules_triees[:-1]))
+    )
+
+    return cellules_triees[debuts], ordre, debuts
+
+
+def nom_grille(latitudes, longitudes):
+    """
+    Objectif : Créer un nom automatique pour une grille latitude | longitude (emprise et pas de la grille)
+
+    Paramètres :
+        latitudes : Liste de latitudes
+        longitudes : Liste de longitudes
+    """
+
+    # Pas de la grille (0 si un seul point)
+    pas_lat = abs(latitudes[1] - latitudes[0]) if len(latitudes) > 1 else 0
+    pas_lon = abs(longitudes[1] - longitudes[0]) if len(longitudes) > 1 else 0
+
+    return (
+        f"{latitudes[0]:.4f}_{longitudes[0]:.4f}_{latitudes[-1]:.4f}_{longitudes[-1]:.4f}"
+        f"_{pas_lat:.4f}_{pas_lon:.4f}"
+    )
+
+
+def nom_index_hexagones(
+    latitudes, longitudes, resolution_base, resolution_parent, masque=None
+):
+    """
+    Objectif :
+        Créer un nom automatique pour l'index grille -> hexagones (emprise, pas de la grille, résolutions et masque)
+
+    Paramètres :
+        latitudes : Liste de latitudes
+        longitudes : Liste de longitudes
+        resolution_base : Résolution h3 à laquelle chaque point est converti
+        resolution_parent : Résolution h3 des hexagones parents
+        masque : Matrice booléenne des points traités (None -> tous les points)
+    """
+
+    # Nom de l'index
+    final_name = f"index_h3_{nom_grille(latitudes, longitudes)}_{resolution_base}_{resolution_parent}"
+
+    # Empreinte du masque (un index par pays pour une même grille)
+    if masque is not None:
+        final_name += (
+            "_masque_" + hashlib.sha1(np.packbits(masque).tobytes()).hexdigest()[:12]
+        )
+
+    return final_name
+
+
+@etape_suivie("index_hexagones")
+def index_hexagones(
+    latitudes,
+    longitudes,
+    resolution_base,
+    resolution_parent,
+    dossier_index=None,
+    masque=None,
+):
+    """
+    Objectif :
+        Construire (ou relire depuis le disque) l'index qui associe chaque point de la grille à son hexagone parent
+
+    Paramètres :
+        latitudes : Liste de latitudes
+        longitudes : Liste de longitudes
+        resolution_base : Résolution h3 à laquelle chaque point est converti
+        resolution_parent : Résolution h3 des hexagones parents
+        dossier_index : Dossier où l'index est enregistré (None -> pas d'enregistrement)
+        masque : Matrice booléenne des points à traiter (cf masque_pays, None -> tous les points)
+
+    La grille ERA5 d'un pays ne change pas d'une date à l'autre : l'index est construit à la première utilisation puis lu en mémoire partagée (mmap)
+    """
+
+    details_etape(resolution=resolution_parent)
+
+    # Pas d'enregistrement : calcul direct
+    if dossier_index is None:
+        details_etape(cache="sans_index")
+        return groupes_hexagones(
+            cellules_grille(
+                latitudes, longitudes, resolution_base, resolution_parent, masque
+            )
+        )
+
+    # Sous dossier propre à la grille et à la résolution
+    folder = os.path.join(
+        dossier_index,
+        nom_index_hexagones(
+            latitudes, longitudes, resolution_base, resolution_parent, masque
+        ),
+    )
+    noms = ["hexagones", "ordre", "debuts"]
+    chemins = [os.path.join(folder, nom + ".npy") for nom in noms]
+
+    # Index déjà existant -> lecture en mmap
+    if all(os.path.exists(chemin) for chemin in chemins):
+        details_etape(cache="index_existant")
+        return tuple(np.load(chemin, mmap_mode="r") for chemin in chemins)
+
+    # Sinon construction puis enregistrement (fichier temporaire puis renommage pour éviter les fichiers partiels)
+    details_etape(cache="construction_index")
+    index = groupes_hexagones(
+        cellules_grille(
+            latitudes, longitudes, resolution_base, resolution_parent, masque
+        )
+    )
+    os.makedirs(folder, exist_ok=True)
+    for chemin, tableau in zip(chemins, index):
+        chemin_tmp = chemin_temporaire(chemin)
+        with open(chemin_tmp, "wb") as fichier:
+            np.save(fichier, tableau)
+        os.replace(chemin_tmp, chemin)
+
+    return index
+
+
+def max_par_hexagone(index, wind):
+    """
+    Objectif :
+        Agréger le maximum du vent par hexagone avec une réduction groupée numpy (gather + maximum.reduceat)
+
+    Paramètres :
+        index : Hexagones, ordre et débuts de groupes renvoyés par index_hexagones
+        wind : Matrice où chaque valeur i,j de vent correspond à une latitude i et une longitude j
+
+    Renvoie les hexagones uniques (uint64) et le maximum de vent associé
+    """
+
+    hexagones, ordre, debuts = index
+
+    # Maximum par groupe (fmax ignore les valeurs manquantes)
+    maxima = np.fmax.reduceat(np.asarray(wind).ravel()[ordre], debuts)
+
+    return np.asarray(hexagones), maxima
+
+
+def max_par_hexagone_temps(index, wind):
+    """
+    Objectif :
+        Agréger le maximum du vent par hexagone pour plusieurs pas de temps à la fois (réduction groupée sur la matrice temps x points)
+
+    Paramètres :
+        index : Hexagones, ordre et débuts de groupes renvoyés par index_hexagones
+        wind : Tableau (temps, latitude, longitude) de valeurs de vent
 
-# Liste de fonctions
+    Renvoie la matrice des maxima (temps x hexagones)
+    """
 
+    _, ordre, debuts = index
+    wind = np.asarray(wind)
 
-def grille_pays(data_pays, code_iso3a):
+    return np.fmax.reduceat(wind.reshape(len(wind), -1)[:, ordre], debuts, axis=1)
+
+
+@etape_suivie("calcul_hexagone")
+def calcul_hexagone(
+    latitudes,
+    longitudes,
+    wind,
+    resolution_base,
+    resolution_parent,
+    dossier_index=None,
+    masque=None,
+):
     """
-    Objectif:
-        Définir les coordonées d'un rectangle contenant le pays selectionné
+    Objectif :
+        Calcul les hexagones h3 à partir de la grille de longitude | latitude et associe à chaque hexagone le maximum de la valeur du vent
 
     Paramètres :
-        data_pays : Fichier contenant tous les pays, leur code d'identification et les coordonnées du rectangle
-        code_iso3a : Code d'identification du pays
+        latitudes : Liste de latitudes
+        longitudes : Liste de longitudes
+        wind : Matrice où chaque valeur i,j de vent correspond à une latitude i et une longitude j
+        dossier_index : Dossier où l'index grille -> hexagones est conservé entre les dates et les variables
+        masque : Matrice booléenne des points à traiter (cf masque_pays, None -> tous les points)
     """
 
-    # Extraction des coordonnées
-    lon_min = data_pays.loc[data_pays["ISO3"] == code_iso3a, "Lon_min"].values[0]
-    lon_max = data_pays.loc[data_pays["ISO3"] == code_iso3a, "Lon_max"].values[0]
-    lat_min = data_pays.loc[data_pays["ISO3"] == code_iso3a, "Lat_min"].values[0]
-    lat_max = data_pays.loc[data_pays["ISO3"] == code_iso3a, "Lat_max"].values[0]
+    # Hexagone parent de chaque point de la grille
+    index = index_hexagones(
+        latitudes, longitudes, resolution_base, resolution_parent, dossier_index, masque
+    )
+
+    # Maximum du vent par hexagone parent
+    hexagones, maxima = max_par_hexagone(index, wind)
+    details_etape(
+        points=int(np.size(wind)),
+        resolution=resolution_parent,
+        hexagones=len(hexagones),
+    )
 
-    # Renvoi de l'array dans l'ordre demandé par l'API Copernicus
-    return [lat_max, lon_min, lat_min, lon_max]
+    return dictionnaire_hexagones(hexagones, maxima)
 
 
-def name_file(
-    country_selected,
-    year_selected,
-    month_selected,
-    day_selected,
-    time_selected,
+@etape_suivie("calcul_hexagone_horaire")
+def calcul_hexagone_horaire(
+    dataset,
     choix,
-    version=1,
+    resolution_base,
+    resolution_parent,
+    dossier_index=None,
+    taille_bloc=24,
+    masque=None,
 ):
     """
     Objectif :
-        Créer un nom automatique lors de la création d'un fichier de téléchargement
+        Calculer le maximum du vent par hexagone h3 à chaque pas de temps (animation heure par heure) : un seul index
+        grille -> hexagones pour tous les pas de temps et une réduction groupée par bloc de pas de temps
 
     Paramètres :
-        country_selected : pays selectionné
-        year_selected : années sélectionnée
-        month_selected : mois sélectionné
-        day_selected : jour selectioné
-        time_selected : intervalle de temps selectionné
-        version : Si il y a plusieurs version du fichier (en particulier pour l'option part day)
-
-    Attention : Si plusieurs jours, mois ou années sont sélectionnées, le fichier prend le nom du premier élément à chaque fois
+        dataset : Dataset xarray des fichiers de la période (cf ouverture_periode)
+        choix : Choix de l'utilisateur (rafale, soutenu_10m ou soutenu_100m)
+        resolution_base : Résolution h3 à laquelle chaque point est converti
+        resolution_parent : Résolution h3 des hexagones
+        dossier_index : Dossier où l'index grille -> hexagones est conservé entre les dates et les variables
+        taille_bloc : Nombre de pas de temps chargés en mémoire à la fois
+        masque : Matrice booléenne des points à traiter (cf masque_pays, None -> tous les points)
+
+    Renvoie les pas de temps (texte), les hexagones (uint64) et la matrice des maxima en km/h (temps x hexagones)
     """
 
-    # Le fichier prend en compte toute la jounrée ou seulement quelques heures
-    if (
-        len(set(time_selected)) == 24
-    ):  # Si il y a 24 valeurs différentes sur 24 possibles, alors toute la journée est sélectionnée
-        type_day = "all_day"
-    else:
-        type_day = "part_day_v" + str(version)
+    index = index_hexagones(
+        dataset["latitude"].values,
+        dataset["longitude"].values,
+        resolution_base,
+        resolution_parent,
+        dossier_index,
+        masque,
+    )
+    hexagones = np.asarray(index[0])
+    nb_temps = dataset.sizes["valid_time"]
+
+    maxima = np.empty((nb_temps, len(hexagones)), dtype=np.float32)
+    for debut in range(0, nb_temps, taille_bloc):
+        bloc = slice(debut, debut + taille_bloc)
+        magnitude = magnitude_vent(dataset.isel(valid_time=bloc), choix)
+        maxima[bloc] = max_par_hexagone_temps(
+            index, magnitude.transpose("valid_time", ...).values
+        )
 
-    # Nom du fichier
-    final_name = (
-        "era_data_"
-        + str(country_selected)
-        + "_"
-        + str(year_selected[0])
-        + "_"
-        + str(month_selected[0])
-        + "_"
-        + str(day_selected[0])
-        + "_"
-        + type_day
-        + "_"
-        + str(choix)
-        + ".nc"
+    temps = pd.DatetimeIndex(dataset["valid_time"].values).strftime("%d/%m/%Y %H:%M")
+    details_etape(
+        pas_de_temps=nb_temps,
+        resolution=resolution_parent,
+        hexagones=len(hexagones),
     )
 
-    return final_name
+    return temps.tolist(), hexagones, maxima
 
 
-def choix_variable(choix):
+def dictionnaire_hexagones(hexagones, maxima):
     """
-    Objectif : Sélectionner les variables de l'API en fonction du choix utilisateur
+    Objectif : Convertir des hexagones (uint64) et leurs valeurs de vent en dictionnaire hexagone -> valeur maximale du vent
 
-    Paramètrs:
-        choix : Choix de l'utilisateur entre soutenu_10m, soutenu_100m, rafale
+    Paramètres :
+        hexagones : Tableau d'indices h3 entiers
+        maxima : Valeur maximale du vent de chaque hexagone
     """
 
-    if choix == "soutenu_10m":
-        variables_selected = ["10m_u_component_of_wind", "10m_v_component_of_wind"]
-    elif choix == "soutenu_100m":
-        variables_selected = ["100m_u_component_of_wind", "100m_v_component_of_wind"]
-    elif choix == "rafale":
-        variables_selected = ["instantaneous_10m_wind_gust"]
-    else:
-        raise ValueError(
-            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
-        )
-
-    return variables_selected
+    return dict(zip(map(h3.int_to_str, hexagones.tolist()), maxima.tolist()))
 
 
-def requete_api(
-    cdsapi_url,
-    cdsapi_key,
-    filename,
-    name_folder,
-    variables_selected,
-    year_selected,
-    month_selected,
-    day_selected,
-    time_selected,
-    country_grid,
+@etape_suivie("pyramide_hexagones")
+def pyramide_hexagones(
+    latitudes,
+    longitudes,
+    wind,
+    resolution_base,
+    resolutions=range(1, 9),
+    dossier_index=None,
+    masque=None,
 ):
     """
-    Objectif : Requeter l'API Copernicus en fonction des choix faits par l'utilisateur
+    Objectif :
+        Calculer en une passe les hexagones de plusieurs résolutions : la plus fine est calculée à partir de la grille,
+        chaque résolution plus grossière est obtenue en regroupant les hexagones de la résolution précédente (maximum)
+
+    Paramètres :
+        latitudes : Liste de latitudes
+        longitudes : Liste de longitudes
+        wind : Matrice où chaque valeur i,j de vent correspond à une latitude i et une longitude j
+        resolution_base : Résolution h3 à laquelle chaque point est converti
+        resolutions : Résolutions h3 à calculer
+        dossier_index : Dossier où l'index grille -> hexagones est conservé entre les dates et les variables
+        masque : Matrice booléenne des points à traiter (cf masque_pays, None -> tous les points)
+
+    Renvoie un dictionnaire résolution -> (hexagones uint64, maximum du vent)
     """
-    # Nom du dataset de ré-analyse
-    dataset = "reanalysis-era5-single-levels"
 
-    # Appel de l'API
-    client = cdsapi.Client(url=cdsapi_url,key=cdsapi_key)
+    resolutions = sorted(resolutions, reverse=True)
 
-    # Requête d'extraction (Show API request)
-    request = {
-        "product_type": ["reanalysis"],
-        "variable": variables_selected,
-        "year": year_selected,
-        "month": month_selected,
-        "day": day_selected,
-        "time": time_selected,
-        "data_format": "netcdf",
-        "download_format": "unarchived",
-        "area": country_grid,
-    }
+    # Résolution la plus fine à partir de la grille
+    index = index_hexagones(
+        latitudes, longitudes, resolution_base, resolutions[0], dossier_index, masque
+    )
+    pyramide = {resolutions[0]: max_par_hexagone(index, wind)}
 
-    # Sous dossier pour enregistrer les fichiers .nc
-    folder = name_folder
+    # Résolutions plus grossières à partir des hexagones déjà agrégés
+    for resolution_fine, resolution_parent in zip(resolutions, resolutions[1:]):
+        hexagones_fins, maxima_fins = pyramide[resolution_fine]
+        hexagones, ordre, debuts = groupes_hexagones(
+            parent_cellules(hexagones_fins, resolution_parent)
+        )
+        pyramide[resolution_parent] = (
+            hexagones,
+            np.fmax.reduceat(maxima_fins[ordre], debuts),
+        )
+    details_etape(
+        points=int(np.size(wind)),
+        resolutions=resolutions,
+        hexagones=sum(len(niveau[0]) for niveau in pyramide.values()),
+    )
 
-    # Création du sous dossier si il n'existe pas
-    os.makedirs(folder, exist_ok=True)
-    full_path = os.path.join(folder, filename)
+    return pyramide
 
-    # Récupération des données et téléchargement
-    if filename in os.listdir():
-        return f"Fichier {filename} déjà existant"
-    else:
-        client.retrieve(dataset, request).download(target=full_path)
-        return f"Fichier {filename} a été téléchargé avec succès"
 
-def traitement_data_wind(dataset, choix):
+def nom_hexagones(country_selected, date_debut, nb_jours, choix, resolution_parent):
     """
-    Objectif : Réaliser du traitement de données sur un dataset de vent (soutenu ou rafale)
+    Objectif :
+        Créer le chemin (partition pays / masque / date / nb_jours / variable / résolution) des hexagones agrégés d'une période complète
+        (toutes les heures)
 
     Paramètres :
-        dataset : Fichier .nc téléchargé par l'API Copernicus
-        choix : Choix de l'utilisateur afin de personnaliser le calcul de la magnitude de vent : w_mag
+        country_selected : pays selectionné
+        date_debut : Premier jour de la période
+        nb_jours : Nombre de jours de la période
+        choix : Choix de l'utilisateur entre soutenu_10m, soutenu_100m, rafale
+        resolution_parent : Résolution h3 des hexagones
     """
 
-    # Extraction des longitudes et latitudes: même si on prend plusieurs variables la grille reste identiques -> coordonnées de la 1ère variable
-    longitudes = dataset[list(dataset.keys())[0]]["longitude"].values
-    latitudes = dataset[list(dataset.keys())[0]]["latitude"].values
+    final_name = os.path.join(
+        "pays=" + str(country_selected),
+        "masque=" + MASQUE_HEXAGONES,
+        "date=" + date_debut.strftime("%Y-%m-%d"),
+        "nb_jours=" + str(nb_jours),
+        "variable=" + str(choix),
+        "resolution=" + str(resolution_parent),
+        "hexagones.parquet",
+    )
 
-    # Pour un vent soutenu 10 m
-    if choix == "soutenu_10m":
+    return final_name
 
-        # Valeurs de vent maximale à la journée selon la direction u -> format numpy.ndarray
-        u_wind_time_value_ex = dataset["u10"].max(dim="valid_time").values
 
-        # Valeurs de vent maximale à la journée selon la direction v -> format numpy.ndarray
-        v_wind_time_value_ex = dataset["v10"].max(dim="valid_time").values
+@etape_suivie("enregistrement_hexagones")
+def enregistrement_hexagones(dossier_hexagones, nom, hexagones):
+    """
+    Objectif : Enregistrer des hexagones agrégés au format Parquet (indices h3 en uint64, vent en float32)
 
-        # Magnitude du vent , w_mag = sqrt(u² +v²) et en km/H -> *3.6
-        wind_mag = 3.6 * np.sqrt(u_wind_time_value_ex**2 + v_wind_time_value_ex**2)
+    Paramètres :
+        dossier_hexagones : Dossier des hexagones agrégés
+        nom : Chemin de la partition (cf nom_hexagones)
+        hexagones : Dictionnaire hexagone -> valeur maximale du vent
+    """
 
-    # Pour un vent soutenu 100 m
-    elif choix == "soutenu_100m":
+    import pyarrow as pa
+    import pyarrow.parquet as pq
 
-        # Valeurs de vent maximale à la journée selon la direction u -> format numpy.ndarray
-        u_wind_time_value_ex = dataset["u100"].max(dim="valid_time").values
+    chemin = os.path.join(dossier_hexagones, nom)
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    chemin_tmp = chemin_temporaire(chemin)
 
-        # Valeurs de vent maximale à la journée selon la direction v -> format numpy.ndarray
-        v_wind_time_value_ex = dataset["v100"].max(dim="valid_time").values
+    table = pa.table(
+        {
+            "cellule": pa.array(
+                [h3.str_to_int(hex_index) for hex_index in hexagones], type=pa.uint64()
+            ),
+            "vent": pa.array(list(hexagones.values()), type=pa.float32()),
+        }
+    )
+    pq.write_table(table, chemin_tmp)
+    os.replace(chemin_tmp, chemin)
+    details_etape(partition=nom, hexagones=len(hexagones))
 
-        # Magnitude du vent , w_mag = sqrt(u² +v²) et en km/H -> *3.6
-        wind_mag = 3.6 * np.sqrt(u_wind_time_value_ex**2 + v_wind_time_value_ex**2)
 
-    # Pour des rafales de vent
-    elif choix == "rafale":
+@etape_suivie("lecture_hexagones")
+def lecture_hexagones(dossier_hexagones, nom):
+    """
+    Objectif : Relire les hexagones agrégés d'une partition (cf enregistrement_hexagones)
 
-        # Magnitude du vent
-        wind_mag = 3.6 * dataset["i10fg"].max(dim="valid_time").values
+    Paramètres :
+        dossier_hexagones : Dossier des hexagones agrégés
+        nom : Chemin de la partition (cf nom_hexagones)
 
-    else:
-        raise ValueError(
-            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
+    Renvoie le dictionnaire hexagone -> valeur maximale du vent, ou None si absent
+    """
+
+    import pyarrow.parquet as pq
+
+    chemin = os.path.join(dossier_hexagones, nom)
+    details_etape(partition=nom)
+    if not os.path.exists(chemin):
+        details_etape(cache="absent")
+        return None
+
+    table = pq.read_table(chemin, columns=["cellule", "vent"])
+    details_etape(cache="partition", hexagones=table.num_rows)
+
+    return dict(
+        zip(
+            map(h3.int_to_str, table["cellule"].to_pylist()),
+            table["vent"].to_pylist(),
         )
+    )
 
-    return longitudes, latitudes, wind_mag
 
+def requete_hexagones(
+    dossier_hexagones,
+    pays=None,
+    date=None,
+    nb_jours=None,
+    variable=None,
+    resolution=None,
+):
+    """
+    Objectif :
+        Interroger l'ensemble des hexagones agrégés (plusieurs tempêtes, pays, variables...) sans rouvrir les fichiers NetCDF :
+        seules les partitions correspondant aux filtres sont lues
 
-def map_center(country_grid):
+    Paramètres :
+        dossier_hexagones : Dossier des hexagones agrégés
+        pays : Code ISO3 (None -> tous)
+        date : Premier jour de la période au format AAAA-MM-JJ (None -> toutes)
+        nb_jours : Nombre de jours de la période (None -> tous)
+        variable : soutenu_10m, soutenu_100m ou rafale (None -> toutes)
+        resolution : Résolution h3 (None -> toutes)
+
+    Seules les partitions restreintes au pays sont lues (cf MASQUE_HEXAGONES).
+    Renvoie un DataFrame pandas (pays, masque, date, nb_jours, variable, resolution, cellule, vent)
     """
-    Objectif : Initaliser la carte sur le centre du rectangle correspondant au pays
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    schema_partitions = pa.schema(
+        [
+            ("pays", pa.string()),
+            ("masque", pa.string()),
+            ("date", pa.string()),
+            ("nb_jours", pa.int32()),
+            ("variable", pa.string()),
+            ("resolution", pa.int32()),
+        ]
+    )
+    partitionnement = ds.partitioning(schema_partitions, flavor="hive")
+
+    # Schéma complet (mêmes colonnes si aucune partition n'est encore écrite, cf enregistrement_hexagones)
+    schema = schema_partitions.append(pa.field("cellule", pa.uint64())).append(
+        pa.field("vent", pa.float32())
+    )
+
+    # Fichiers Parquet uniquement (les fichiers temporaires en cours d'écriture sont ignorés)
+    chemins = [
+        os.path.join(dossier, nom)
+        for dossier, _, noms in os.walk(dossier_hexagones)
+        for nom in noms
+        if nom.endswith(".parquet")
+    ]
+    dataset = ds.dataset(
+        chemins,
+        schema=schema,
+        format="parquet",
+        partitioning=partitionnement,
+        partition_base_dir=dossier_hexagones,
+    )
+
+    # Filtre sur les partitions
+    filtres = {
+        "pays": pays,
+        "masque": MASQUE_HEXAGONES,
+        "date": date,
+        "nb_jours": nb_jours,
+        "variable": variable,
+        "resolution": resolution,
+    }
+    filtre = None
+    for colonne, valeur in filtres.items():
+        if valeur is not None:
+            condition = ds.field(colonne) == valeur
+            filtre = condition if filtre is None else filtre & condition
+
+    return dataset.to_table(filter=filtre).to_pandas()
+
+
+@etape_suivie("traitement_periode")
+def traitement_periode(
+    name_folder,
+    filenames,
+    choix,
+    resolution_base,
+    resolutions,
+    dossier_index,
+    dossier_hexagones,
+    noms,
+    code_iso3a=None,
+    zone=None,
+):
+    """
+    Objectif :
+        Réduire les fichiers d'une période (maximum de la magnitude du vent) puis agréger et enregistrer les hexagones à plusieurs résolutions
 
     Paramètres :
-        country_grid : Grille lon_min, lon_max, lat_min, lat_max
+        name_folder : Dossier des fichiers téléchargés
+        filenames : Noms des fichiers de la période
+        choix : Choix de l'utilisateur entre soutenu_10m, soutenu_100m, rafale
+        resolution_base : Résolution h3 à laquelle chaque point est converti
+        resolutions : Résolutions h3 des hexagones à calculer
+        dossier_index : Dossier des index grille -> hexagones
+        dossier_hexagones : Dossier des hexagones agrégés
+        noms : Noms des fichiers d'hexagones (un par résolution, cf nom_hexagones)
+        code_iso3a : Code du pays -> seuls les points situés dans le pays sont traités (cf masque_pays, None -> tout le rectangle)
+        zone : Zone du pays à extraire des tuiles téléchargées (cf ouverture_periode)
+
+    Fonction de niveau module afin de pouvoir être exécutée dans un pool de processus
     """
-    # Centre
-    lat_mid = (country_grid[0] + country_grid[2]) / 2  # Latitude centrale
-    lon_mid = (country_grid[1] + country_grid[3]) / 2  # Longitude centrale
-    map_center_pt = [lat_mid, lon_mid]
 
-    return map_center_pt
+    # Maximum de la magnitude du vent sur la période
+    with ouverture_periode(name_folder, filenames, zone) as dataset:
+        longitudes, latitudes, wind_mag = traitement_data_wind(dataset, choix)
+
+    # Points de la grille situés dans le pays
+    masque = None
+    if code_iso3a is not None:
+        masque = masque_pays(
+            latitudes, longitudes, code_iso3a, dossier_masques=dossier_index
+        )
+
+    # Hexagones de toutes les résolutions en une passe
+    pyramide = pyramide_hexagones(
+        latitudes,
+        longitudes,
+        wind_mag,
+        resolution_base,
+        resolutions,
+        dossier_index,
+        masque,
+    )
+    for resolution_parent, nom in zip(resolutions, noms):
+        enregistrement_hexagones(
+            dossier_hexagones, nom, dictionnaire_hexagones(*pyramide[resolution_parent])
+        )
+
+    return noms
 
 
-def calcul_hexagone(latitudes, longitudes, wind, resolution_base, resolution_parent):
+@functools.lru_cache(maxsize=None)
+def chargement_echelle(chemin="Echelle_vent.xlsx", date_modification=None):
     """
     Objectif :
-        Calcul les hexagones h3 à partir de la grille de longitude | latitude et associe à chaque hexagone le maximum de la valeur du vent
+        Lire une seule fois l'échelle simplifiée de chaque variable (tableau de droite du fichier Echelle_vent.xlsx)
 
     Paramètres :
-        latitudes : Liste de latitudes
-        longitudes : Liste de longitudes
-        wind : Matrice où chaque valeur i,j de vent correspond à une longitude i et une latitude j
+        chemin : Chemin du fichier Echelle_vent.xlsx
+        date_modification : Date de modification du fichier (fait partie de la clé du cache -> relecture si le fichier change)
+
+    Renvoie un dictionnaire choix -> seuils (bornes basses des niveaux 2 et suivants), couleurs et libellés de la légende
+    """
+
+    feuille = pd.read_excel(chemin, sheet_name="Echelle_vent", header=None)
+    titres = feuille[0].astype(str).str.strip()
+
+    echelles = {}
+    for choix, (section, titre_legende) in SECTIONS_ECHELLE.items():
+        # Ligne d'en-tête (Niveau) du tableau qui suit le titre de la section
+        debut = titres.index[titres == section][0]
+        entete = feuille.index[(feuille.index > debut) & (feuille[4] == "Niveau")][0]
+
+        # Lignes du tableau jusqu'à la première ligne vide
+        intervalles = []
+        for vitesse in feuille.loc[entete + 1 :, 5]:
+            if pd.isna(vitesse):
+                break
+            intervalles.append(str(vitesse).replace("km/h", "").strip())
+
+        # "a à b" -> le niveau suivant commence à b + 1 ; ">b" -> dernier niveau
+        seuils = [
+            float(intervalle.split("à")[1]) + 1
+            for intervalle in intervalles
+            if "à" in intervalle
+        ]
+
+        # Libellés de la légende
+        libelles = [f"< {seuils[0] - 1:.0f} km/h"]
+        libelles += [
+            f"{bas:.0f} - {haut - 1:.0f} km/h" for bas, haut in zip(seuils, seuils[1:])
+        ]
+        libelles.append(f"> {seuils[-1] - 1:.0f} km/h")
+
+        echelles[choix] = {
+            "seuils": np.array(seuils),
+            "couleurs": COULEURS_NIVEAUX[: len(libelles)],
+            "libelles": libelles,
+            "titre": titre_legende,
+        }
+
+    return echelles
+
+
+def echelle_vent(choix):
     """
+    Objectif : Renvoyer l'échelle de la variable choisie (cf chargement_echelle)
 
-    # Dictionnaire pour stocker les hexagones de niveau 4 et leurs valeurs de vent agrégées
-    parent_hex_values = {}
+    Paramètres :
+        choix : Choix de l'utilisateur pour la variable a utiliser
+    """
+
+    chemin = "Echelle_vent.xlsx"
+    echelles = chargement_echelle(chemin, os.stat(chemin).st_mtime_ns)
+    if choix not in echelles:
+        raise ValueError(
+            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
+        )
+
+    return echelles[choix]
 
-    # Ajout des hexagones (boucle longitude | latitude)
-    for i in range(len(latitudes)):
-        for j in range(len(longitudes)):
 
-            # Pour chaque latitude et longitude -> Magnitude du vent
-            lat = latitudes[i]
-            lon = longitudes[j]
-            wind_value = wind[i, j]
+def classification_vent(wind, choix):
+    """
+    Objectif :
+        Associer en une seule opération vectorisée un niveau de l'échelle à chaque valeur de vent
 
-            # Conversion de la latitude et de la longitude en indice H3 (base)
-            hex_index_base = h3.latlng_to_cell(lat, lon, resolution_base)
+    Paramètres :
+        wind : Tableau de valeurs de vent en km/h
+        choix : Choix de l'utilisateur pour la variable a utiliser
 
-            # Calculer l'hexagone parent de niveau 4
-            hex_index_parent = h3.cell_to_parent(hex_index_base, resolution_parent)
+    Renvoie les niveaux (indices dans la table des couleurs) et la table des couleurs
+    """
 
-            # Ajouter ou mettre à jour la valeur maximale pour l'hexagone parent de niveau 4
-            if hex_index_parent not in parent_hex_values:
-                parent_hex_values[hex_index_parent] = wind_value
-            else:
-                parent_hex_values[hex_index_parent] = max(
-                    parent_hex_values[hex_index_parent], wind_value
-                )
+    echelle = echelle_vent(choix)
+    niveaux = np.searchsorted(echelle["seuils"], np.asarray(wind), side="right")
 
-    return parent_hex_values
+    return niveaux, echelle["couleurs"]
 
 
 def get_wind_color(wind_value, choix):
     """
     Objectif :
-        Créer une légende et associer une couleur a une intensité de vent
+        Associer une couleur a une intensité de vent
 
     Paramètres :
         wind_value : Valeur du vent en km/h
         choix : Choix de l'utilisateur pour la variable a utiliser
     """
 
-    if choix == "rafale":
-        if wind_value < 31:
-            return "green"
-        elif wind_value < 71:
-            return "yellow"
-        elif wind_value < 101:
-            return "orange"
-        elif wind_value < 131:
-            return "#FF8C00"  # Orange foncé
-        else:
-            return "red"
-
-    elif choix == "soutenu_10m":
-        if wind_value < 31:
-            return "green"
-        elif wind_value < 71:
-            return "yellow"
-        elif wind_value < 101:
-            return "orange"
-        elif wind_value < 131:
-            return "#FF8C00"  # Orange foncé
-        else:
-            return "red"
+    niveau, couleurs = classification_vent(wind_value, choix)
 
-    elif choix == "soutenu_100m":
-        if wind_value < 31:
-            return "green"
-        elif wind_value < 71:
-            return "yellow"
-        elif wind_value < 131:
-            return "orange"
-        elif wind_value < 171:
-            return "#FF8C00"  # Orange foncé
-        else:
-            return "red"
+    return couleurs[int(niveau)]
 
-    else:
-        raise ValueError(
-            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
+
+def geojson_hexagones(hexagones, choix):
+    """
+    Objectif :
+        Construire en une fois une FeatureCollection GeoJSON contenant tous les hexagones (couleur et vent en propriétés)
+
+    Paramètres :
+        hexagones : Liste d'hexagones contenant la valeur du vent à afficher
+        choix : Choix de l'utilisateur pour la variable a utiliser
+    """
+
+    # Couleur de tous les hexagones en une fois
+    niveaux, couleurs = classification_vent(
+        np.fromiter(hexagones.values(), dtype=np.float64, count=len(hexagones)),
+        choix,
+    )
+
+    features = []
+    for (hex_index, max_wind_value), niveau in zip(hexagones.items(), niveaux.tolist()):
+        # Contour de l'hexagone au format GeoJSON (lon, lat) arrondi pour alléger la page, anneau fermé
+        contour = [
+            [round(lon, 5), round(lat, 5)]
+            for lat, lon in h3.cell_to_boundary(hex_index)
+        ]
+        contour.append(contour[0])
+
+        features.append(
+            {
+                "type": "Feature",
+                "id": hex_index,
+                "properties": {
+                    "vent": round(float(max_wind_value), 2),
+                    "couleur": couleurs[niveau],
+                },
+                "geometry": {"type": "Polygon", "coordinates": [contour]},
+            }
         )
 
+    return {"type": "FeatureCollection", "features": features}
+
+
+def style_hexagone(feature):
+    """
+    Objectif : Style d'un hexagone de la couche GeoJSON à partir de sa couleur
+
+    Paramètres :
+        feature : Hexagone de la FeatureCollection
+    """
+
+    couleur = feature["properties"]["couleur"]
 
-def affichage_hexagones(carte, hexagones, choix):
+    return {"color": couleur, "fillColor": couleur, "fillOpacity": 0.2}
+
+
+@etape_suivie("affichage_hexagones")
+def affichage_hexagones(carte, hexagones, choix, mode="geojson"):
     """
     Objectif :
         Afficher les hexagones calculés sur une carte
@@ -322,25 +3329,102 @@ def affichage_hexagones(carte, hexagones, choix):
         carte : Objet carte follium sur lesquels les hexagones seront affichés
         hexagones : Liste d'hexagones contenant la valeur du vent à afficher
         choix : Choix de l'utilisateur pour la variable a utiliser
+        mode : "geojson" (une seule couche pour tous les hexagones) ou "polygones" (un objet folium par hexagone)
     """
 
-    for hex_index, max_wind_value in hexagones.items():
-        # Coordonées de l'hexagone
-        hex_boundary = h3.cell_to_boundary(hex_index)
+    import folium
 
-        # Couleur de l'hexagone en fonction de la légende
-        color = get_wind_color(max_wind_value, choix)
+    details_etape(hexagones=len(hexagones), mode=mode)
 
-        # Création du polygone
-        folium.Polygon(
-            locations=hex_boundary,
-            color=color,
-            fill=True,
-            fill_color=color,
-            fill_opacity=0.2,
-            popup=f"Vent soutenu: {max_wind_value:.2f} km/h",
+    # Une seule couche GeoJSON, stylée par la couleur de chaque hexagone
+    if mode == "geojson":
+        folium.GeoJson(
+            geojson_hexagones(hexagones, choix),
+            style_function=style_hexagone,
+            popup=folium.GeoJsonPopup(fields=["vent"], aliases=["Vent (km/h)"]),
         ).add_to(carte)
 
+    # Un polygone folium par hexagone
+    elif mode == "polygones":
+        # Couleur de tous les hexagones en une fois
+        niveaux, couleurs = classification_vent(
+            np.fromiter(hexagones.values(), dtype=np.float64, count=len(hexagones)),
+            choix,
+        )
+
+        for (hex_index, max_wind_value), niveau in zip(
+            hexagones.items(), niveaux.tolist()
+        ):
+            # Coordonées de l'hexagone
+            hex_boundary = h3.cell_to_boundary(hex_index)
+
+            # Couleur de l'hexagone en fonction de la légende
+            color = couleurs[niveau]
+
+            # Création du polygone
+            folium.Polygon(
+                locations=hex_boundary,
+                color=color,
+                fill=True,
+                fill_color=color,
+                fill_opacity=0.2,
+                popup=f"Vent soutenu: {max_wind_value:.2f} km/h",
+            ).add_to(carte)
+
+    else:
+        raise ValueError(
+            "Erreur : mode non reconnu. Utilisez 'geojson' ou 'polygones'."
+        )
+
+    return carte
+
+
+@etape_suivie("affichage_hexagones_horaire")
+def affichage_hexagones_horaire(carte, hexagones, maxima, temps, choix):
+    """
+    Objectif :
+        Afficher les hexagones sous forme d'animation heure par heure : une seule couche GeoJSON (contours envoyés une fois)
+        recolorée par un curseur à partir des valeurs de chaque pas de temps
+
+    Paramètres :
+        carte : Objet carte folium sur lequel l'animation est affichée
+        hexagones : Hexagones h3 entiers (uint64), cf calcul_hexagone_horaire
+        maxima : Matrice des maxima du vent (temps x hexagones)
+        temps : Libellé de chaque pas de temps
+        choix : Choix de l'utilisateur pour la variable a utiliser
+    """
+
+    import folium
+    from branca.element import MacroElement, Template
+
+    details_etape(hexagones=len(hexagones), pas_de_temps=len(temps))
+
+    # Contours des hexagones (premier pas de temps) et rang de chaque hexagone dans les tableaux de valeurs
+    geojson = geojson_hexagones(dictionnaire_hexagones(hexagones, maxima[0]), choix)
+    for rang, feature in enumerate(geojson["features"]):
+        feature["properties"]["rang"] = rang
+
+    couche = folium.GeoJson(
+        geojson,
+        style_function=style_hexagone,
+        popup=folium.GeoJsonPopup(fields=["vent"], aliases=["Vent (km/h)"]),
+    ).add_to(carte)
+
+    # Valeurs de chaque pas de temps (arrondies pour alléger la page) et échelle de couleurs
+    echelle = echelle_vent(choix)
+    animation = MacroElement()
+    animation._template = Template(GABARIT_ANIMATION)
+    animation.couche = couche.get_name()
+    animation.donnees = json.dumps(
+        {
+            "temps": list(temps),
+            "valeurs": np.round(maxima.astype(np.float64), 1).tolist(),
+            "seuils": echelle["seuils"].tolist(),
+            "couleurs": echelle["couleurs"],
+        }
+    )
+    animation.add_to(carte)
+
     return carte
 
 
@@ -352,59 +3436,25 @@ def legende_carte(choix):
         choix : choix de la variable de l'utilisateur
     """
 
-    if choix == "rafale":
-        legend_html = """
-            <div style="position: fixed; 
-                        bottom: 20px; left: 20px; width: 140x; height: 150px; 
-                        background-color: white; border:2px solid grey; 
-                        z-index:9999; font-size:14px;
-                         padding: 10px;">
-                <b style="display: inline-block; margin-bottom: 8px;">Légende Rafale</b><br>
-                <i style="background:green; width: 20px; height: 20px; display: inline-block;"></i> < 30 km/h<br>
-                <i style="background:yellow; width: 20px; height: 20px; display: inline-block;"></i> 31 - 70 km/h<br>
-                <i style="background:orange; width: 20px; height: 20px; display: inline-block;"></i> 71 - 100 km/h<br>
-                <i style="background:#FF8C00; width: 20px; height: 20px; display: inline-block;"></i> 101 - 130 km/h<br>
-                <i style="background:red; width: 20px; height: 20px; display: inline-block;"></i> > 130 km/h
-            </div>
-        """
+    echelle = echelle_vent(choix)
 
-    elif choix == "soutenu_10m":
-        legend_html = """
-            <div style="position: fixed; 
-                        bottom: 20px; left: 20px; width: 140px; height: 150px;
-                        background-color: white; border:2px solid grey; 
-                        z-index:9999; font-size:14px;
-                        padding: 10px;">
-                <b style="display: inline-block; margin-bottom: 8px;">Légende Vent soutenu 10m</b><br>
-                <i style="background:green; width: 20px; height: 20px; display: inline-block;"></i> < 30 km/h<br>
-                <i style="background:yellow; width: 20px; height: 20px; display: inline-block;"></i> 31 - 70 km/h<br>
-                <i style="background:orange; width: 20px; height: 20px; display: inline-block;"></i> 71 - 100 km/h<br>
-                <i style="background:#FF8C00; width: 20px; height: 20px; display: inline-block;"></i> 101 - 130 km/h<br>
-                <i style="background:red; width: 20px; height: 20px; display: inline-block;"></i> > 130 km/h
-            </div>
-        """
+    # Une ligne par niveau de l'échelle
+    lignes = "<br>\n".join(
+        f"""                <i style="background:{couleur}; width: 20px; height: 20px; display: inline-block;"></i> {libelle}"""
+        for couleur, libelle in zip(echelle["couleurs"], echelle["libelles"])
+    )
 
-    elif choix == "soutenu_100m":
-        legend_html = """
+    legend_html = f"""
             <div style="position: fixed; 
                         bottom: 20px; left: 20px; width: 140px; height: 150px;
                         background-color: white; border:2px solid grey; 
                         z-index:9999; font-size:14px;
                         padding: 10px;">
-                <b style="display: inline-block; margin-bottom: 8px;">Légende Vent soutenu 100m</b><br>
-                <i style="background:green; width: 20px; height: 20px; display: inline-block;"></i> < 30 km/h<br>
-                <i style="background:yellow; width: 20px; height: 20px; display: inline-block;"></i> 31 - 70 km/h<br>
-                <i style="background:orange; width: 20px; height: 20px; display: inline-block;"></i> 71 - 130 km/h<br>
-                <i style="background:#FF8C00; width: 20px; height: 20px; display: inline-block;"></i> 131 - 170 km/h<br>
-                <i style="background:red; width: 20px; height: 20px; display: inline-block;"></i> > 170 km/h
+                <b style="display: inline-block; margin-bottom: 8px;">{echelle["titre"]}</b><br>
+{lignes}
             </div>
         """
 
-    else:
-        raise ValueError(
-            "Erreur : choix non reconnu. Utilisez 'rafale', 'soutenu_10m' ou 'soutenu_100m'."
-        )
-
     return legend_html
 
 
@@ -3,11 +3,15 @@ from datetime import datetime, timedelta
 
 import pandas as pd
 import streamlit as st
-import xarray as xr
-from streamlit_folium import st_folium
 
 from functions import *
 
+# folium et streamlit_folium (les plus coûteux à importer) sont importés uniquement à l'affichage de la carte
+
+# Journal JSON des étapes et mesures de cette exécution du script (cf section mesures de performance)
+configuration_journal(os.path.join("wind_api_copernicus", "journal_etapes.jsonl"))
+mesures = debut_mesures()
+
 #### SECTION INTRODUCITON ####
 
 # Paramétrage
@@ -27,17 +31,21 @@ st.write(
 )
 
 # Récupération de l'URL (version sécurisée)
-#cdsapi_url = st.secrets["cdsapirc"]["url"]
-#cdsapi_key = st.secrets["cdsapirc"]["key"]
+# cdsapi_url = st.secrets["cdsapirc"]["url"]
+# cdsapi_key = st.secrets["cdsapirc"]["key"]
 
 # Récupération de l'URL (version non sécurisée attention)
-cdsapi_url = "https://cds.climate.copernicus.eu/api"
-cdsapi_key = "db2d03e3-02f3-4b14-8f2c-ffcc72a94988" # dépend de l'utilisateur
+# Les variables d'environnement CDSAPI_URL et CDSAPI_KEY permettent d'utiliser un autre serveur (cf serveur_cds.py)
+cdsapi_url = os.environ.get("CDSAPI_URL", "https://cds.climate.copernicus.eu/api")
+cdsapi_key = os.environ.get(
+    "CDSAPI_KEY", "db2d03e3-02f3-4b14-8f2c-ffcc72a94988"
+)  # dépend de l'utilisateur
 
 #### SECTION CHOIX DU PAYS #####
 
-# Chargement de la base des pays
-data_pays = pd.read_excel("Pays_grille.xlsx")
+# Chargement de la base des pays (une seule fois par processus, copie Parquet conservée)
+dossier_references = os.path.join("wind_api_copernicus", "references")
+data_pays = chargement_reference("Pays_grille.xlsx", dossier_references)
 
 with st.sidebar:
 
@@ -61,13 +69,14 @@ with st.sidebar:
     country_selected = info_selected_country["ISO3"]
 
     # Grille du pays
-    country_grid = grille_pays(data_pays, country_selected)
+    country_grid = index_pays("Pays_grille.xlsx", dossier_references)[country_selected]
 
     ### SECTION CHOIX D UNE TEMPETE DE REFERENCE ####
 
     # Chargement de la base des tempêtes de références
-    data_tempetes = pd.read_excel("Tempete_references.xlsx")
-    data_tempetes["Date"] = pd.to_datetime(data_tempetes["Date"]).dt.date
+    data_tempetes = chargement_reference(
+        "Tempete_references.xlsx", dossier_references
+    ).assign(Date=lambda data: pd.to_datetime(data["Date"]).dt.date)
 
     # Titre de la section
     st.header("Choix de la date")
@@ -124,6 +133,12 @@ with st.sidebar:
         "Choix de la variable de vent", ("rafale", "soutenu_10m", "soutenu_100m")
     )
 
+    # Nombre de jours à partir de la date choisie (une tempête peut durer plusieurs jours)
+    nb_jours = st.number_input(
+        "Nombre de jours", min_value=1, max_value=31, value=1, step=1
+    )
+    date_fin = selected_date + timedelta(days=nb_jours - 1)
+
     # Extraction du jour, du mois et de l'année
     year_selected = [selected_date.year]
     month_selected = [selected_date.month]
@@ -173,16 +188,15 @@ with st.sidebar:
 
     # Titre de la section
     st.title("Selection de la résolution")
-    st.write(
-        "Une résolution basse correspond à de grands hexagones"
-    )
-    st.warning(
-        "Conseil : Les résolutions 4 et 5 sont les plus adaptées "
-    )
+    st.write("Une résolution basse correspond à de grands hexagones")
+    st.warning("Conseil : Les résolutions 4 et 5 sont les plus adaptées ")
     # Choix de la resolution parent
     resolution_parent = st.slider(
         "Choisissez une résolution hexagonale", min_value=1, max_value=15, value=4
     )
+
+    # Animation : maximum de chaque pas de temps au lieu du maximum de la période
+    animation_horaire = st.checkbox("Animation heure par heure")
     if resolution_parent > resolution_base:
         st.error(f"Erreur : La resolution doit être inférieure à {resolution_base}")
     else:  # Affichage de la surface en km² ou m² en fonction de la résolution
@@ -205,45 +219,110 @@ with st.sidebar:
                 f"Vous avez sélectionné la résolution {resolution_parent} d'une surface de {area_km2} m²"
             )
 
+    ### SECTION DEBUG ####
+
+    # Affichage des mesures de performance de chaque étape
+    mode_debug = st.checkbox("Afficher les mesures de performance (debug)")
+    if mode_debug:
+        # Mesure de la mémoire : ralentit tout le processus (toutes les sessions)
+        mesure_memoire = st.checkbox("Mesurer la mémoire de chaque étape (tracemalloc)")
+        if mesure_memoire and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not mesure_memoire and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
 #### TELECHARGEMENT DONNEES CLIMATIQUES ####
 
 # Selection des variables
 variables_selected = choix_variable(wind_selected)
 
-# Nom du fichier pour le téléchargement
-filename = name_file(
-    country_selected,
-    year_selected,
-    month_selected,
-    day_selected,
+# Requêtes d'extraction : une par mois, par variable et par tuile de la grille fixe sur la période
+requests = decoupage_requetes(
+    variables_selected,
+    selected_date,
+    date_fin,
     time_selected,
-    wind_selected,
-    version=1,
+    country_grid,
+    TAILLE_TUILE,
 )
+
+# Noms des fichiers pour le téléchargement (contiennent la clé de la requête complète)
+filenames = [
+    name_file(nom_tuile(request["area"]), wind_selected, request)
+    for request in requests
+]
 name_folder = (
     "wind_api_copernicus"  # Sous dossier dans lequel les fichiers .nc sont enregistrés
 )
+dossier_index = os.path.join(
+    name_folder, "index_h3"
+)  # Sous dossier dans lequel les index grille -> hexagones sont enregistrés
+dossier_hexagones = os.path.join(
+    name_folder, "hexagones"
+)  # Sous dossier dans lequel les hexagones agrégés sont enregistrés (cf batch.py)
+taille_max_cache = 5 * 1024**3  # Taille maximale du dossier de téléchargement (5 Go)
+conversion_zarr_active = False  # True -> fichiers téléchargés convertis en Zarr int16 compressé (nécessite zarr)
+
+resolutions_pyramide = range(
+    1, 9
+)  # Résolutions calculées en une passe (changement de résolution instantané)
+
+# Hexagones déjà agrégés : uniquement pour une période complète (toutes les heures)
+periode_complete = len(set(time_selected)) == 24
+if periode_complete:
+    nom_stocke = nom_hexagones(
+        country_selected, selected_date, nb_jours, wind_selected, resolution_parent
+    )
+else:
+    nom_stocke = None
 
 if st.button("Commencer le téléchargement"):
 
-    # Vérification de l'existence du fichier
-    if os.path.exists(os.path.join(name_folder, filename)):
+    # Vérification de l'existence des fichiers dans le cache
+    if all(fichier_en_cache(name_folder, filename) for filename in filenames):
         st.write("Le fichier existe déjà : ")
 
     else:
         st.write("Télechargement des données")
-        requete_api(
-            cdsapi_url,
-            cdsapi_key,
-            filename,
-            name_folder,
-            variables_selected,
-            year_selected,
-            month_selected,
-            day_selected,
-            time_selected,
-            country_grid,
-        )
+
+        # Ajout à la file d'attente : les téléchargements se font en arrière-plan
+        ajout_file_attente(name_folder, filenames, requests)
+
+# Jobs de la période pas encore terminés
+jobs = lecture_file_attente(name_folder)
+jobs_en_cours = {
+    filename: jobs[filename]
+    for filename in filenames
+    if filename in jobs and jobs[filename]["etat"] != "termine"
+}
+
+if jobs_en_cours:
+
+    # Démarrage des workers (une seule fois par processus, reprise des jobs interrompus)
+    demarrage_file_attente(
+        cdsapi_url,
+        cdsapi_key,
+        name_folder,
+        taille_max_cache,
+        conversion=conversion_zarr_active,
+    )
+
+    # Progression de chaque téléchargement
+    for filename, job in jobs_en_cours.items():
+        if job["etat"] == "echec":
+            st.error(f"Échec du téléchargement de {filename} : {job['erreur']}")
+        elif job["taille_totale"]:
+            st.progress(
+                min(job["octets"] / job["taille_totale"], 1.0),
+                text=f"{filename} : {job['octets'] / 1024**2:.1f} Mo",
+            )
+        else:
+            st.progress(
+                0.0,
+                text=f"{filename} : {job['etat']} (essai {job['tentatives'] + 1})",
+            )
+
+    st.button("Actualiser la progression")
 
 if st.button("Afficher la carte"):
     st.session_state.clear()  # Réinitialise tout le session_state
@@ -253,9 +332,21 @@ if st.button("Afficher la carte"):
 # Centre de la carte
 map_center_pt = map_center(country_grid)
 
-# Initialisation de la carte si elle n'existe pas encore dans session_state
-if "carte" not in st.session_state:
-    st.session_state.carte = folium.Map(location=map_center_pt, zoom_start=5)
+# Données différentes de celles en mémoire (pays, dates, heures, variable) -> réinitialisation
+# Le pays fait partie de la clé : des pays voisins partagent les mêmes tuiles (cf nom_tuile) mais pas le même masque
+cle_donnees = (country_selected, tuple(filenames), wind_selected)
+if st.session_state.get("cle_donnees") != cle_donnees:
+    for cle in [
+        "dataset",
+        "longitudes",
+        "latitudes",
+        "wind_mag",
+        "pyramide",
+        "carte",
+        "resolution_carte",
+    ]:
+        st.session_state.pop(cle, None)
+    st.session_state.cle_donnees = cle_donnees
 
 # Séparation côté légende et côté carte car problème de compatibilité html pour légende directement sur la carte
 legend_side, carte_side = st.columns([1, 3])
@@ -283,68 +374,228 @@ with legend_side:
 
 
 try:
-    if os.path.exists(os.path.join(name_folder, filename)):
+    if (
+        nom_stocke is not None
+        and os.path.exists(os.path.join(dossier_hexagones, nom_stocke))
+    ) or all(
+        os.path.exists(chemin_donnees(name_folder, filename)) for filename in filenames
+    ):
 
         with carte_side:
-            # Vérification si les données ont déjà été extraites et stockées dans session_state
-            if "dataset" not in st.session_state:
-
-                # Ouverture du fichier et extraction des données uniquement si cela n'a pas été fait auparavant
-                dataset = xr.open_dataset(os.path.join(name_folder, filename))
-
-                # Extraction de la longitude, latitude et magnitude de vent
-                longitudes, latitudes, wind_mag = traitement_data_wind(
-                    dataset, wind_selected
-                )
-
-                # Fermeture du fichier
-                dataset.close()
-
-                # Stocker les résultats dans session_state
-                st.session_state.dataset = dataset
-                st.session_state.longitudes = longitudes
-                st.session_state.latitudes = latitudes
-                st.session_state.wind_mag = wind_mag
-
-            else:
-                # Utiliser les données déjà extraites
-                longitudes = st.session_state.longitudes
-                latitudes = st.session_state.latitudes
-                wind_mag = st.session_state.wind_mag
-
-            # Vérification si les hexagones ont déjà été calculés et stockés dans session_state
-            if "hexagones" not in st.session_state:
-                # Calcul des hexagones uniquement si cela n'a pas été fait auparavant
-                hexagones = calcul_hexagone(
-                    latitudes, longitudes, wind_mag, resolution_base, resolution_parent
+            import folium
+            from streamlit_folium import st_folium
+
+            # Hexagones de chaque résolution déjà calculés pour ces données
+            if "pyramide" not in st.session_state:
+                st.session_state.pyramide = {}
+            pyramide = st.session_state.pyramide
+
+            # Hexagones déjà enregistrés (batch ou session précédente) -> lecture directe
+            if resolution_parent not in pyramide and nom_stocke is not None:
+                hexagones = lecture_hexagones(dossier_hexagones, nom_stocke)
+                if hexagones is not None:
+                    pyramide[resolution_parent] = hexagones
+
+            # Vérification si les hexagones ont déjà été calculés pour cette résolution
+            if resolution_parent not in pyramide:
+
+                # Vérification si les données ont déjà été extraites et stockées dans session_state
+                if "dataset" not in st.session_state:
+
+                    # Ouverture des fichiers de la période et extraction des données uniquement si cela n'a pas été fait auparavant
+                    dataset = ouverture_periode(name_folder, filenames, country_grid)
+
+                    # Extraction de la longitude, latitude et magnitude de vent
+                    longitudes, latitudes, wind_mag = traitement_data_wind(
+                        dataset, wind_selected
+                    )
+
+                    # Fermeture du fichier
+                    dataset.close()
+
+                    # Stocker les résultats dans session_state
+                    st.session_state.dataset = dataset
+                    st.session_state.longitudes = longitudes
+                    st.session_state.latitudes = latitudes
+                    st.session_state.wind_mag = wind_mag
+
+                else:
+                    # Utiliser les données déjà extraites
+                    longitudes = st.session_state.longitudes
+                    latitudes = st.session_state.latitudes
+                    wind_mag = st.session_state.wind_mag
+
+                # Seuls les points de la grille situés dans le pays sont traités
+                masque = masque_pays(
+                    latitudes,
+                    longitudes,
+                    country_selected,
+                    dossier_masques=dossier_index,
                 )
-                st.session_state.hexagones = hexagones
-            else:
-                hexagones = st.session_state.hexagones
-
-            # Vérifier si la carte a déjà été mise à jour avec les hexagones
-            if "carte_with_hexagons" not in st.session_state:
-                # Si la carte n'a pas encore été mise à jour avec les hexagones, on l'ajoute
-                st.session_state.carte = affichage_hexagones(
-                    st.session_state.carte, hexagones, wind_selected
-                )
-                st.session_state.carte_with_hexagons = (
-                    True  # Marquer que la carte a été mise à jour
+                if masque is None:
+                    st.info(
+                        "Frontières du pays indisponibles : tout le rectangle du pays est affiché"
+                    )
+
+                # Toutes les résolutions de la pyramide en une passe
+                if resolution_parent in resolutions_pyramide:
+                    niveaux = pyramide_hexagones(
+                        latitudes,
+                        longitudes,
+                        wind_mag,
+                        resolution_base,
+                        resolutions_pyramide,
+                        dossier_index,
+                        masque,
+                    )
+                    nouvelles_resolutions = [
+                        resolution
+                        for resolution in niveaux
+                        if resolution not in pyramide
+                    ]
+                    for resolution in nouvelles_resolutions:
+                        pyramide[resolution] = dictionnaire_hexagones(
+                            *niveaux[resolution]
+                        )
+
+                # Résolution fine hors pyramide : calcul direct
+                else:
+                    nouvelles_resolutions = [resolution_parent]
+                    pyramide[resolution_parent] = calcul_hexagone(
+                        latitudes,
+                        longitudes,
+                        wind_mag,
+                        resolution_base,
+                        resolution_parent,
+                        dossier_index,
+                        masque,
+                    )
+
+                # Enregistrement pour les prochaines sessions
+                if periode_complete:
+                    for resolution in nouvelles_resolutions:
+                        enregistrement_hexagones(
+                            dossier_hexagones,
+                            nom_hexagones(
+                                country_selected,
+                                selected_date,
+                                nb_jours,
+                                wind_selected,
+                                resolution,
+                            ),
+                            pyramide[resolution],
+                        )
+
+            hexagones = pyramide[resolution_parent]
+
+            # L'animation est calculée à partir des fichiers téléchargés ou de leurs magasins Zarr (absents si seuls les hexagones sont enregistrés)
+            animation = animation_horaire and all(
+                os.path.exists(chemin_donnees(name_folder, filename))
+                for filename in filenames
+            )
+            if animation_horaire and not animation:
+                st.warning(
+                    "Animation indisponible : les fichiers de la période ne sont pas téléchargés"
                 )
 
+            # Carte reconstruite uniquement si la résolution affichée ou le mode change
+            if st.session_state.get("resolution_carte") != (
+                resolution_parent,
+                animation,
+            ):
+                if animation:
+                    # Maximum par hexagone de chaque pas de temps, une seule couche d'hexagones
+                    with ouverture_periode(
+                        name_folder, filenames, country_grid
+                    ) as dataset:
+                        temps, hexagones_horaires, maxima_horaires = (
+                            calcul_hexagone_horaire(
+                                dataset,
+                                wind_selected,
+                                resolution_base,
+                                resolution_parent,
+                                dossier_index,
+                                masque=masque_pays(
+                                    dataset["latitude"].values,
+                                    dataset["longitude"].values,
+                                    country_selected,
+                                    dossier_masques=dossier_index,
+                                ),
+                            )
+                        )
+                    st.session_state.carte = affichage_hexagones_horaire(
+                        folium.Map(location=map_center_pt, zoom_start=5),
+                        hexagones_horaires,
+                        maxima_horaires,
+                        temps,
+                        wind_selected,
+                    )
+                else:
+                    st.session_state.carte = affichage_hexagones(
+                        folium.Map(location=map_center_pt, zoom_start=5),
+                        hexagones,
+                        wind_selected,
+                    )
+                st.session_state.resolution_carte = (resolution_parent, animation)
+
             # Titre de la carte
             title_carte = titre_carte(
-                wind_selected, country_selected, day_selected, month_selected, year_selected
+                wind_selected,
+                country_selected,
+                day_selected,
+                month_selected,
+                year_selected,
             )
             st.markdown(title_carte, unsafe_allow_html=True)
 
             # Affichage de la carte
-            st_folium(st.session_state.carte, width=600, height=550)
+            with suivi_etape("st_folium", hexagones=len(hexagones)):
+                st_folium(st.session_state.carte, width=600, height=550)
 
     else:
         st.warning("Pour afficher la carte cliquez sur commencer le téléchargement")
 
-except FileNotFoundError:
-    print("Erreur : Le fichier est introuvable.")
+except FileNotFoundError as e:
+    st.error("Erreur : Le fichier est introuvable.")
+    journal_erreur("visualisation", e)
 except Exception as e:
-    print("Une erreur s'est produite :", e)
+    st.error(f"Une erreur s'est produite : {e}")
+    journal_erreur("visualisation", e)
+
+#### MESURES DE PERFORMANCE ####
+
+if mode_debug:
+    # Mesures des dernières exécutions du script (la plus récente en premier)
+    historique = st.session_state.setdefault("historique_mesures", [])
+    historique.extend(mesures)
+    del historique[:-200]
+
+    with st.expander("Mesures de performance", expanded=True):
+        colonnes = ["etape", "parent", "duree_s", "pic_memoire_mo", "rss_max_mo"]
+        st.dataframe(
+            pd.DataFrame(historique[::-1]).pipe(
+                lambda data: data[
+                    [colonne for colonne in colonnes if colonne in data]
+                    + [colonne for colonne in data if colonne not in colonnes]
+                ]
+            ),
+            hide_index=True,
+        )
+
+        # Temps d'attente côté API et de téléchargement des fichiers de la période
+        jobs_periode = {
+            filename: jobs[filename] for filename in filenames if filename in jobs
+        }
+        if jobs_periode:
+            st.dataframe(
+                pd.DataFrame.from_dict(jobs_periode, orient="index").reindex(
+                    columns=[
+                        "etat",
+                        "tentatives",
+                        "duree_attente",
+                        "duree_telechargement",
+                        "octets",
+                        "erreur",
+                    ]
+                )
+            )
@@ -0,0 +1,601 @@
+"""
+Serveur local imitant l'API CDS de Copernicus (tests hors ligne et tests de charge)
+
+Le serveur implémente le protocole utilisé par cdsapi (soumission, suivi du job, résultat, téléchargement avec reprise)
+et renvoie des fichiers NetCDF synthétiques pour les variables, la zone, les jours et les heures demandés. Le délai
+d'attente dans la file, la durée de traitement, le nombre de jobs traités simultanément et les erreurs (jobs en échec,
+téléchargements interrompus) sont paramétrables.
+
+Exemples :
+    python serveur_cds.py --port 8765 --delai-file 5 --duree-traitement 2 --taux-echec 0.1
+    CDSAPI_URL=http://127.0.0.1:8765/api CDSAPI_KEY=cle-locale streamlit run main.py
+    python serveur_cds.py --charge 100 --nb-workers 8 --capacite 4 --taux-coupure 0.2
+"""
+
+#### SECTION IMPORT DE LIBRAIRIES ####
+import argparse
+import functools
+import http.server
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+import cdsapi
+import numpy as np
+
+from benchmark import dataset_synthetique
+from functions import *
+
+
+def grille_requete(request):
+    """
+    Objectif : Déterminer la zone (alignée sur la grille ERA5 de 0.25°) et les jours couverts par une requête
+
+    Paramètres :
+        request : Requête d'extraction (cf requete_cds)
+
+    Renvoie la zone [nord, ouest, sud, est] et la liste des jours (les dates inexistantes sont ignorées)
+    """
+
+    nord, ouest, sud, est = [float(coordonnee) for coordonnee in request["area"]]
+    area = [
+        np.floor(nord * 4) / 4,
+        np.ceil(ouest * 4) / 4,
+        np.ceil(sud * 4) / 4,
+        np.floor(est * 4) / 4,
+    ]
+
+    dates = []
+    for annee in request["year"]:
+        for mois in request["month"]:
+            for jour in request["day"]:
+                try:
+                    dates.append(date(int(annee), int(mois), int(jour)))
+                except ValueError:
+                    continue
+
+    return area, sorted(dates)
+
+
+def horodatage(instant):
+    """
+    Objectif : Convertir un instant (time.time) au format de date de l'API
+    """
+
+    return datetime.fromtimestamp(instant, timezone.utc).isoformat()
+
+
+def mise_a_jour_etats(serveur):
+    """
+    Objectif :
+        Faire avancer les jobs : accepted -> running (après le délai de file, dans la limite de la capacité)
+        -> successful ou failed (après la durée de traitement)
+
+    Paramètres :
+        serveur : Serveur (cf demarrage_serveur)
+    """
+
+    parametres = serveur.parametres
+    maintenant = time.time()
+
+    with serveur.verrou:
+        en_cours = sum(job["status"] == "running" for job in serveur.jobs.values())
+
+        for job in serveur.jobs.values():
+            # Fin du traitement
+            if (
+                job["status"] == "running"
+                and maintenant >= job["debut"] + parametres["duree_traitement"]
+            ):
+                job["status"] = "failed" if job["echec"] else "successful"
+                job["fin"] = maintenant
+                en_cours -= 1
+
+        # Jobs dans l'ordre de soumission
+        for job in sorted(serveur.jobs.values(), key=lambda job: job["cree"]):
+            if job["status"] != "accepted":
+                continue
+            if maintenant < job["cree"] + parametres["delai_file"]:
+                continue
+            if (
+                parametres["capacite"] is not None
+                and en_cours >= parametres["capacite"]
+            ):
+                break
+            job["status"] = "running"
+            job["debut"] = maintenant
+            en_cours += 1
+
+
+def description_job(serveur, job):
+    """
+    Objectif : Construire la réponse de suivi d'un job (format de l'API)
+
+    Paramètres :
+        serveur : Serveur (cf demarrage_serveur)
+        job : Job du serveur
+    """
+
+    lien_job = f"{serveur.url}/retrieve/v1/jobs/{job['id']}"
+
+    return {
+        "jobID": job["id"],
+        "processID": job["dataset"],
+        "type": "process",
+        "status": job["status"],
+        "created": horodatage(job["cree"]),
+        "updated": horodatage(time.time()),
+        "metadata": {"request": {"ids": job["requete"]}},
+        "links": [
+            {"rel": "self", "href": lien_job},
+            {"rel": "monitor", "href": lien_job},
+            {"rel": "results", "href": f"{lien_job}/results"},
+        ],
+    }
+
+
+class GestionnaireCDS(http.server.BaseHTTPRequestHandler):
+    """
+    Objectif : Répondre aux appels HTTP de cdsapi (un thread par requête, cf ThreadingHTTPServer)
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Journal des requêtes uniquement en mode bavard
+        if self.server.parametres["bavard"]:
+            super().log_message(format, *args)
+
+    def envoi_json(self, contenu, code=200):
+        """
+        Objectif : Envoyer une réponse JSON
+        """
+
+        corps = json.dumps(contenu).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corps)))
+        self.end_headers()
+        self.wfile.write(corps)
+
+    def envoi_erreur(self, code, titre, detail=""):
+        """
+        Objectif : Envoyer une erreur au format de l'API (titre et détail affichés par cdsapi)
+        """
+
+        self.envoi_json({"type": "error", "title": titre, "detail": detail}, code)
+
+    def do_GET(self):
+        serveur = self.server
+        chemin = self.path.split("?")[0].rstrip("/")
+
+        if not chemin.startswith("/api/"):
+            return self.envoi_erreur(404, "Not found")
+        morceaux = chemin[len("/api/") :].split("/")
+
+        # Messages du catalogue (lus à la création du client)
+        if morceaux == ["catalogue", "v1", "messages"]:
+            return self.envoi_json({"messages": []})
+
+        # Téléchargement du fichier résultat (sans clé, comme l'API)
+        if morceaux[0] == "download" and len(morceaux) == 2:
+            return self.envoi_fichier(morceaux[1].removesuffix(".nc"))
+
+        if self.headers.get("PRIVATE-TOKEN") is None:
+            return self.envoi_erreur(401, "Authentication failed", "Clé manquante")
+
+        # Description d'un dataset
+        if morceaux[:3] == ["retrieve", "v1", "processes"] and len(morceaux) == 4:
+            if morceaux[3] != DATASET_ERA5:
+                return self.envoi_erreur(404, "Process not found", morceaux[3])
+            return self.envoi_json({"id": morceaux[3], "links": []})
+
+        # Suivi d'un job et résultat
+        if morceaux[:3] == ["retrieve", "v1", "jobs"] and len(morceaux) in (4, 5):
+            mise_a_jour_etats(serveur)
+            with serveur.verrou:
+                job = serveur.jobs.get(morceaux[3])
+                if job is None:
+                    return self.envoi_erreur(404, "Job not found", morceaux[3])
+                description = description_job(serveur, job)
+
+            if len(morceaux) == 4:
+                return self.envoi_json(description)
+
+            if morceaux[4] != "results":
+                return self.envoi_erreur(404, "Not found")
+            if job["status"] == "failed":
+                return self.envoi_erreur(
+                    400, "The job has failed", "Échec simulé par le serveur local"
+                )
+            if job["status"] != "successful":
+                return self.envoi_erreur(404, "Results not ready", job["status"])
+            return self.envoi_json(
+                {
+                    "asset": {
+                        "value": {
+                            "type": "application/netcdf",
+                            "href": f"{serveur.url}/download/{job['id']}.nc",
+                            "file:size": os.path.getsize(job["chemin"]),
+                        }
+                    }
+                }
+            )
+
+        return self.envoi_erreur(404, "Not found")
+
+    def do_POST(self):
+        serveur = self.server
+        chemin = self.path.split("?")[0].rstrip("/")
+        morceaux = chemin.removeprefix("/api/").split("/")
+
+        # Soumission d'une requête : /retrieve/v1/processes/{dataset}/execution
+        if not (
+            morceaux[:3] == ["retrieve", "v1", "processes"]
+            and len(morceaux) == 5
+            and morceaux[4] == "execution"
+        ):
+            return self.envoi_erreur(404, "Not found")
+        if self.headers.get("PRIVATE-TOKEN") is None:
+            return self.envoi_erreur(401, "Authentication failed", "Clé manquante")
+        if morceaux[3] != DATASET_ERA5:
+            return self.envoi_erreur(404, "Process not found", morceaux[3])
+
+        longueur = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(longueur) or b"{}").get("inputs", {})
+
+        variables_inconnues = set(request.get("variable", [])) - set(VARIABLES_NETCDF)
+        if variables_inconnues:
+            return self.envoi_erreur(
+                400, "Invalid request", f"Variables inconnues : {variables_inconnues}"
+            )
+
+        # Données synthétiques générées à la soumission (le téléchargement ne fait que les envoyer)
+        job_id = str(uuid.uuid4())
+        chemin_job = os.path.join(serveur.dossier, job_id + ".nc")
+        area, dates = grille_requete(request)
+        dataset_synthetique(
+            area,
+            dates,
+            request["time"],
+            request["variable"],
+            graine=serveur.aleatoire.randrange(2**32),
+        ).to_netcdf(chemin_job)
+
+        with serveur.verrou:
+            job = {
+                "id": job_id,
+                "dataset": morceaux[3],
+                "requete": request,
+                "status": "accepted",
+                "cree": time.time(),
+                "debut": None,
+                "fin": None,
+                "chemin": chemin_job,
+                "echec": serveur.aleatoire.random() < serveur.parametres["taux_echec"],
+                "coupure": serveur.aleatoire.random()
+                < serveur.parametres["taux_coupure"],
+            }
+            serveur.jobs[job_id] = job
+            serveur.statistiques["soumissions"] += 1
+            serveur.statistiques["echecs"] += job["echec"]
+            description = description_job(serveur, job)
+
+        self.envoi_json(description, 201)
+
+    def envoi_fichier(self, job_id):
+        """
+        Objectif : Envoyer le fichier d'un job (en-tête Range supporté, coupure simulée de la connexion)
+
+        Paramètres :
+            job_id : Identifiant du job
+        """
+
+        serveur = self.server
+        with serveur.verrou:
+            job = serveur.jobs.get(job_id)
+            if job is None or job["status"] != "successful":
+                return self.envoi_erreur(404, "Not found", job_id)
+
+            # Coupure uniquement au premier téléchargement du job
+            coupure = job["coupure"]
+            job["coupure"] = False
+
+        with open(job["chemin"], "rb") as fichier:
+            contenu = fichier.read()
+        taille = len(contenu)
+
+        # Reprise : "bytes=debut-"
+        debut = 0
+        plage = self.headers.get("Range")
+        if plage is not None and plage.startswith("bytes="):
+            debut = int(plage[len("bytes=") :].split("-")[0] or 0)
+            if debut >= taille:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{taille}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {debut}-{taille - 1}/{taille}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", "application/netcdf")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(taille - debut))
+        self.end_headers()
+
+        # Connexion coupée à la moitié du fichier
+        fin = debut + (taille - debut) // 2 if coupure else taille
+        self.wfile.write(contenu[debut:fin])
+        with serveur.verrou:
+            serveur.statistiques["octets"] += fin - debut
+            serveur.statistiques["coupures"] += coupure
+        if coupure:
+            self.close_connection = True
+
+
+def demarrage_serveur(
+    port=0,
+    delai_file=0.0,
+    duree_traitement=0.0,
+    capacite=None,
+    taux_echec=0.0,
+    taux_coupure=0.0,
+    graine=0,
+    bavard=False,
+):
+    """
+    Objectif : Démarrer le serveur local dans un thread en arrière-plan
+
+    Paramètres :
+        port : Port d'écoute (0 -> port libre choisi par le système)
+        delai_file : Temps passé par chaque job dans la file (état accepted) en secondes
+        duree_traitement : Temps de traitement de chaque job (état running) en secondes
+        capacite : Nombre de jobs traités simultanément (None -> pas de limite)
+        taux_echec : Proportion des jobs qui se terminent en échec
+        taux_coupure : Proportion des téléchargements coupés à la moitié du fichier
+        graine : Graine du générateur aléatoire (erreurs et données reproductibles)
+        bavard : Afficher chaque requête HTTP reçue
+
+    Renvoie le serveur (adresse de l'API dans serveur.url, arrêt avec serveur.shutdown())
+    """
+
+    serveur = http.server.ThreadingHTTPServer(("127.0.0.1", port), GestionnaireCDS)
+    serveur.daemon_threads = True
+    serveur.url = f"http://127.0.0.1:{serveur.server_address[1]}/api"
+    serveur.parametres = {
+        "delai_file": delai_file,
+        "duree_traitement": duree_traitement,
+        "capacite": capacite,
+        "taux_echec": taux_echec,
+        "taux_coupure": taux_coupure,
+        "bavard": bavard,
+    }
+    serveur.jobs = {}
+    serveur.verrou = threading.Lock()
+    serveur.aleatoire = random.Random(graine)
+    serveur.statistiques = {"soumissions": 0, "echecs": 0, "coupures": 0, "octets": 0}
+    serveur.dossier = tempfile.mkdtemp(prefix="serveur_cds_")
+
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+
+    return serveur
+
+
+def arret_serveur(serveur):
+    """
+    Objectif : Arrêter le serveur et supprimer les fichiers générés
+    """
+
+    serveur.shutdown()
+    serveur.server_close()
+    shutil.rmtree(serveur.dossier, ignore_errors=True)
+
+
+def test_charge(
+    serveur, nb_requetes, nb_workers, nb_jours=1, delai_base=1, fabrique_client=None
+):
+    """
+    Objectif :
+        Mesurer le débit de bout en bout de la file d'attente de téléchargement (soumission, attente, téléchargement,
+        enregistrement en cache) sur des requêtes distinctes (pays x jours)
+
+    Paramètres :
+        serveur : Serveur (cf demarrage_serveur)
+        nb_requetes : Nombre de requêtes envoyées
+        nb_workers : Nombre de téléchargements simultanés
+        nb_jours : Nombre de jours de chaque requête
+        delai_base : Délai avant le 2ème essai d'un job en échec en secondes
+        fabrique_client : Fonction (url, key) -> client de l'API (None -> cdsapi.Client)
+
+    Renvoie un dictionnaire de statistiques
+    """
+
+    name_folder = tempfile.mkdtemp(prefix="charge_cds_")
+    hours = [f"{heure:02d}:00" for heure in range(24)]
+    grilles_pays = index_pays("Pays_grille.xlsx")
+    pays = sorted(grilles_pays)
+
+    # Requêtes distinctes : pays différents puis jours différents
+    filenames, requests = [], []
+    for numero in range(nb_requetes):
+        country_selected = pays[numero % len(pays)]
+        date_debut = date(2020, 1, 1) + timedelta(days=nb_jours * (numero // len(pays)))
+        date_fin = date_debut + timedelta(days=nb_jours - 1)
+        for request in decoupage_requetes(
+            choix_variable("rafale"),
+            date_debut,
+            date_fin,
+            hours,
+            grilles_pays[country_selected],
+        ):
+            requests.append(request)
+            filenames.append(name_file(country_selected, "rafale", request))
+
+    try:
+        debut = time.time()
+        ajout_file_attente(name_folder, filenames, requests)
+        arret = demarrage_file_attente(
+            serveur.url,
+            "cle-locale",
+            name_folder,
+            fabrique_client=fabrique_client,
+            nb_workers=nb_workers,
+            delai_base=delai_base,
+            delai_max=30,
+        )
+        while True:
+            jobs = lecture_file_attente(name_folder)
+            if all(job["etat"] in ("termine", "echec") for job in jobs.values()):
+                break
+            time.sleep(0.2)
+        duree = time.time() - debut
+        arret.set()
+
+        # Fichiers NetCDF ou magasins Zarr s'ils ont été convertis (cf chemin_donnees)
+        taille = sum(
+            taille_donnees(chemin_donnees(name_folder, filename))
+            for filename in filenames
+            if os.path.exists(chemin_donnees(name_folder, filename))
+        )
+        termines = sum(job["etat"] == "termine" for job in jobs.values())
+
+        return {
+            "requetes": len(filenames),
+            "termines": termines,
+            "echecs": len(filenames) - termines,
+            "nouveaux_essais": sum(job["tentatives"] for job in jobs.values()),
+            "duree (s)": round(duree, 2),
+            "requetes/s": round(termines / duree, 2),
+            "Mo/s": round(taille / 1024**2 / duree, 2),
+            **{
+                f"serveur_{cle}": valeur for cle, valeur in serveur.statistiques.items()
+            },
+        }
+
+    finally:
+        shutil.rmtree(name_folder, ignore_errors=True)
+
+
+def arguments():
+    """
+    Objectif : Lire les arguments de la ligne de commande
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Serveur local imitant l'API CDS (tests hors ligne et tests de charge)"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port d'écoute")
+    parser.add_argument(
+        "--delai-file",
+        type=float,
+        default=0.0,
+        help="Temps passé par chaque job dans la file en secondes",
+    )
+    parser.add_argument(
+        "--duree-traitement",
+        type=float,
+        default=0.0,
+        help="Temps de traitement de chaque job en secondes",
+    )
+    parser.add_argument(
+        "--capacite",
+        type=int,
+        default=None,
+        help="Nombre de jobs traités simultanément (par défaut sans limite)",
+    )
+    parser.add_argument(
+        "--taux-echec",
+        type=float,
+        default=0.0,
+        help="Proportion des jobs qui se terminent en échec",
+    )
+    parser.add_argument(
+        "--taux-coupure",
+        type=float,
+        default=0.0,
+        help="Proportion des téléchargements coupés à la moitié du fichier",
+    )
+    parser.add_argument("--graine", type=int, default=0, help="Graine aléatoire")
+    parser.add_argument(
+        "--bavard", action="store_true", help="Afficher chaque requête HTTP"
+    )
+    parser.add_argument(
+        "--charge",
+        type=int,
+        default=None,
+        help="Test de charge : nombre de requêtes envoyées au serveur (puis arrêt)",
+    )
+    parser.add_argument(
+        "--nb-workers",
+        type=int,
+        default=4,
+        help="Test de charge : nombre de téléchargements simultanés",
+    )
+    parser.add_argument(
+        "--nb-jours",
+        type=int,
+        default=1,
+        help="Test de charge : nombre de jours de chaque requête",
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    """
+    Objectif : Démarrer le serveur (ou réaliser un test de charge)
+    """
+
+    args = arguments()
+    serveur = demarrage_serveur(
+        0 if args.charge is not None else args.port,
+        args.delai_file,
+        args.duree_traitement,
+        args.capacite,
+        args.taux_echec,
+        args.taux_coupure,
+        args.graine,
+        args.bavard,
+    )
+
+    try:
+        if args.charge is not None:
+            # Client sans journal ni barre de progression (un message par requête sinon)
+            statistiques = test_charge(
+                serveur,
+                args.charge,
+                args.nb_workers,
+                args.nb_jours,
+                fabrique_client=functools.partial(
+                    cdsapi.Client, quiet=True, progress=False
+                ),
+            )
+            for cle, valeur in statistiques.items():
+                print(f"{cle:<22} {valeur}")
+            return
+
+        print(f"Serveur CDS local : {serveur.url}")
+        print(
+            f"    CDSAPI_URL={serveur.url} CDSAPI_KEY=cle-locale streamlit run main.py"
+        )
+        while True:
+            time.sleep(3600)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        arret_serveur(serveur)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Statistiques des valeurs extrêmes du vent par hexagone h3 (maxima annuels et niveaux de retour)
+
+Les maxima annuels sont calculés pour chaque hexagone à partir de la magnitude du vent (ou des maxima journaliers écrits
+par maxima_hors_memoire), puis une loi de Gumbel ou une loi GEV est ajustée par la méthode des L-moments pour tous les
+hexagones à la fois (calcul vectorisé, sans boucle par hexagone). Les niveaux de retour obtenus (vent atteint en moyenne
+une fois tous les T ans) forment des couches d'hexagones affichables par affichage_hexagones.
+
+Exemple :
+    python statistiques.py --maxima wind_api_copernicus/maxima --choix rafale --periodes 10 50 100 --resolution 5
+"""
+
+#### SECTION IMPORT DE LIBRAIRIES ####
+import argparse
+import os
+
+import numpy as np
+
+from functions import (
+    affichage_hexagones,
+    details_etape,
+    dictionnaire_hexagones,
+    etape_suivie,
+    index_hexagones,
+    lecture_maxima,
+    legende_carte,
+)
+
+# Constante d'Euler-Mascheroni (moyenne de la loi de Gumbel réduite)
+EULER = 0.5772156649015329
+
+# En dessous de cette valeur du paramètre de forme, la loi GEV est remplacée par sa limite de Gumbel
+FORME_GUMBEL = 1e-6
+
+
+def maxima_annuels_hexagones(wind, index, couverture_min=0.9):
+    """
+    Objectif :
+        Calculer le maximum annuel du vent de chaque hexagone (maxima par blocs d'un an)
+
+    Paramètres :
+        wind : DataArray xarray (valid_time, latitude, longitude) de la magnitude du vent ou de ses maxima journaliers
+        index : Hexagones, ordre et débuts de groupes renvoyés par index_hexagones
+        couverture_min : Part minimale de pas de temps d'une année, rapportée à l'année la plus complète (années partielles écartées)
+
+    Renvoie les années retenues, les hexagones (uint64) et la matrice des maxima annuels (années x hexagones)
+    """
+
+    hexagones, ordre, debuts = index
+
+    # Années trop incomplètes (début ou fin de période) : maximum sous-estimé
+    annees_temps = wind["valid_time"].to_index().year
+    annees, nb_pas = np.unique(annees_temps, return_counts=True)
+    annees = annees[nb_pas >= couverture_min * nb_pas.max()]
+    wind = wind.isel(valid_time=np.isin(annees_temps, annees))
+
+    # Maximum annuel de chaque point de grille (calcul différé si les données sont découpées en blocs dask)
+    # Regroupement par année et non resample : une année écartée en milieu de période ne revient pas en ligne vide
+    annuels = (
+        wind.groupby("valid_time.year")
+        .max(skipna=True)
+        .sel(year=annees)
+        .transpose("year", "latitude", "longitude")
+        .values.astype(np.float32, copy=False)
+    )
+
+    # Maximum annuel de chaque hexagone : réduction groupée sur tous les hexagones et toutes les années à la fois
+    maxima = np.fmax.reduceat(
+        annuels.reshape(len(annuels), -1)[:, ordre], debuts, axis=1
+    )
+
+    return annees, np.asarray(hexagones), maxima
+
+
+def moments_l(echantillons):
+    """
+    Objectif :
+        Calculer les trois premiers L-moments de chaque colonne (moments pondérés de probabilité sans biais)
+
+    Paramètres :
+        echantillons : Matrice (observations x séries), par exemple les maxima annuels de chaque hexagone
+
+    Renvoie l1 (moyenne), l2 (L-échelle) et t3 (L-asymétrie) de chaque série.
+    Une série avec une valeur manquante donne des L-moments manquants
+    """
+
+    valeurs = np.sort(np.asarray(echantillons, dtype=np.float64), axis=0)
+    n = valeurs.shape[0]
+    if n < 3:
+        raise ValueError(
+            f"Erreur : au moins 3 maxima annuels sont nécessaires ({n} disponibles)."
+        )
+
+    # Rang (0 à n-1) de chaque observation triée
+    rang = np.arange(n, dtype=np.float64)[:, None]
+
+    b0 = valeurs.mean(axis=0)
+    b1 = (rang / (n - 1) * valeurs).mean(axis=0)
+    b2 = (rang * (rang - 1) / ((n - 1) * (n - 2)) * valeurs).mean(axis=0)
+
+    l1 = b0
+    l2 = 2 * b1 - b0
+    l3 = 6 * b2 - 6 * b1 + b0
+
+    # Série constante : asymétrie non définie
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t3 = l3 / l2
+
+    return l1, l2, t3
+
+
+def ajustement_gumbel(maxima):
+    """
+    Objectif : Ajuster une loi de Gumbel à chaque colonne par la méthode des L-moments
+
+    Paramètres :
+        maxima : Matrice des maxima annuels (années x hexagones)
+
+    Renvoie la position et l'échelle de chaque loi
+    """
+
+    l1, l2, _ = moments_l(maxima)
+    echelle = l2 / np.log(2)
+    position = l1 - EULER * echelle
+
+    return position, echelle
+
+
+def ajustement_gev(maxima):
+    """
+    Objectif : Ajuster une loi GEV à chaque colonne par la méthode des L-moments (approximation de Hosking)
+
+    Paramètres :
+        maxima : Matrice des maxima annuels (années x hexagones)
+
+    Renvoie la position, l'échelle et la forme k de chaque loi (k > 0 : queue bornée, k < 0 : queue lourde, convention de Hosking)
+    """
+
+    from scipy.special import gamma
+
+    l1, l2, t3 = moments_l(maxima)
+
+    c = 2 / (3 + t3) - np.log(2) / np.log(3)
+    forme = 7.8590 * c + 2.9554 * c**2
+
+    # Limite k -> 0 : loi de Gumbel
+    gumbel = np.abs(forme) < FORME_GUMBEL
+    k = np.where(gumbel, 1.0, forme)
+    gamma_k = gamma(1 + k)
+    echelle = np.where(gumbel, l2 / np.log(2), l2 * k / ((1 - 2 ** (-k)) * gamma_k))
+    position = np.where(gumbel, l1 - EULER * echelle, l1 - echelle * (1 - gamma_k) / k)
+
+    return position, echelle, np.where(gumbel, 0.0, forme)
+
+
+def niveaux_retour(maxima, periodes=(10, 50, 100), loi="gev"):
+    """
+    Objectif :
+        Calculer les niveaux de retour de chaque colonne : vent dépassé en moyenne une fois tous les T ans
+
+    Paramètres :
+        maxima : Matrice des maxima annuels (années x hexagones)
+        periodes : Périodes de retour T en années (> 1)
+        loi : "gev" ou "gumbel"
+
+    Renvoie une matrice (périodes x hexagones)
+    """
+
+    periodes = np.asarray(periodes, dtype=np.float64)
+    if np.any(periodes <= 1):
+        raise ValueError("Erreur : les périodes de retour doivent dépasser 1 an.")
+
+    # Variable réduite -ln(1 - 1/T) de chaque période
+    reduite = -np.log(1 - 1 / periodes)[:, None]
+
+    if loi == "gumbel":
+        position, echelle = ajustement_gumbel(maxima)
+        return position - echelle * np.log(reduite)
+
+    elif loi == "gev":
+        position, echelle, forme = ajustement_gev(maxima)
+        gumbel = forme == 0
+        k = np.where(gumbel, 1.0, forme)
+        return np.where(
+            gumbel,
+            position - echelle * np.log(reduite),
+            position + echelle / k * (1 - reduite**k),
+        )
+
+    else:
+        raise ValueError("Erreur : loi non reconnue. Utilisez 'gev' ou 'gumbel'.")
+
+
+@etape_suivie("niveaux_retour_hexagones")
+def niveaux_retour_hexagones(
+    wind,
+    resolution_base,
+    resolution_parent,
+    periodes=(10, 50, 100),
+    loi="gev",
+    dossier_index=None,
+    couverture_min=0.9,
+    masque=None,
+):
+    """
+    Objectif :
+        Calculer pour chaque période de retour la couche d'hexagones h3 des niveaux de retour du vent (affichable par affichage_hexagones)
+
+    Paramètres :
+        wind : DataArray xarray (valid_time, latitude, longitude) de la magnitude du vent ou de ses maxima journaliers (km/h)
+        resolution_base : Résolution h3 à laquelle chaque point est converti
+        resolution_parent : Résolution h3 des hexagones
+        periodes : Périodes de retour T en années
+        loi : "gev" ou "gumbel"
+        dossier_index : Dossier où l'index grille -> hexagones est conservé (cf index_hexagones)
+        couverture_min : Part minimale de pas de temps d'une année (cf maxima_annuels_hexagones)
+        masque : Matrice booléenne des points à traiter (cf masque_pays, None -> tous les points)
+
+    Renvoie un dictionnaire période -> {hexagone: niveau de retour}. Les hexagones sans ajustement possible sont écartés
+    """
+
+    index = index_hexagones(
+        wind["latitude"].values,
+        wind["longitude"].values,
+        resolution_base,
+        resolution_parent,
+        dossier_index,
+        masque,
+    )
+    annees, hexagones, maxima = maxima_annuels_hexagones(wind, index, couverture_min)
+    niveaux = niveaux_retour(maxima, periodes, loi).astype(np.float32)
+    details_etape(
+        annees=len(annees), hexagones=len(hexagones), loi=loi, periodes=list(periodes)
+    )
+
+    couches = {}
+    for periode, niveaux_periode in zip(periodes, niveaux):
+        valides = np.isfinite(niveaux_periode)
+        couches[periode] = dictionnaire_hexagones(
+            hexagones[valides], niveaux_periode[valides]
+        )
+
+    return couches
+
+
+def main():
+    """
+    Objectif : Carte HTML des niveaux de retour à partir des maxima journaliers écrits par maxima_hors_memoire
+    """
+
+    parser = argparse.ArgumentParser(
+        description="Niveaux de retour du vent par hexagone h3"
+    )
+    parser.add_argument(
+        "--maxima",
+        default=os.path.join("wind_api_copernicus", "maxima"),
+        help="Dossier des maxima journaliers (cf maxima_hors_memoire)",
+    )
+    parser.add_argument(
+        "--grille",
+        default=None,
+        help="Sous-dossier grille_... des maxima (par défaut la seule grille disponible)",
+    )
+    parser.add_argument(
+        "--choix",
+        default="rafale",
+        choices=["rafale", "soutenu_10m", "soutenu_100m"],
+        help="Variable de vent",
+    )
+    parser.add_argument(
+        "--periodes",
+        nargs="+",
+        type=int,
+        default=[10, 50, 100],
+        help="Périodes de retour en années",
+    )
+    parser.add_argument(
+        "--loi", default="gev", choices=["gev", "gumbel"], help="Loi ajustée"
+    )
+    parser.add_argument(
+        "--resolution", type=int, default=5, help="Résolution h3 des hexagones"
+    )
+    parser.add_argument(
+        "--sortie", default="niveaux_retour.html", help="Fichier HTML de la carte"
+    )
+    args = parser.parse_args()
+
+    import folium
+
+    wind = lecture_maxima(args.maxima, args.choix, grille=args.grille)
+    couches = niveaux_retour_hexagones(
+        wind,
+        15,
+        args.resolution,
+        args.periodes,
+        args.loi,
+        os.path.join("wind_api_copernicus", "index_h3"),
+    )
+
+    # Une couche par période de retour, au choix dans le contrôle des couches
+    carte = folium.Map(
+        location=[
+            float(wind["latitude"].mean()),
+            float(wind["longitude"].mean()),
+        ],
+        zoom_start=5,
+    )
+    for numero, (periode, hexagones) in enumerate(couches.items()):
+        couche = folium.FeatureGroup(
+            name=f"Retour {periode} ans ({args.loi})", overlay=False, show=numero == 0
+        )
+        affichage_hexagones(couche, hexagones, args.choix).add_to(carte)
+    folium.LayerControl(collapsed=False).add_to(carte)
+    carte.get_root().html.add_child(folium.Element(legende_carte(args.choix)))
+
+    carte.save(args.sortie)
+    print(f"Carte des niveaux de retour enregistrée : {args.sortie}")
+
+
+if __name__ == "__main__":
+    main()